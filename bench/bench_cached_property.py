@@ -0,0 +1,87 @@
+# cached_property under contention: many threads reading lazy properties of
+# fresh objects, as threaded servers do with per-request objects. The locking
+# implementation tackle used before is included for comparison.
+
+from tackle.util import cached_property, slot_cached_property
+
+from runner import report
+
+import time
+import threading
+
+THREADS = 32
+OBJECTS = 2000
+
+
+class locked_cached_property(object):
+    """ cached_property as it was, with one lock per property. """
+
+    def __init__(self, func):
+        self.__name__ = func.__name__
+        self.func = func
+        self.lock = threading.RLock()
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self
+        with self.lock:
+            value = obj.__dict__.get(self.__name__, self)
+            if value is self:
+                value = obj.__dict__[self.__name__] = self.func(obj)
+            return value
+
+
+class Locked(object):
+
+    @locked_cached_property
+    def value(self):
+        return 42
+
+
+class LockFree(object):
+
+    @cached_property
+    def value(self):
+        return 42
+
+
+class Slotted(object):
+
+    __slots__ = ('_value',)
+
+    @slot_cached_property
+    def value(self):
+        return 42
+
+
+def contended(klass, threads = THREADS, objects = OBJECTS):
+    """ Seconds for `threads` threads to each create `objects` instances,
+        reading the property three times from each. """
+    start_event = threading.Event()
+
+    def work():
+        start_event.wait()
+        for i in xrange(objects):
+            instance = klass()
+            instance.value, instance.value, instance.value
+
+    workers = [threading.Thread(target = work) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    start = time.time()
+    start_event.set()
+    for worker in workers:
+        worker.join()
+    return time.time() - start
+
+
+def bench_cached_property():
+    for klass, label in ((Locked, 'locked'), (LockFree, 'lock-free'),
+                         (Slotted, 'slots')):
+        report('cached_property %s, %d threads x %d objects' % (
+            label, THREADS, OBJECTS), contended(klass))
+
+    for klass, label in ((Locked, 'locked'), (LockFree, 'lock-free'),
+                         (Slotted, 'slots')):
+        yield ('cached_property %s, first access' % label,
+               lambda klass = klass: klass().value)
@@ -0,0 +1,52 @@
+# Route dispatch cost as the number of registered routes grows.
+
+from tackle import WSGIApplication, RequestHandler
+
+ROUTE_COUNTS = (10, 100, 400, 1000)
+
+
+class Handler(RequestHandler):
+    def get(self, resource_id):
+        return resource_id
+
+
+def make_application(count):
+    return WSGIApplication(*[
+        ('/resource%d/<resource_id:\d+>' % i, Handler) for i in range(count)
+    ])
+
+
+def linear_match(routes, path):
+    """ The former dispatch strategy: evaluate every route in turn. """
+    for route in routes:
+        match, handler = route.match(path)
+        if match:
+            return match, handler
+    return None, None
+
+
+def bench_dispatch():
+    for count in ROUTE_COUNTS:
+        router = make_application(count).router
+        last = '/resource%d/42' % (count - 1)
+        miss = '/missing/42'
+        router.match(miss)  # compile ahead of timing.
+
+        yield ('dispatch compiled, %4d routes, hit last' % count,
+               lambda: router.match(last))
+        yield ('dispatch compiled, %4d routes, miss' % count,
+               lambda: router.match(miss))
+        yield ('dispatch linear,   %4d routes, hit last' % count,
+               lambda: linear_match(router.routes, last))
+        yield ('dispatch linear,   %4d routes, miss' % count,
+               lambda: linear_match(router.routes, miss))
+
+
+def bench_dispatch_cached():
+    router = WSGIApplication(*[
+        ('/resource%d/<resource_id:\d+>' % i, Handler) for i in range(400)
+    ], dispatch_cache_size = 1024).router
+    hit, miss = '/resource399/42', '/wp-login.php'
+
+    yield ('dispatch cached,    400 routes, hit', lambda: router.match(hit))
+    yield ('dispatch cached,    400 routes, miss', lambda: router.match(miss))
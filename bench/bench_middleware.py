@@ -0,0 +1,51 @@
+# Per-layer cost of a 10-middleware stack: nested wsgi() wrappers against a
+# MiddlewareChain compiled into one callable.
+
+from tackle import Middleware, MiddlewareChain
+from tackle.wsgi import RequestInfo
+
+from bench_request import make_environ, start_response
+
+LAYERS = 10
+
+
+class PathCheck(Middleware):
+    """ A typical preemptive layer: inspects the path, rarely intercepts. """
+
+    def run_before(self, environ, start_response):
+        if RequestInfo.of(environ).path.startswith('/never/'):
+            return []
+
+
+class Passthrough(Middleware):
+
+    def run_after(self, environ, start_response, result):
+        return result
+
+
+def app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return ['ok']
+
+
+def make_layers():
+    return [(PathCheck if index % 2 else Passthrough)()
+            for index in range(LAYERS)]
+
+
+def nested(layers, app):
+    for layer in reversed(layers):
+        app = layer.wsgi(app)
+    return app
+
+
+def bench_middleware():
+    environ = make_environ('/index')
+    stacks = [
+        ('middleware: bare app', app),
+        ('middleware: %d nested wrappers' % LAYERS, nested(make_layers(), app)),
+        ('middleware: %d layers, MiddlewareChain' % LAYERS,
+            MiddlewareChain(make_layers()).wsgi(app)),
+    ]
+    for name, stack in stacks:
+        yield name, (lambda stack = stack: stack(environ, start_response))
@@ -0,0 +1,37 @@
+# Redirection lookups with a large table of short links.
+
+from tackle import Shortener
+
+from bench_request import make_environ, start_response
+
+import re
+
+LINK_COUNT = 50000
+
+
+def linear_lookup(rules, path):
+    """ The former strategy: one regular expression per rule. """
+    for pattern in rules:
+        if pattern.match(path) is not None:
+            return pattern
+    return None
+
+
+def bench_redirect():
+    shortener = Shortener(basepath = '/s/')
+    for index in range(LINK_COUNT):
+        shortener.redirect('link%d' % index, 'http://example.com/%d' % index)
+    shortener.redirect(r'tag/(\w+)', 'http://example.com/tags/{1}')
+
+    hit = make_environ('/s/link%d' % (LINK_COUNT - 1))
+    miss = make_environ('/articles/42')
+    shortener.lookup('/')  # compile ahead of timing.
+
+    yield ('redirect %d links, hit' % LINK_COUNT,
+           lambda: shortener.run_before(hit, start_response))
+    yield ('redirect %d links, miss' % LINK_COUNT,
+           lambda: shortener.run_before(miss, start_response))
+
+    rules = [re.compile('/s/link%d$' % i) for i in range(0, LINK_COUNT, 100)]
+    yield ('redirect linear %d rules, miss' % len(rules),
+           lambda: linear_lookup(rules, '/articles/42'))
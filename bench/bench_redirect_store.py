@@ -0,0 +1,57 @@
+# Bulk redirect stores: startup time and lookup latency with a large link table.
+# The table size can be lowered for quick runs with TACKLE_BENCH_LINKS.
+
+from tackle import Shortener
+from tackle.redirects import build_sqlite, MemoryRedirectStore, SQLiteRedirectStore
+
+from bench_request import make_environ, start_response
+from runner import report
+
+import os
+import time
+import shutil
+import tempfile
+
+LINK_COUNT = int(os.environ.get('TACKLE_BENCH_LINKS', 1000000))
+
+
+def links(count):
+    for index in xrange(count):
+        yield ('link%d' % index, 'http://example.com/%d' % index, False)
+
+
+def timed(name, func):
+    start = time.time()
+    result = func()
+    report(name, time.time() - start)
+    return result
+
+
+def bench_redirect_store():
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, 'links.db')
+    try:
+        timed('build sqlite store, %d links' % LINK_COUNT,
+              lambda: build_sqlite(links(LINK_COUNT), filename))
+        store = timed('open sqlite store',
+                      lambda: SQLiteRedirectStore(filename, check_interval = 1.0))
+        memory = timed('load memory store, %d links' % LINK_COUNT,
+                       lambda: MemoryRedirectStore(links(LINK_COUNT)))
+        shortener = Shortener(basepath = '/s/')
+        timed('Shortener.redirect() x %d' % min(LINK_COUNT, 100000),
+              lambda: shortener.load(links(min(LINK_COUNT, 100000))))
+
+        sqlite_shortener = Shortener(basepath = '/s/', store = store)
+        memory_shortener = Shortener(basepath = '/s/', store = memory)
+        hit = make_environ('/s/link%d' % (LINK_COUNT // 2))
+        miss = make_environ('/s/absent')
+        sqlite_shortener.run_before(hit, start_response)  # connect ahead of timing.
+
+        yield ('sqlite store %d links, hit' % LINK_COUNT,
+               lambda: sqlite_shortener.run_before(hit, start_response))
+        yield ('sqlite store %d links, miss' % LINK_COUNT,
+               lambda: sqlite_shortener.run_before(miss, start_response))
+        yield ('memory store %d links, hit' % LINK_COUNT,
+               lambda: memory_shortener.run_before(hit, start_response))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,66 @@
+# End-to-end request cost through WSGIApplication, comparing handlers
+# receiving a webob.Request with lightweight routes receiving a RequestView,
+# and the cost of per-route metrics.
+
+from tackle import WSGIApplication, RequestHandler
+from tackle.metrics import Metrics
+
+from StringIO import StringIO
+
+
+class JSONHandler(RequestHandler):
+    def get(self, item_id):
+        self.response.content_type = 'application/json'
+        return '{"id": %s}' % item_id
+
+
+def json_view(request, match):
+    return (200, [('Content-Type', 'application/json')],
+        '{"id": %s}' % match.group('item_id'))
+
+
+def make_environ(path, method = 'GET'):
+    return {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'localhost',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': StringIO(''),
+        'wsgi.errors': StringIO(),
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+
+
+def start_response(status, headers, exc_info = None):
+    pass
+
+
+def request(app, path):
+    def run():
+        result = app(make_environ(path), start_response)
+        body = ''.join(result)
+        if hasattr(result, 'close'):
+            result.close()
+        return body
+    return run
+
+
+def bench_request():
+    app = WSGIApplication()
+    app.route('/webob/<item_id:\d+>', JSONHandler)
+    app.route('/light/<item_id:\d+>', json_view, lightweight = True)
+
+    yield ('request webob handler', request(app, '/webob/42'))
+    yield ('request lightweight route', request(app, '/light/42'))
+
+    measured = WSGIApplication(metrics = Metrics())
+    measured.route('/light/<item_id:\d+>', json_view, lightweight = True)
+    yield ('request lightweight route, metrics', request(measured, '/light/42'))
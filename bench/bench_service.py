@@ -0,0 +1,41 @@
+# WSGIService host lookup with many configured hosts.
+
+from tackle import WSGIService
+
+from bench_request import make_environ, start_response
+
+HOST_COUNT = 100
+
+
+def app(environ, start_response):
+    start_response('200 OK', [])
+    return ['']
+
+
+def bench_service():
+    service = WSGIService(*[('host%d.example.com' % i, app)
+                            for i in range(HOST_COUNT)])
+    hit = make_environ('/')
+    hit['HTTP_HOST'] = 'host%d.example.com:8080' % (HOST_COUNT - 1)
+    miss = make_environ('/')
+    miss['HTTP_HOST'] = 'unknown.example.org'
+
+    yield ('service %d hosts, hit' % HOST_COUNT,
+           lambda: service(hit, start_response))
+    yield ('service %d hosts, miss' % HOST_COUNT,
+           lambda: service(miss, start_response))
+
+
+def bench_service_wildcard():
+    service = WSGIService(*[('*.zone%d.example.com' % i, app)
+                            for i in range(HOST_COUNT)])
+    service.register(app, '*')
+    hit = make_environ('/')
+    hit['HTTP_HOST'] = 'www.site.zone%d.example.com' % (HOST_COUNT - 1)
+    default = make_environ('/')
+    default['HTTP_HOST'] = 'unknown.example.org'
+
+    yield ('service %d wildcards, hit' % HOST_COUNT,
+           lambda: service(hit, start_response))
+    yield ('service %d wildcards, default' % HOST_COUNT,
+           lambda: service(default, start_response))
@@ -0,0 +1,58 @@
+# Application startup: the cost of the first requests to a large route table,
+# compiled lazily on first use, ahead of time by finalize(), or from a
+# persisted route cache.
+
+from tackle import WSGIApplication
+
+from bench_dispatch import Handler
+from runner import report
+
+import os
+import re
+import time
+import shutil
+import tempfile
+
+ROUTE_COUNT = 1000
+
+
+def make_application(count = ROUTE_COUNT, **options):
+    return WSGIApplication(*[
+        ('/resource%d/<resource_id:\d+>' % i, Handler) for i in range(count)
+    ], **options)
+
+
+def first_requests(app, count = ROUTE_COUNT):
+    for i in range(count):
+        app.router.match('/resource%d/42' % i)
+
+
+def cold(func):
+    """ Seconds taken by func(), with the re module's own cache emptied. """
+    re.purge()
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def bench_startup():
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, 'routes.cache')
+    try:
+        lazy = make_application()
+        report('startup lazy, first request to %d routes' % ROUTE_COUNT,
+               cold(lambda: first_requests(lazy)))
+
+        finalized = make_application()
+        report('startup finalize(), %d routes' % ROUTE_COUNT,
+               cold(finalized.finalize))
+        report('startup finalized, first request to %d routes' % ROUTE_COUNT,
+               cold(lambda: first_requests(finalized)))
+
+        make_application(route_cache = filename).finalize()  # writes the cache.
+        cached = make_application(route_cache = filename)
+        report('startup finalize() from route cache, %d routes' % ROUTE_COUNT,
+               cold(cached.finalize))
+    finally:
+        shutil.rmtree(directory)
+    return []
@@ -0,0 +1,39 @@
+# StaticFileMiddleware serving small and large files, from disk and from
+# the in-memory cache.
+
+from tackle import WSGIApplication, StaticFileMiddleware
+
+from bench_request import request
+
+import os
+import atexit
+import shutil
+import tempfile
+
+SMALL_SIZE = 1024
+LARGE_SIZE = 4 << 20
+
+
+def make_directory():
+    directory = tempfile.mkdtemp(prefix = 'tackle-bench-')
+    atexit.register(shutil.rmtree, directory, True)
+    for name, size in (('small.css', SMALL_SIZE), ('large.bin', LARGE_SIZE)):
+        with open(os.path.join(directory, name), 'wb') as stream:
+            stream.write('x' * size)
+    return directory
+
+
+def bench_static():
+    directory = make_directory()
+    upstream = WSGIApplication()
+    apps = (
+        ('disk', StaticFileMiddleware(directory, '/static/').wsgi(upstream)),
+        ('memory', StaticFileMiddleware(directory, '/static/',
+            memory_cache_size = 1 << 20).wsgi(upstream)),
+    )
+    for label, app in apps:
+        yield ('static %s, %dKB file' % (label, SMALL_SIZE >> 10),
+               request(app, '/static/small.css'))
+    yield ('static disk, %dMB file' % (LARGE_SIZE >> 20),
+           request(apps[0][1], '/static/large.bin'))
+    yield ('static miss, passed upstream', request(apps[0][1], '/static/absent.css'))
@@ -0,0 +1,34 @@
+# Reverse URL building, as templates rendering many links do.
+
+from tackle import WSGIApplication, RequestHandler
+
+
+class Handler(RequestHandler):
+    def get(self, *args, **kwargs):
+        return ''
+
+
+def make_application(**options):
+    return WSGIApplication(
+        ('/users/<user_id:\d+>', Handler, 'user'),
+        ('/blog/<year:\d{4}>/<slug>', Handler, 'post'),
+        **options)
+
+
+def bench_url_for():
+    app = make_application()
+    cached = make_application(url_cache_size = 1024)
+    posts = [{'year': 2015, 'slug': 'post-%d' % (i % 100)} for i in range(1000)]
+
+    yield ('url_for 1 argument',
+           lambda: app.url_for('user', user_id = 42))
+    yield ('url_for 2 arguments',
+           lambda: app.url_for('post', year = 2015, slug = 'hello world'))
+    yield ('url_for 2 arguments, memoized',
+           lambda: cached.url_for('post', year = 2015, slug = 'hello world'))
+    yield ('url str.format 2 arguments (unchecked, unescaped)',
+           lambda: '/blog/{year}/{slug}'.format(year = 2015, slug = 'hello world'))
+    yield ('urls_for 1000 links, 100 distinct',
+           lambda: app.urls_for('post', posts))
+    yield ('url_for 1000 links, 100 distinct',
+           lambda: [app.url_for('post', **post) for post in posts])
@@ -0,0 +1,169 @@
+# A simple benchmark runner for tackle's hot paths.
+# Benchmark modules (bench_*.py) define functions named bench_*, which
+# generate (name, callable) cases; each case is timed and reported.
+#
+# Usage:
+#   python bench/runner.py [--filter TEXT] [--json results.json]
+#                          [--compare baseline.json] [paths...]
+
+import os
+import gc
+import sys
+import glob
+import time
+import json
+import imp
+import argparse
+import platform
+
+
+# Results of the current run, by case name, for --json and --compare.
+results = {}
+
+# Only cases whose name contains this text are run and reported (--filter).
+include = None
+
+
+def dirname_up(path, howmany = 1):
+    while (howmany > 0):
+        path = os.path.dirname(path)
+        howmany = howmany - 1
+    return path
+
+
+def calibrate(func, batch_time):
+    """ The number of calls lasting at least `batch_time` seconds. """
+    number = 1
+    while True:
+        start = time.time()
+        for i in xrange(number):
+            func()
+        if time.time() - start >= batch_time:
+            return number
+        number = number * 10
+
+
+def percentile(ordered, percent):
+    index = int(round((len(ordered) - 1) * percent / 100.0))
+    return ordered[index]
+
+
+def measure(func, min_time = 0.2, batches = 25):
+    """ Time a callable in batches of calls, returning a dict of statistics
+        in seconds per call: mean, min and percentiles (over the batches, as
+        single calls are too short to time), and `objects`, the gc-tracked
+        objects each call left allocated (Python 2 has no tracemalloc). """
+    func()  # warm caches ahead of timing.
+    number = calibrate(func, min_time / batches)
+    timings = []
+    total = 0.0
+    while len(timings) < batches or total < min_time:
+        start = time.time()
+        for i in xrange(number):
+            func()
+        elapsed = time.time() - start
+        timings.append(elapsed / number)
+        total = total + elapsed
+
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.get_count()[0]
+        for i in xrange(number):
+            func()
+        objects = float(gc.get_count()[0] - before) / number
+    finally:
+        gc.enable()
+
+    timings.sort()
+    return {
+        'ops': len(timings) * number / total,
+        'mean': total / (len(timings) * number),
+        'min': timings[0],
+        'p50': percentile(timings, 50),
+        'p90': percentile(timings, 90),
+        'p99': percentile(timings, 99),
+        'objects': objects,
+        'calls': len(timings) * number
+    }
+
+
+def report(name, stats):
+    """ Print (and record) a case's statistics, or a one-off duration. """
+    if include is not None and include not in name:
+        return
+    if not isinstance(stats, dict):
+        stats = {'seconds': stats}
+        print("%-56s %12.3f ms once" % (name, stats['seconds'] * 1e3))
+    else:
+        print("%-56s %12.0f ops/s %9.2f us/op  p50 %8.2f  p99 %8.2f  %6.1f objs/op" % (
+            name, stats['ops'], stats['mean'] * 1e6, stats['p50'] * 1e6,
+            stats['p99'] * 1e6, stats['objects']))
+    results[name] = stats
+
+
+def compare(baseline):
+    """ Print the change in mean time per call against an earlier run. """
+    print("\n%-56s %12s %12s %8s" % ('compared to baseline', 'before us', 'after us', 'change'))
+    for name, stats in sorted(results.items()):
+        before = baseline.get('results', baseline).get(name)
+        if not before or 'mean' not in stats or 'mean' not in before:
+            continue
+        change = (stats['mean'] - before['mean']) / before['mean'] * 100
+        print("%-56s %12.2f %12.2f %+7.1f%%" % (
+            name, before['mean'] * 1e6, stats['mean'] * 1e6, change))
+
+
+def load_modules(paths, pattern = 'bench_*.py'):
+    for path in paths:
+        for filename in sorted(glob.glob(os.path.join(path, pattern))):
+            name = os.path.splitext(os.path.basename(filename))[0]
+            yield imp.load_source(name, filename)
+
+
+def runbenchmarks(paths, top = None):
+    if top is None:
+        top = dirname_up(os.path.abspath(__file__), 2)
+    if top not in sys.path:
+        sys.path.insert(0, top)
+    # benchmarks importing `runner` share this module's results.
+    sys.modules.setdefault('runner', sys.modules[__name__])
+
+    for module in load_modules(paths):
+        for attr in sorted(dir(module)):
+            bench = getattr(module, attr)
+            if attr.startswith('bench_') and callable(bench):
+                for name, func in bench():
+                    if include is None or include in name:
+                        report(name, measure(func))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description = 'Run tackle benchmarks.')
+    parser.add_argument('paths', nargs = '*')
+    parser.add_argument('--filter', default = None,
+                        help = 'only run cases whose name contains this text')
+    parser.add_argument('--json', default = None,
+                        help = 'write results to this file')
+    parser.add_argument('--compare', default = None,
+                        help = 'compare with results written by --json')
+    options = parser.parse_args(args)
+
+    global include
+    include = options.filter
+    runbenchmarks(options.paths or [os.path.dirname(os.path.abspath(__file__))])
+
+    if options.json:
+        with open(options.json, 'w') as stream:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.time(),
+                'results': results
+            }, stream, indent = 2, sort_keys = True)
+    if options.compare:
+        with open(options.compare) as stream:
+            compare(json.load(stream))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
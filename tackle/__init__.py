@@ -1,7 +1,8 @@
 
-from util import cached_property
+from util import cached_property, slot_cached_property
 from wsgi import (
     WSGIService,
+    LazyHostApplication,
     WSGIApplication,
     WSGIRequestHandler as RequestHandler,
     sendfile
@@ -9,8 +10,11 @@ from wsgi import (
 
 from middleware import (
     Middleware,
+    MiddlewareChain,
     RedirectionMiddleware,
     StaticFileMiddleware,
+    ResponseCacheMiddleware,
+    CompressionMiddleware,
     Shortener
 )
 
@@ -0,0 +1,211 @@
+# Streaming request bodies.
+# Copyright (c) 2015, Sam Briesemeister
+# Licensed under the Python Software Foundation License.
+
+""" Request bodies read incrementally from `wsgi.input`, in bounded memory.
+
+    A RequestBody reads exactly the body of a request: `Content-Length`
+    bytes, or with `Transfer-Encoding: chunked`, the decoded chunks (unless
+    the server decoded them already, as it signals with
+    `wsgi.input_terminated`). With a `max_size`, a declared length beyond it
+    is refused before anything is read, and a chunked body as soon as it
+    exceeds it, with 413 Request Entity Too Large. Routes with a limit also
+    have it applied to bodies read through WebOb (see RequestBody.limit).
+
+    Usage (in a request handler, where `self.stream` is a RequestBody):
+        def put(self, name):
+            with open(path, 'wb') as target:
+                for chunk in self.stream:
+                    target.write(chunk)
+
+        def post(self):
+            upload = self.stream.spool()  # a file; on disk when large.
+"""
+
+from webob import exc as exceptions
+
+import re
+import tempfile
+
+
+class ChunkedReader(object):
+    """ A file-like reader decoding a chunked transfer coding (RFC 7230,
+        section 4.1) from a stream positioned at the start of the body. """
+
+    # Longest chunk size line (with extensions) or trailer line accepted.
+    max_line = 4096
+
+    # Chunk sizes are bare hex digits: int(size, 16) would also take '0x1f',
+    # '+5' or '-0'.
+    RE_SIZE = re.compile(r'[0-9A-Fa-f]{1,16}\Z')
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.remaining = 0   # bytes left in the current chunk
+        self.finished = False
+
+    def readline(self):
+        line = self.stream.readline(self.max_line + 1)
+        if len(line) > self.max_line or not line.endswith('\n'):
+            raise exceptions.HTTPBadRequest('Malformed chunked request body.')
+        return line
+
+    def next_chunk(self):
+        if self.remaining == 0 and not self.finished:
+            size = self.readline().split(';', 1)[0].strip()
+            if self.RE_SIZE.match(size) is None:
+                raise exceptions.HTTPBadRequest('Malformed chunked request body.')
+            self.remaining = int(size, 16)
+            if self.remaining == 0:
+                while self.readline().strip():
+                    pass  # trailers are not exposed.
+                self.finished = True
+
+    def read(self, size = -1):
+        parts = []
+        while size != 0:
+            self.next_chunk()
+            if self.finished:
+                break
+            count = self.remaining if size < 0 else min(size, self.remaining)
+            data = self.stream.read(count)
+            if len(data) < count:
+                raise exceptions.HTTPBadRequest('Incomplete chunked request body.')
+            parts.append(data)
+            self.remaining -= count
+            if size > 0:
+                size -= count
+            if self.remaining == 0 and self.readline().strip():
+                raise exceptions.HTTPBadRequest('Malformed chunked request body.')
+            if size > 0:
+                break  # a short read, rather than waiting for the next chunk.
+        return ''.join(parts)
+
+
+
+class RequestBody(object):
+    """ The body of a request, read incrementally.
+
+        Iterating yields chunks of up to `chunk_size` bytes; read() is as a
+        file's. spool() copies the rest of the body into a temporary file,
+        held in memory up to `spool_threshold` bytes and on disk beyond, and
+        makes it the request's `wsgi.input` (with its Content-Length), so
+        WebOb can parse forms from it afterwards.
+    """
+
+    # Where WSGIApplication records the limit of the route being served.
+    limit_key = 'tackle.max_body_size'
+
+    chunk_size = 65536
+    spool_class = tempfile.SpooledTemporaryFile
+
+    def __init__(self, environ, max_size = None, spool_threshold = 1 << 20):
+        self.environ = environ
+        self.max_size = environ.get(self.limit_key, max_size)
+        self.spool_threshold = spool_threshold
+        self.received = 0
+        self.spooled = None
+
+        length = self.check_length(environ, self.max_size)
+        stream = environ.get('wsgi.input')
+        if stream is None:
+            self.input, self.length = None, 0
+        elif environ.get('wsgi.input_terminated'):
+            self.input, self.length = stream, length  # read to its end.
+        elif self.chunked(environ):
+            self.input, self.length = ChunkedReader(stream), None
+        else:
+            self.input, self.length = stream, length or 0
+
+    @staticmethod
+    def chunked(environ):
+        encoding = environ.get('HTTP_TRANSFER_ENCODING', '')
+        return encoding.lower().rstrip().endswith('chunked')
+
+    @classmethod
+    def check_length(cls, environ, max_size = None):
+        """ The declared Content-Length, or None; raises 413 when it exceeds
+            `max_size`, before any of the body is read. """
+        length = environ.get('CONTENT_LENGTH')
+        if not length or cls.chunked(environ):
+            return None
+        try:
+            length = int(length)
+        except ValueError:
+            raise exceptions.HTTPBadRequest('Invalid Content-Length.')
+        if length < 0:
+            raise exceptions.HTTPBadRequest('Invalid Content-Length.')
+        if max_size is not None and length > max_size:
+            raise exceptions.HTTPRequestEntityTooLarge()
+        return length
+
+    @classmethod
+    def limit(cls, environ, max_size):
+        """ Apply a route's `max_size` before anything reads the body: a
+            declared Content-Length beyond it is refused at once, and a body
+            of undeclared length (chunked, or read to the end of the input)
+            is wrapped in a RequestBody as `wsgi.input`, so that WebOb
+            reading it is refused once it exceeds the limit too. """
+        environ[cls.limit_key] = max_size
+        length = cls.check_length(environ, max_size)
+        if length is None and environ.get('wsgi.input') is not None and \
+                (environ.get('wsgi.input_terminated') or cls.chunked(environ)):
+            environ['wsgi.input'] = cls(environ, max_size)
+            environ['wsgi.input_terminated'] = True  # decoded, read to its end.
+            environ.pop('CONTENT_LENGTH', None)  # overridden by chunking.
+
+    def read(self, size = -1):
+        if self.spooled is not None:
+            return self.spooled.read(size)
+        if self.input is None:
+            return ''
+
+        if self.length is not None:
+            remaining = self.length - self.received
+            size = remaining if size < 0 else min(size, remaining)
+            if size <= 0:
+                return ''
+        elif size < 0 and self.max_size is not None:
+            # to the end, in reads of one byte past the limit at most, which
+            # tells an oversized body from a full one.
+            parts = []
+            while True:
+                data = self.read(self.max_size - self.received + 1)
+                if not data:
+                    return ''.join(parts)
+                parts.append(data)
+
+        data = self.input.read(size)
+        self.received += len(data)
+        if self.max_size is not None and self.received > self.max_size:
+            raise exceptions.HTTPRequestEntityTooLarge()
+        return data
+
+    def __iter__(self):
+        read, size = self.read, self.chunk_size
+        while True:
+            chunk = read(size)
+            if not chunk:
+                return
+            yield chunk
+
+    def spool(self):
+        """ The rest of the body, as a file positioned at its start. """
+        if self.spooled is None:
+            spooled = self.spool_class(self.spool_threshold)
+            for chunk in self:
+                spooled.write(chunk)
+            size = spooled.tell()
+            spooled.seek(0)
+            self.spooled = spooled
+
+            environ = self.environ
+            environ['wsgi.input'] = spooled
+            environ['CONTENT_LENGTH'] = str(size)
+            environ.pop('HTTP_TRANSFER_ENCODING', None)
+            environ.pop('wsgi.input_terminated', None)
+        return self.spooled
+
+    def close(self):
+        if self.spooled is not None:
+            self.spooled.close()
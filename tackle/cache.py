@@ -0,0 +1,156 @@
+# Storage backends for cached responses.
+# Copyright (c) 2015, Sam Briesemeister
+# Licensed under the Python Software Foundation License.
+
+""" Backends for ResponseCacheMiddleware. Each maps string keys to values
+    with a time to live, through get(key), set(key, value, ttl) and
+    delete(key); a value that has expired is never returned.
+"""
+
+from tackle.util import LRUCache
+
+import os
+import time
+import errno
+import hashlib
+import tempfile
+import cPickle as pickle
+
+
+class CachedResponse(object):
+    """ A complete response: status line, header list and body string. """
+
+    __slots__ = ('status', 'headers', 'body', 'created')
+
+    def __init__(self, status, headers, body, created = None):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.created = time.time() if created is None else created
+
+    def header(self, name):
+        name = name.lower()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+
+
+class MemoryResponseCache(object):
+    """ Responses held in this process, in an LRUCache bounded by the total
+        size of the cached bodies (in bytes). """
+
+    cache_class = LRUCache
+
+    # Approximate cost of an entry beyond its body.
+    overhead = 256
+
+    def __init__(self, maxsize = 64 << 20):
+        self.cache = self.cache_class(maxsize, weigher = self.weigh)
+
+    @classmethod
+    def weigh(cls, item):
+        value = item[1]
+        return cls.overhead + len(getattr(value, 'body', ''))
+
+    def get(self, key):
+        item = self.cache.get(key)
+        if item is None:
+            return None
+        if item[0] <= time.time():
+            self.cache.pop(key)
+            return None
+        return item[1]
+
+    def set(self, key, value, ttl):
+        return self.cache.set(key, (time.time() + ttl, value))
+
+    def delete(self, key):
+        self.cache.pop(key)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
+
+
+
+class FileResponseCache(object):
+    """ Responses pickled into files within a directory, shared by all worker
+        processes using it. Placing the directory on a memory filesystem
+        (e.g. /dev/shm) makes this a shared-memory cache.
+
+        Files are replaced atomically, so readers never see partial entries;
+        expired files are removed when read, or by purge().
+
+        Entries are unpickled when read, and unpickling can run arbitrary
+        code: the directory must be writable only by the application's own
+        processes (not, say, a world-writable directory of /tmp).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def filename(self, key):
+        return os.path.join(self.directory, hashlib.md5(key).hexdigest())
+
+    def get(self, key):
+        filename = self.filename(key)
+        try:
+            with open(filename, 'rb') as stream:
+                stored_key, expires, value = pickle.load(stream)
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+        if stored_key != key:
+            return None
+        if expires <= time.time():
+            self.remove(filename)
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        filename = self.filename(key)
+        # a unique file, as other threads may be storing the same key.
+        descriptor, temporary = tempfile.mkstemp('.tmp',
+            os.path.basename(filename) + '.', self.directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as stream:
+                pickle.dump((key, time.time() + ttl, value), stream, 2)
+            os.rename(temporary, filename)
+        except:
+            self.remove(temporary)
+            raise
+        return True
+
+    def delete(self, key):
+        self.remove(self.filename(key))
+
+    def remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                raise
+
+    def purge(self):
+        """ Remove expired entries, returning how many were removed. """
+        removed, now = 0, time.time()
+        for name in os.listdir(self.directory):
+            filename = os.path.join(self.directory, name)
+            try:
+                with open(filename, 'rb') as stream:
+                    expires = pickle.load(stream)[1]
+            except Exception:
+                continue
+            if expires <= now:
+                self.remove(filename)
+                removed = removed + 1
+        return removed
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            self.remove(os.path.join(self.directory, name))
@@ -4,13 +4,39 @@
 
 
 from tackle.wsgi import sendfile
-from tackle.wsgi import RequestInfo
-from tackle.util import stripfirst
+from tackle.wsgi import RequestInfo, ResponseStream, close_result
+from tackle.util import stripfirst, literal_prefix, LRUCache, PatternSet
+from tackle.util import gzip_compress, parse_accept_encoding, accepts_encoding
+from tackle.util import parse_cache_control, gzip_compressor
+from tackle.cache import CachedResponse, MemoryResponseCache
+
+from webob.byterange import Range
+from email.utils import formatdate, parsedate_tz, mktime_tz
+from multiprocessing.pool import ThreadPool
 
 import os
 import re
+import stat
+import time
+import hashlib
+import threading
 import urlparse
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def forward_finalize(wrapper, app):
+    """ Give a wrapper the finalize() of the application it wraps, so that
+        WSGIService.finalize() and the prefork server still reach it. """
+    finalize = getattr(app, 'finalize', None)
+    if callable(finalize):
+        wrapper.finalize = finalize
+    return wrapper
+
+
 
 class Middleware(object):
 
@@ -21,23 +47,63 @@ class Middleware(object):
     def run_before(self, environ, start_response):
         pass
 
+    def run_start_response(self, environ, status, headers):
+        """ Rewrite the status and headers of the upstream response, returning
+            (status, headers), or None to leave them unchanged. Only called
+            when overridden, as the upstream's start_response is wrapped. """
+        return None
+
     def run_after(self, environ, start_response, result):
+        """ Return the upstream result, or an iterable replacing it. To work
+            on the body as it streams, rather than materialising it, return
+            self.stream(result, ...) with per-chunk hooks. """
         return result
 
+    def stream(self, result, transform = None, finish = None, close = None):
+        return ResponseStream(result, transform, finish, close)
+
+    def finalize(self):
+        """ Build lookup tables ahead of the first request, rather than on
+            it; called by wsgi() and MiddlewareChain. """
+        pass
+
+    def overrides(self, name):
+        """ Whether a hook is overridden from Middleware's default. """
+        method = getattr(type(self), name)
+        return getattr(method, '__func__', method) is not \
+            getattr(Middleware, name).__func__
+
+    def intercepts_start_response(self):
+        return self.overrides('run_start_response')
+
+    def wrap_start_response(self, environ, start_response):
+        def __start_response__(status, headers, exc_info = None):
+            rewritten = self.run_start_response(environ, status, list(headers))
+            if rewritten is not None:
+                status, headers = rewritten
+            return start_response(status, headers, exc_info)
+        return __start_response__
+
     def wsgi(self, app):
+        self.finalize()
+        rewrites = self.intercepts_start_response()
         def __wrapper__(environ, start_response):
             intercept = self.run_before(environ, start_response)
-            if not intercept:
-                result = app(environ, start_response)
-                result = self.run_after(environ, start_response, result)
-                return result
-            else:
+            if intercept is not None:
                 return intercept
-        return __wrapper__
+            if rewrites:
+                start_response = self.wrap_start_response(environ, start_response)
+            result = app(environ, start_response)
+            try:
+                return self.run_after(environ, start_response, result)
+            except:
+                close_result(result)
+                raise
+        return forward_finalize(__wrapper__, app)
 
     def __call__(self, environ, start_response):
         intercept = self.run_before(environ, start_response)
-        if not intercept:
+        if intercept is None:
             result = self.run_after(environ, start_response, intercept)
             return result
         else:
@@ -45,6 +111,95 @@ class Middleware(object):
 
 
 
+class MiddlewareChain(object):
+    """ A stack of middleware compiled into a single WSGI callable.
+
+        The result is equivalent to nesting each layer's wsgi() wrapper, the
+        first layer outermost: run_before hooks are called in order until one
+        intercepts the request, then run_after hooks of the layers entered are
+        called in reverse. Hooks left as Middleware's defaults are skipped,
+        and layers share one RequestInfo per request (RequestInfo.of) while
+        their hooks run.
+        Layers with their own wsgi() (e.g. ResponseCacheMiddleware) are
+        nested around the compiled layers within them.
+
+        Usage:
+            app = MiddlewareChain(redirects, static, cache).wsgi(upstream_app)
+            # same as redirects.wsgi(static.wsgi(cache.wsgi(upstream_app)))
+    """
+
+    def __init__(self, *middlewares):
+        if len(middlewares) == 1 and isinstance(middlewares[0], (list, tuple)):
+            middlewares = middlewares[0]
+        self.middlewares = list(middlewares)
+
+    def wsgi(self, app):
+        compiled = []  # innermost first
+        for layer in reversed(self.middlewares):
+            layer.finalize()
+            if layer.overrides('wsgi'):
+                app = layer.wsgi(self.compile(compiled[::-1], app))
+                compiled = []
+            else:
+                compiled.append(layer)
+        return self.compile(compiled[::-1], app)
+
+    def compile(self, layers, app):
+        if not layers:
+            return app
+        layers = tuple(layers)
+        count = len(layers)
+        befores = tuple(layer.run_before if layer.overrides('run_before') else None
+                        for layer in layers)
+        afters = tuple(layer.run_after if layer.overrides('run_after') else None
+                       for layer in layers)
+        rewrites = tuple(layer.intercepts_start_response() for layer in layers)
+        rewriting = any(rewrites)
+        info_key = RequestInfo.environ_key
+
+        def __chain__(environ, start_response):
+            # shared while the chain runs; removed after, as it references environ.
+            environ[info_key] = RequestInfo(environ)
+            try:
+                return run(environ, start_response)
+            finally:
+                environ.pop(info_key, None)
+
+        def run(environ, start_response):
+            # the start_response given to each layer, as when nested.
+            starts = [start_response] * count if rewriting else None
+            depth = 0
+            while depth < count:
+                before = befores[depth]
+                if before is not None:
+                    result = before(environ, start_response)
+                    if result is not None:
+                        break
+                if rewriting:
+                    starts[depth] = start_response
+                    if rewrites[depth]:
+                        start_response = layers[depth].wrap_start_response(
+                            environ, start_response)
+                depth = depth + 1
+            else:
+                result = app(environ, start_response)
+
+            while depth > 0:
+                depth = depth - 1
+                after = afters[depth]
+                if after is not None:
+                    try:
+                        result = after(environ,
+                            starts[depth] if rewriting else start_response, result)
+                    except:
+                        close_result(result)
+                        raise
+            return result
+
+        return forward_finalize(__chain__, app)
+
+
+
 class RedirectionMiddleware(Middleware):
     """ WSGI Middleware to intercept requests that should be redirected.
         Supports Regular Expressions patterns for extracting parts from
@@ -62,35 +217,117 @@ class RedirectionMiddleware(Middleware):
     def __init__(self, retain_path = False, retain_query = True):
         self.retain_path = retain_path
         self.retain_query = retain_query
-        self._map = []
+        self._map = []          # all rules, in registered order
+        self._literals = {}     # exact path => first rule matching only it
+        self._expressions = []  # rules matched by regular expression
+        self._patterns = None   # PatternSet of _expressions, built lazily
 
     def redirect(self, detect, target, permanent = False):
-        self._map.append((re.compile(detect), target, permanent))
+        rule = RedirectRule(len(self._map), detect, target, permanent)
+        self._map.append(rule)
 
+        path = self.literal(detect)
+        if path is not None:
+            self._literals.setdefault(path, rule)
+        else:
+            rule.pattern = re.compile(detect)
+            self._expressions.append(rule)
+            self._patterns = None
+
+    @classmethod
+    def literal(cls, detect):
+        """ The only path a pattern can match, if it has no variable part. """
+        if detect.endswith('$') and not detect.endswith('\\$'):
+            prefix, complete = literal_prefix(detect)
+            if complete:
+                return prefix
+        return None
+
+    @property
+    def patterns(self):
+        patterns = self._patterns
+        if patterns is None:
+            expressions = list(self._expressions)
+            patterns = PatternSet(expressions)
+            if len(expressions) == len(self._expressions):
+                self._patterns = patterns
+        return patterns
+
+    def finalize(self):
+        if self._expressions:
+            self.patterns
+
+    def lookup(self, path):
+        """ The first registered rule matching the path, and its match. """
+        rule = self._literals.get(path)
+        if self._expressions:
+            found, match = self.patterns.match(path)
+            if found is not None and (rule is None or found.index < rule.index):
+                return found, match
+        return rule, None
 
 
     def run_before(self, environ, start_response):
-        info = RequestInfo(environ)
-        status = [ "302 Temporary Redirect", "301 Permanent Redirect" ]
+        info = RequestInfo.of(environ)
+        rule, match = self.lookup(info.path)
+        if rule is not None:
+            result = rule.location_for(info, match,
+                self.retain_path, self.retain_query)
+            start_response(rule.status, [('Location', result)])
+            return ['Redirecting to %s' % result]
+
 
-        for pattern, target, permanent in self._map:
-            match = pattern.match(info.path)
+
+class RedirectRule(object):
+    """ A redirection, with its target URL parsed when registered. """
+
+    __slots__ = (
+        'index', 'pattern', 'target', 'status', 'parts', 'location', 'formatted'
+    )
+
+    statuses = ( "302 Temporary Redirect", "301 Permanent Redirect" )
+
+    def __init__(self, index, detect, target, permanent):
+        self.index = index
+        self.pattern = None
+        self.target = target
+        self.status = self.statuses[int(bool(permanent))]
+        self.parts = urlparse.urlsplit(target)
+        self.location = urlparse.urlunsplit(self.parts)
+        self.formatted = ('{' in target) or ('}' in target)
+
+    def location_for(self, info, match, retain_path, retain_query):
+        """ The target URL for a request, interpolating the pattern's groups
+            and request properties when the target is a format string. """
+        escape = self.escape if self.formatted else (lambda text: text)
+        query = info.query
+
+        if (retain_query and query) or retain_path:
+            parts = list(self.parts)
+            if retain_query and query:
+                parts[3] = escape(stripfirst('?', query))
+            if retain_path:
+                parts[2] = escape(info.path)
+            location = urlparse.urlunsplit(parts)
+        else:
+            location = self.location
+
+        if self.formatted:
+            args, kwargs = (), {}
             if match is not None:
                 args, kwargs = match.groups(), match.groupdict()
-                parts = list(urlparse.urlsplit(target))
-                if self.retain_query:
-                    parts[3] = stripfirst('?', info.query or parts[3])
-                if self.retain_path:
-                    parts[2] = info.path
-                kwargs.update({
-                    'hostname': info.hostname,
-                    'path': info.path,
-                    'query': info.query,
-                    'path_qs': info.path_qs
-                })
-                result = urlparse.urlunsplit(parts).format(*args, **kwargs)
-                start_response(status[int(permanent)], [('Location', result)])
-                return ['Redirecting to %s' % result]
+            kwargs.update({
+                'hostname': info.hostname,
+                'path': info.path,
+                'query': query,
+                'path_qs': info.path_qs
+            })
+            location = location.format(*args, **kwargs)
+        return location
+
+    @staticmethod
+    def escape(text):
+        return text.replace('{', '{{').replace('}', '}}')
 
 
 
@@ -99,38 +336,218 @@ class StaticFileMiddleware(Middleware):
 
     default_cache_life = 3600
 
+    # Content types by (lowercase) file extension. This is explicit, rather
+    # than read from the host's mimetypes database, so responses do not
+    # vary with the system they are served from.
+    content_types = {
+        '.html': 'text/html',
+        '.htm': 'text/html',
+        '.css': 'text/css',
+        '.js': 'text/javascript',
+        '.mjs': 'text/javascript',
+        '.json': 'application/json',
+        '.map': 'application/json',
+        '.txt': 'text/plain',
+        '.csv': 'text/csv',
+        '.xml': 'application/xml',
+        '.pdf': 'application/pdf',
+        '.wasm': 'application/wasm',
+        '.zip': 'application/zip',
+        '.svg': 'image/svg+xml',
+        '.png': 'image/png',
+        '.jpg': 'image/jpeg',
+        '.jpeg': 'image/jpeg',
+        '.gif': 'image/gif',
+        '.webp': 'image/webp',
+        '.avif': 'image/avif',
+        '.ico': 'image/x-icon',
+        '.woff': 'font/woff',
+        '.woff2': 'font/woff2',
+        '.ttf': 'font/ttf',
+        '.otf': 'font/otf',
+        '.mp3': 'audio/mpeg',
+        '.ogg': 'audio/ogg',
+        '.wav': 'audio/wav',
+        '.mp4': 'video/mp4',
+        '.webm': 'video/webm'
+    }
+
+    # Cache lives by file extension, where not `default_cache_life`.
+    cache_lives = {
+        '.txt': 600
+    }
+
+    # Formerly the only table: (pattern, content type, cache life) rules,
+    # searched before the tables. The defaults agree with the tables, so
+    # they are only searched once a subclass replaces or extends them.
     match_content_types = [
         (r'\.js$', 'text/javascript', default_cache_life),
         (r'\.json$', 'application/json', default_cache_life),
         (r'\.txt$', 'text/plain', 600),
         (r'\.css$', 'text/css', default_cache_life)
     ]
+    default_match_content_types = list(match_content_types)
+
+    # Encodings in order of preference, with the suffix of precompressed files.
+    encodings = (('br', '.br'), ('gzip', '.gz'))
 
+    compressible_types = (
+        'text/', 'application/json', 'application/javascript',
+        'application/xml', 'image/svg+xml'
+    )
 
+    def __init__(self, *args, **options):
+        """ Options:
+                etag_hash: derive ETags from file content (an MD5 digest,
+                    computed once per file version) rather than from the
+                    file's inode, size and modification time.
+                memory_cache_size: hold files in memory, up to this many
+                    bytes in total; least recently used files are evicted.
+                memory_max_file: the largest file to hold in memory.
+                memory_check_interval: seconds between checks that a file
+                    held in memory is unchanged on disk.
+                precompressed: serve sibling '.br' or '.gz' files to clients
+                    accepting those encodings (see tackle.precompress).
+                compress: gzip compressible files up to `compress_max_file`
+                    bytes on the fly, caching the output up to
+                    `compress_cache_size` bytes.
+                manifest: index the static directory up front, resolving
+                    requests with a dictionary lookup rather than probing the
+                    filesystem. Changes on disk are only picked up by reload().
+        """
+        super(StaticFileMiddleware, self).__init__(*args, **options)
+        self.etag_hash = options.get('etag_hash', False)
+        self.digests = LRUCache(options.get('etag_cache_size', 4096))
+
+        self.precompressed = options.get('precompressed', False)
+        self.compress = options.get('compress', False)
+        self.compress_level = options.get('compress_level', 6)
+        self.compress_max_file = options.get('compress_max_file', 1 << 20)
+        self.compressed = LRUCache(
+            options.get('compress_cache_size', 16 << 20), weigher = len)
+
+        self.memory = None
+        self.memory_max_file = options.get('memory_max_file', 256 * 1024)
+        self.memory_check_interval = options.get('memory_check_interval', 1.0)
+        if options.get('memory_cache_size'):
+            self.memory = LRUCache(options['memory_cache_size'],
+                weigher = lambda entry: entry.size)
+
+        self.manifest = None
+        if options.get('manifest'):
+            self.reload()
+
+
+    @classmethod
+    def match_rule(cls, rules, filename):
+        """ The first of `match_content_types` matching, where they differ
+            from the defaults. """
+        if rules and rules != cls.default_match_content_types:
+            for rule in rules:
+                if re.search(rule[0], filename):
+                    return rule
+        return None
 
     def get_headers(self, filename):
-        for pattern, content_type, cache_life in self.match_content_types:
-            if re.search(pattern, filename):
-                return [
-                    ('Content-Type', content_type),
-                    ('Cache-Control', 'max-age=%d' % cache_life)
-                ]
-        # else
-        return []
+        rule = self.match_rule(self.match_content_types, filename)
+        if rule is not None:
+            return [
+                ('Content-Type', rule[1]),
+                ('Cache-Control', 'max-age=%d' % rule[2])
+            ]
+
+        extension = os.path.splitext(filename)[1].lower()
+        content_type = self.content_types.get(extension)
+        if content_type is None:
+            return []
+        return [
+            ('Content-Type', content_type),
+            ('Cache-Control', 'max-age=%d' % self.cache_lives.get(
+                extension, self.default_cache_life))
+        ]
 
     @classmethod
     def cache_life(cls, filename):
         """ Look up the effective cache life of a given filename. """
-        for pattern, content_type, duration in cls.match_content_types:
-            if re.search(pattern, filename):
-                return duration
-        return cls.default_cache_life
+        rule = cls.match_rule(cls.match_content_types, filename)
+        if rule is not None:
+            return rule[2]
+        extension = os.path.splitext(filename)[1].lower()
+        return cls.cache_lives.get(extension, cls.default_cache_life)
+
+    def reload(self):
+        """ (Re)build the manifest: each file within the static directory,
+            by URL path, with its response metadata and any precompressed
+            variants. Files whose real path lies outside the directory (via
+            symbolic links) are excluded. """
+        static_path, prefix = self.arguments
+        root = os.path.realpath(static_path)
+        suffixes = dict((suffix, encoding) for encoding, suffix in self.encodings)
+        manifest = {}
+
+        for dirpath, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                localpath = os.path.join(dirpath, filename)
+                realpath = os.path.realpath(localpath)
+                if not realpath.startswith(root + os.sep):
+                    continue
+                try:
+                    filestat = os.stat(realpath)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(filestat.st_mode):
+                    continue
+
+                path = os.path.relpath(localpath, root).replace(os.sep, '/')
+                base, suffix = os.path.splitext(path)
+                encoding = suffixes.get(suffix) if self.precompressed else None
+                if encoding is not None:
+                    variants = manifest.setdefault(base, ManifestEntry()).variants
+                    variants[encoding] = (realpath, filestat)
+                else:
+                    entry = manifest.setdefault(path, ManifestEntry())
+                    entry.localpath, entry.filestat = realpath, filestat
+
+        for path, entry in manifest.items():
+            if entry.localpath is None:  # a precompressed file on its own.
+                del manifest[path]
+                continue
+            entry.identity = self.describe(path, entry.localpath, entry.filestat)
+            for encoding, (localpath, filestat) in entry.variants.items():
+                if int(filestat.st_mtime) >= int(entry.filestat.st_mtime):
+                    entry.variants[encoding] = self.describe(
+                        path, localpath, filestat, encoding)
+                else:
+                    del entry.variants[encoding]
+
+        self.manifest = manifest
+
+    def resolve(self, path, encodings):
+        """ The StaticFile to serve for a path in the manifest, if any. """
+        entry = self.manifest.get(path)
+        if entry is None:
+            return None
+        for encoding in encodings:
+            if encoding in entry.variants:
+                return entry.variants[encoding]
+        if self.compress and 'gzip' in encodings:
+            return self.select(path, entry.localpath, entry.filestat, ('gzip',))
+        return entry.identity
 
     def run_before(self, environ, start_response):
-        info = RequestInfo(environ)
+        info = RequestInfo.of(environ)
         static_path, prefix = self.arguments
         path = info.path
 
+        if self.manifest is not None:
+            if prefix and not path.startswith(prefix):
+                return None
+            entry = self.resolve(stripfirst('/', path[len(prefix or ''):]),
+                self.negotiate(environ))
+            if entry is not None:
+                return self.respond(environ, start_response, entry)
+            return None
+
         if prefix and path.startswith(prefix):
             path = path[len(prefix):]
         elif prefix:
@@ -140,14 +557,281 @@ class StaticFileMiddleware(Middleware):
         path = path.replace('..', '').replace('//', '')
         localpath = os.path.join(static_path, path)
 
-        if os.path.isfile(localpath):
+        encodings = self.negotiate(environ)
+
+        if self.memory is not None:
+            entry = self.cached((localpath, encodings))
+            if entry is not None:
+                return self.respond(environ, start_response, entry)
+
+        try:
+            filestat = os.stat(localpath)
+        except OSError:
+            return None
+
+        if stat.S_ISREG(filestat.st_mode):
             # logger.info('Serving file %r', localpath)
-            headers = self.get_headers(path)
-            headers.append(('X-Local-Path', localpath))
-            start_response('200 OK', headers)
-            return sendfile(environ, localpath)
+            return self.serve(environ, start_response,
+                path, localpath, filestat, encodings)
+
+    def negotiate(self, environ):
+        """ The encodings on offer which the client accepts, in order of
+            preference, e.g. ('br', 'gzip'). """
+        if not (self.precompressed or self.compress):
+            return ()
+        accepted = parse_accept_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+        return tuple(
+            encoding for encoding, suffix in self.encodings
+            if (self.precompressed or encoding == 'gzip')
+            and accepts_encoding(accepted, encoding))
+
+    def compressible(self, headers):
+        for name, value in headers:
+            if name == 'Content-Type':
+                return value.startswith(self.compressible_types)
+        return False
+
+    def get_etag(self, localpath, filestat):
+        if not self.etag_hash:
+            return '"%x-%x-%x"' % (
+                filestat.st_ino, filestat.st_size, int(filestat.st_mtime))
+
+        key = (localpath, filestat.st_size, filestat.st_mtime)
+        etag = self.digests.get(key)
+        if etag is None:
+            digest = hashlib.md5()
+            with open(localpath, 'rb') as stream:
+                for block in iter(lambda: stream.read(65536), ''):
+                    digest.update(block)
+            etag = '"%s"' % digest.hexdigest()
+            self.digests.set(key, etag)
+        return etag
+
+    @classmethod
+    def not_modified(cls, environ, etag, mtime):
+        """ Whether the client's cached copy is current, per If-None-Match
+            (weak comparison) or else If-Modified-Since. """
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            if if_none_match.strip() == '*':
+                return True
+            for tag in if_none_match.split(','):
+                tag = tag.strip()
+                if (tag[2:] if tag.startswith('W/') else tag) == etag:
+                    return True
+            return False
+
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since and mtime is not None:
+            since = parsedate_tz(if_modified_since)
+            if since is not None:
+                return int(mtime) <= mktime_tz(since)
+        return False
+
+    @classmethod
+    def requested_range(cls, environ, size, validators):
+        """ The (start, stop) byte range requested, if any, or False when the
+            range cannot be satisfied. An `If-Range` validator that does not
+            match the file causes the whole file to be served. """
+        if environ.get('REQUEST_METHOD') != 'GET':
+            return None
+
+        byterange = Range.parse(environ.get('HTTP_RANGE'))
+        if byterange is None:
+            return None
+
+        if_range = environ.get('HTTP_IF_RANGE')
+        if if_range and if_range not in validators:
+            return None
+
+        start, stop = byterange.start, byterange.end
+        if stop is None:
+            stop = size
+            if start < 0:  # suffix range, i.e. the last N bytes.
+                start = max(start + size, 0)
+        stop = min(stop, size)
+        return (start, stop) if start < stop else False
+
+    def describe(self, path, localpath, filestat, encoding = None, content = None):
+        """ Collect a file's validators and response headers. A file may be
+            served in an encoding, from a precompressed sibling file or from
+            content compressed in memory. """
+        entry = StaticFile(localpath, filestat)
+        entry.etag = self.get_etag(localpath, filestat)
+        if content is not None:
+            entry.etag = '%s-%s"' % (entry.etag[:-1], encoding)
+            entry.size = len(content)
+            entry.load(content)
+        entry.last_modified = formatdate(filestat.st_mtime, usegmt=True)
+        entry.headers = self.get_headers(path) + [
+            ('ETag', entry.etag),
+            ('Last-Modified', entry.last_modified)
+        ]
+        if self.precompressed or (self.compress and self.compressible(entry.headers)):
+            entry.headers.append(('Vary', 'Accept-Encoding'))
+        if encoding is not None:
+            entry.headers.append(('Content-Encoding', encoding))
+        entry.full_headers = entry.headers + [
+            ('X-Local-Path', localpath),
+            ('Accept-Ranges', 'bytes'),
+            ('Content-Length', str(entry.size))
+        ]
+        return entry
+
+    def select(self, path, localpath, filestat, encodings):
+        """ Describe the best representation of a file for the client. """
+        for encoding, suffix in self.encodings:
+            if encoding not in encodings:
+                continue
+
+            if self.precompressed:
+                try:
+                    variant = os.stat(localpath + suffix)
+                except OSError:
+                    variant = None
+                if variant and stat.S_ISREG(variant.st_mode) and \
+                        int(variant.st_mtime) >= int(filestat.st_mtime):
+                    return self.describe(path, localpath + suffix, variant, encoding)
+
+            if self.compress and encoding == 'gzip' and \
+                    filestat.st_size <= self.compress_max_file and \
+                    self.compressible(self.get_headers(path)):
+                key = (localpath, filestat.st_size, filestat.st_mtime)
+                content = self.compressed.get(key)
+                if content is None:
+                    with open(localpath, 'rb') as stream:
+                        content = gzip_compress(stream.read(), self.compress_level)
+                    self.compressed.set(key, content)
+                return self.describe(path, localpath, filestat, encoding, content)
+
+        return self.describe(path, localpath, filestat)
+
+    def serve(self, environ, start_response, path, localpath, filestat, encodings = ()):
+        entry = self.select(path, localpath, filestat, encodings)
+        if self.memory is not None and entry.size <= self.memory_max_file:
+            if entry.content is None:
+                with open(entry.localpath, 'rb') as stream:
+                    entry.load(stream.read())
+            entry.checked = time.time()
+            if entry.localpath != localpath:
+                # a variant is only current while its original is unchanged.
+                entry.source = (localpath, filestat.st_size, filestat.st_mtime)
+            self.memory.set((localpath, encodings), entry)
+        return self.respond(environ, start_response, entry)
+
+    def respond(self, environ, start_response, entry):
+        if environ.get('REQUEST_METHOD') in ('GET', 'HEAD') and \
+                self.not_modified(environ, entry.etag, entry.mtime):
+            start_response('304 Not Modified', [
+                header for header in entry.headers
+                if header[0] not in ('Content-Type', 'Content-Encoding') ])
+            return []
+
+        size = entry.size
+        byterange = self.requested_range(environ, size,
+            (entry.etag, entry.last_modified))
+
+        if byterange is None:
+            start_response('200 OK', entry.full_headers)
+            return entry.body(environ)
+
+        elif byterange is False:
+            start_response('416 Requested Range Not Satisfiable', [
+                ('Content-Range', 'bytes */%d' % size),
+                ('Content-Length', '0') ])
+            return []
+
+        start, stop = byterange
+        start_response('206 Partial Content', entry.headers + [
+            ('X-Local-Path', entry.localpath),
+            ('Accept-Ranges', 'bytes'),
+            ('Content-Range', 'bytes %d-%d/%d' % (start, stop - 1, size)),
+            ('Content-Length', str(stop - start))
+        ])
+        return entry.body(environ, start, stop - start)
+
+    def cached(self, key):
+        """ A file held in memory, if still current. Its modification time is
+            checked at most once per `memory_check_interval` seconds. """
+        entry = self.memory.get(key)
+        if entry is None:
+            return None
+
+        now = time.time()
+        if now - entry.checked < self.memory_check_interval:
+            return entry
+
+        try:
+            filestat = os.stat(entry.localpath)
+            if entry.source is not None:
+                source = os.stat(entry.source[0])
+                if (source.st_size, source.st_mtime) != entry.source[1:]:
+                    filestat = None
+        except OSError:
+            filestat = None
+        if filestat is None or not entry.matches(filestat):
+            self.memory.pop(key)
+            return None
+
+        entry.checked = now
+        return entry
+
+    def memory_stats(self):
+        """ Statistics of the in-memory file cache, for monitoring. """
+        if self.memory is None:
+            return None
+        stats = self.memory.stats()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = (float(stats['hits']) / lookups) if lookups else 0.0
+        stats['resident_bytes'] = stats['size']
+        return stats
+
+
+
+class ManifestEntry(object):
+    """ A file indexed by StaticFileMiddleware's manifest. """
+
+    __slots__ = ('localpath', 'filestat', 'identity', 'variants')
+
+    def __init__(self):
+        self.localpath = None
+        self.filestat = None
+        self.identity = None
+        self.variants = {}
+
+
+
+class StaticFile(object):
+    """ The response metadata of a static file, and optionally its content. """
+
+    __slots__ = (
+        'localpath', 'version', 'size', 'mtime', 'etag', 'last_modified',
+        'headers', 'full_headers', 'content', 'checked', 'source'
+    )
+
+    def __init__(self, localpath, filestat):
+        self.localpath = localpath
+        self.version = (filestat.st_size, filestat.st_mtime, filestat.st_ino)
+        self.size = filestat.st_size
+        self.mtime = filestat.st_mtime
+        self.content = None
+        self.checked = 0
+        self.source = None  # (path, size, mtime) of the original of a variant
+
+    def load(self, content):
+        self.content = [content]
+
+    def matches(self, filestat):
+        return self.version == \
+            (filestat.st_size, filestat.st_mtime, filestat.st_ino)
+
+    def body(self, environ, offset = 0, length = None):
+        if self.content is None:
+            return sendfile(environ, self.localpath, offset, length)
+        elif length is None:
+            return self.content
         else:
-            pass
+            return [self.content[0][offset:offset + length]]
 
 
 
@@ -160,13 +844,487 @@ class Shortener(RedirectionMiddleware):
             # /s/abc => 302 http://abc.com
             shortener.redirect('abc', 'http://abc.com')
 
+            # links in bulk, from rows or a store (see tackle.redirects)
+            shortener.load(read_csv('links.csv'))
+            shortener = Shortener(basepath = "/s/",
+                                  store = SQLiteRedirectStore('links.db'))
+
+        Links registered directly take precedence over those in the store.
+        Rules for links found in the store are cached (up to
+        `store_cache_size`) until the store's content is replaced.
     """
 
 
     def __init__(self, *args, **kwargs):
         self.basepath = kwargs.pop('basepath', '/')
+        self.store = kwargs.pop('store', None)
+        self.store_rules = LRUCache(kwargs.pop('store_cache_size', 4096))
+        self.store_generation = None
         super(Shortener, self).__init__(*args, **kwargs)
 
     def redirect(self, reference, destination_url, permanent = False):
         pattern = self.basepath + reference + '$'
         super(Shortener, self).redirect(pattern, destination_url, permanent)
+
+    def load(self, rows):
+        """ Register (reference, destination_url, permanent) rows. """
+        for reference, destination_url, permanent in rows:
+            self.redirect(reference, destination_url, permanent)
+
+    def lookup(self, path):
+        rule, match = super(Shortener, self).lookup(path)
+        if rule is None and self.store is not None and \
+                path.startswith(self.basepath):
+            rule = self.store_rule(path[len(self.basepath):])
+        return rule, match
+
+    def store_rule(self, reference):
+        """ The rule for a link in the store, or None; rules are reused until
+            the store's generation changes. """
+        store, rules = self.store, self.store_rules
+        store.refresh()
+        if self.store_generation != store.generation:
+            rules.clear()
+            self.store_generation = store.generation
+
+        rule = rules.get(reference)
+        if rule is None:
+            link = store.get(reference)
+            if link is not None:
+                rule = RedirectRule(-1, reference, link[0], link[1])
+                rules.set(reference, rule)
+        return rule
+
+
+
+class ResponseCacheMiddleware(Middleware):
+    """ WSGI Middleware caching complete responses to GET (and HEAD)
+        requests, in a pluggable backend (see tackle.cache).
+
+        Responses are stored when their status is cacheable and they carry a
+        freshness lifetime (`s-maxage`, `max-age` or `Expires`; otherwise
+        `default_ttl` seconds, 0 by default), unless marked `no-store`,
+        `private` or `no-cache`, setting cookies, or varying on `*`. Variants
+        are keyed on the request headers named by `Vary`. Requests with
+        `Cache-Control: no-cache` (or `max-age=0`) refresh the cached copy.
+
+        Concurrent misses for the same key within this process are coalesced:
+        the first request is passed upstream, and the others wait up to
+        `coalesce_timeout` seconds for its response to be cached, or found
+        uncacheable.
+
+        Usage:
+            cache = ResponseCacheMiddleware(default_ttl = 60)
+            app = cache.wsgi(upstream_app)
+
+            # shared by worker processes
+            cache = ResponseCacheMiddleware(
+                backend = FileResponseCache('/dev/shm/app-cache'))
+    """
+
+    backend_class = MemoryResponseCache
+
+    cacheable_statuses = frozenset([200, 203, 204, 300, 301, 404, 405, 410, 414, 501])
+
+    uncacheable_directives = ('no-store', 'private', 'no-cache')
+
+    # Requests carrying these headers are passed through, uncached.
+    bypass_headers = ('HTTP_AUTHORIZATION', 'HTTP_RANGE')
+
+
+    def __init__(self, backend = None, default_ttl = 0, max_body = 1 << 20,
+            coalesce_timeout = 10.0, **backend_options):
+        self.backend = backend or self.backend_class(**backend_options)
+        self.default_ttl = default_ttl
+        self.max_body = max_body
+        self.coalesce_timeout = coalesce_timeout
+        self.lock = threading.Lock()
+        self.pending = {}  # key => Event, for misses in progress.
+
+    def key(self, environ):
+        return '%s://%s%s?%s' % (
+            environ.get('wsgi.url_scheme', 'http'),
+            environ.get('HTTP_HOST') or environ.get('SERVER_NAME', ''),
+            environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', ''),
+            environ.get('QUERY_STRING', ''))
+
+    @staticmethod
+    def variant_key(key, vary, environ):
+        values = [environ.get('HTTP_' + name.upper().replace('-', '_'), '')
+                  for name in vary]
+        return '\0'.join([key] + values)
+
+    def lookup(self, key, environ):
+        vary = self.backend.get(key + '\0vary')
+        if vary is None:
+            return None
+        return self.backend.get(self.variant_key(key, vary, environ))
+
+    def ttl(self, status, headers):
+        """ The freshness lifetime of a response, or None if not cacheable. """
+        try:
+            code = int(status.split(None, 1)[0])
+        except ValueError:
+            return None
+        if code not in self.cacheable_statuses:
+            return None
+
+        fields = dict((name.lower(), value) for name, value in headers)
+        if 'set-cookie' in fields or fields.get('vary', '').strip() == '*':
+            return None
+
+        directives = parse_cache_control(fields.get('cache-control'))
+        if any(name in directives for name in self.uncacheable_directives):
+            return None
+
+        ttl = self.default_ttl
+        for name in ('s-maxage', 'max-age'):
+            if name in directives:
+                try:
+                    ttl = int(directives[name])
+                except (TypeError, ValueError):
+                    return None
+                break
+        else:
+            if 'expires' in fields:
+                expires = parsedate_tz(fields['expires'])
+                ttl = (mktime_tz(expires) - time.time()) if expires else 0
+
+        return ttl if ttl > 0 else None
+
+    def store(self, key, environ, response):
+        ttl = self.ttl(response.status, response.headers)
+        if ttl is None:
+            return False
+        vary = tuple(name.strip().lower()
+                     for name in (response.header('Vary') or '').split(',')
+                     if name.strip())
+        self.backend.set(key + '\0vary', vary, ttl)
+        return self.backend.set(self.variant_key(key, vary, environ), response, ttl)
+
+    def respond(self, environ, start_response, response):
+        headers = list(response.headers)
+        headers.append(('Age', str(int(max(0, time.time() - response.created)))))
+
+        etag = response.header('ETag')
+        if etag and etag.startswith('W/'):
+            etag = etag[2:]
+        modified = parsedate_tz(response.header('Last-Modified') or '')
+        modified = mktime_tz(modified) if modified else None
+        if StaticFileMiddleware.not_modified(environ, etag, modified):
+            start_response('304 Not Modified', [(name, value)
+                for name, value in headers
+                if name.lower() not in ('content-type', 'content-length')])
+            return []
+
+        start_response(response.status, headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        return [response.body]
+
+
+    def wsgi(self, app):
+        def __wrapper__(environ, start_response):
+            return self.handle(app, environ, start_response)
+        return forward_finalize(__wrapper__, app)
+
+    def handle(self, app, environ, start_response):
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if method not in ('GET', 'HEAD') or \
+                any(name in environ for name in self.bypass_headers):
+            return app(environ, start_response)
+
+        directives = parse_cache_control(environ.get('HTTP_CACHE_CONTROL'))
+        if 'no-store' in directives:
+            return app(environ, start_response)
+
+        key = self.key(environ)
+        refresh = 'no-cache' in directives or directives.get('max-age') == '0'
+        if not refresh:
+            response = self.lookup(key, environ)
+            if response is not None:
+                return self.respond(environ, start_response, response)
+        if method == 'HEAD':
+            return app(environ, start_response)
+
+        with self.lock:
+            event = self.pending.get(key)
+            leader = event is None
+            if leader:
+                event = self.pending[key] = threading.Event()
+
+        if not leader:
+            event.wait(self.coalesce_timeout)
+            response = self.lookup(key, environ)
+            if response is not None:
+                return self.respond(environ, start_response, response)
+
+        def release():
+            with self.lock:
+                if self.pending.get(key) is event:
+                    del self.pending[key]
+            event.set()
+
+        def finish(captured, body):
+            try:
+                if captured and body is not None:
+                    response = CachedResponse(captured[0], captured[1], body)
+                    self.store(key, environ, response)
+            finally:
+                if leader:
+                    release()
+
+        def started(status, headers):
+            if leader and self.ttl(status, headers) is None:
+                release()  # nothing to wait for.
+
+        try:
+            return self.record(app, environ, start_response, finish, started)
+        except:
+            if leader:
+                release()
+            raise
+
+    def record(self, app, environ, start_response, finish, started = None):
+        """ Pass a response through, capturing it for the cache. `finish` is
+            called as soon as the body is captured, or given up on; `started`
+            with the status and headers, once the response starts. """
+        captured = []
+
+        def capture_start_response(status, headers, exc_info = None):
+            captured[:] = [status, list(headers)]
+            if started is not None:
+                started(status, headers)
+            write = start_response(status, headers, exc_info)
+            def capture_write(data):
+                captured.append(None)  # bodies written directly aren't cached.
+                return write(data)
+            return capture_write
+
+        result = app(environ, capture_start_response)
+        return RecordingIterator(result, captured, self.max_body, finish)
+
+
+
+class RecordingIterator(ResponseStream):
+    """ A response stream which records the chunks passing through, then
+        calls `finish(captured, body)` once: with the body as soon as the
+        response is completely iterated, within `max_body` bytes, or with
+        None when the body grows too large, or the stream is closed first. """
+
+    def __init__(self, result, captured, max_body, finish):
+        super(RecordingIterator, self).__init__(
+            result, self.record, self.completed, self.closed)
+        self.captured = captured
+        self.max_body = max_body
+        self.recorded = finish
+        self.chunks = []
+        self.size = 0
+
+    def report(self, body):
+        recorded, self.recorded = self.recorded, None
+        if recorded is not None:
+            recorded(self.captured, body)
+
+    def record(self, chunk):
+        if self.chunks is not None:
+            self.size = self.size + len(chunk)
+            if self.size > self.max_body:
+                self.chunks = None
+                self.report(None)
+            else:
+                self.chunks.append(chunk)
+        return chunk
+
+    def completed(self):
+        body = None
+        if self.chunks is not None and len(self.captured) == 2:
+            body = ''.join(self.chunks)
+        self.chunks = None
+        self.report(body)
+
+    def closed(self):
+        self.report(None)
+
+
+
+class CompressionMiddleware(Middleware):
+    """ WSGI Middleware compressing responses with gzip (or Brotli, when the
+        `brotli` module is installed) for clients accepting it, chunk by
+        chunk as the response streams through.
+
+        Responses are compressed when their Content-Type starts with one of
+        `types`, and their Content-Length (when given) is at least
+        `minimum_size`. Responses already encoded, partial (or to Range
+        requests), marked `no-transform`, or to HEAD requests pass through
+        unchanged. `Vary: Accept-Encoding` is added to every response of a
+        compressible type.
+
+        With `threads`, bodies of `threaded_size` bytes or more are
+        compressed by a thread pool, one chunk ahead of the chunk being sent,
+        so higher levels cost less time in the worker's own thread. The pool
+        is started in each (forked) process on first use; close() stops it.
+
+        Usage:
+            app = CompressionMiddleware(level = 6).wsgi(upstream_app)
+    """
+
+    environ_key = 'tackle.compression'
+
+    encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    compressible_types = StaticFileMiddleware.compressible_types
+
+    skipped_statuses = ('204', '206', '304')
+
+    def __init__(self, minimum_size = 512, level = 6, types = None,
+            threads = 0, threaded_size = 1 << 20):
+        self.minimum_size = minimum_size
+        self.level = level
+        self.types = tuple(types) if types else self.compressible_types
+        self.threads = threads
+        self.threaded_size = threaded_size
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        """ The compression thread pool, started on first use in each
+            process; a pool inherited across fork() has no threads. """
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = ThreadPool(self.threads)
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def close(self):
+        """ Stop this process's compression threads, if any were started. """
+        with self._lock:
+            pool, self._pool = self._pool, None
+            if pool is not None and self._pool_pid == os.getpid():
+                pool.terminate()
+                pool.join()
+
+    def negotiate(self, environ):
+        """ The preferred encoding the client accepts, or None. """
+        accepted = parse_accept_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+        for encoding in self.encodings:
+            if accepts_encoding(accepted, encoding):
+                return encoding
+        return None
+
+    def compressor(self, encoding):
+        if encoding == 'br':
+            return BrotliCompressor(min(self.level, 11))
+        return gzip_compressor(self.level)
+
+    def run_before(self, environ, start_response):
+        environ.pop(self.environ_key, None)
+
+    def run_start_response(self, environ, status, headers):
+        environ[self.environ_key] = None
+        fields = dict((name.lower(), value) for name, value in headers)
+
+        if not fields.get('content-type', '').startswith(self.types):
+            return None
+        vary = fields.get('vary')
+        if not vary:
+            headers.append(('Vary', 'Accept-Encoding'))
+        elif 'accept-encoding' not in vary.lower() and vary.strip() != '*':
+            headers = [(name, value + ', Accept-Encoding'
+                        if name.lower() == 'vary' else value)
+                       for name, value in headers]
+
+        length = fields.get('content-length')
+        if status[:3] in self.skipped_statuses or 'content-encoding' in fields \
+                or 'content-range' in fields or 'HTTP_RANGE' in environ \
+                or environ.get('REQUEST_METHOD') == 'HEAD' \
+                or 'no-transform' in parse_cache_control(fields.get('cache-control')) \
+                or (length is not None and length.isdigit() and
+                    int(length) < self.minimum_size):
+            return status, headers
+
+        encoding = self.negotiate(environ)
+        if encoding is None:
+            return status, headers
+
+        threaded = self.threads and length is not None and length.isdigit() \
+            and int(length) >= self.threaded_size
+        environ[self.environ_key] = (self.compressor(encoding), threaded)
+
+        rewritten = [('Content-Encoding', encoding)]
+        for name, value in headers:
+            lower = name.lower()
+            if lower == 'content-length':
+                continue
+            if lower == 'etag' and not value.startswith('W/'):
+                value = 'W/' + value  # the encoded body differs byte-wise.
+            rewritten.append((name, value))
+        return status, rewritten
+
+    def wrap_start_response(self, environ, start_response):
+        """ Compress what the application passes to `write()` too. """
+        rewrite = super(CompressionMiddleware, self).wrap_start_response(
+            environ, start_response)
+        def __start_response__(status, headers, exc_info = None):
+            write = rewrite(status, headers, exc_info)
+            compression = environ.get(self.environ_key)
+            if compression is None:
+                return write
+            compressor = compression[0]
+            def __write__(data):
+                # the body's chunks must follow these in the same stream.
+                environ[self.environ_key] = (compressor, False)
+                data = compressor.compress(data)
+                if data:
+                    write(data)
+            return __write__
+        return __start_response__
+
+    def run_after(self, environ, start_response, result):
+        if self.environ_key in environ and environ[self.environ_key] is None:
+            return result  # already known to pass through.
+        state = []  # [compressor, threaded, pending result]
+
+        def started():
+            if not state:
+                compression = environ.get(self.environ_key)
+                state[:] = [None, False, None] if compression is None \
+                    else [compression[0], compression[1], None]
+            return state[0] is not None
+
+        def transform(chunk):
+            if not started():
+                return chunk
+            compressor, threaded, pending = state
+            if not threaded:
+                return compressor.compress(chunk)
+            # compress this chunk in the pool while the last is sent.
+            previous = pending.get() if pending is not None else ''
+            state[2] = self.pool.apply_async(compressor.compress, (chunk,))
+            return previous
+
+        def finish():
+            if not started():
+                return ''
+            compressor, threaded, pending = state
+            previous = pending.get() if pending is not None else ''
+            return previous + compressor.flush()
+
+        return self.stream(result, transform, finish)
+
+
+
+class BrotliCompressor(object):
+    """ A streaming Brotli compressor, with zlib's compress/flush interface. """
+
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality = quality)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
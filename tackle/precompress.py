@@ -0,0 +1,114 @@
+# Build-time compression of static assets.
+# Copyright (c) 2015, Sam Briesemeister
+# Licensed under the Python Software Foundation License.
+
+""" Writes '.gz' (and, when the `brotli` module is installed, '.br') siblings
+    of compressible files in a static directory, for StaticFileMiddleware's
+    `precompressed` option. Files are compressed in parallel by a process
+    pool; siblings newer than their source are left alone.
+
+    Usage:
+        python -m tackle.precompress [--level 9] [--workers 4] static/
+"""
+
+from tackle.util import gzip_compress
+from tackle.middleware import StaticFileMiddleware
+
+import os
+import sys
+import argparse
+import multiprocessing
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Files smaller than this rarely benefit from compression.
+MINIMUM_SIZE = 256
+
+
+def compressors(level):
+    yield '.gz', lambda data: gzip_compress(data, level)
+    if brotli is not None:
+        yield '.br', lambda data: brotli.compress(data, quality = min(level, 11))
+
+
+def compressible(filename):
+    if filename.endswith(('.gz', '.br')):
+        return False
+    extension = os.path.splitext(filename)[1].lower()
+    content_type = StaticFileMiddleware.content_types.get(extension)
+    return bool(content_type) and \
+        content_type.startswith(StaticFileMiddleware.compressible_types)
+
+
+def candidates(root, minimum_size = MINIMUM_SIZE):
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if compressible(path) and os.path.getsize(path) >= minimum_size:
+                yield path
+
+
+def compress_file(job):
+    """ Write the compressed siblings of one file, returning those written.
+        Siblings take the source's modification time, and are only kept
+        when smaller than the source. """
+    path, level = job
+    source = os.stat(path)
+    written = []
+    data = None
+
+    for suffix, compress in compressors(level):
+        target = path + suffix
+        if os.path.exists(target) and \
+                int(os.stat(target).st_mtime) >= int(source.st_mtime):
+            continue
+        if data is None:
+            with open(path, 'rb') as stream:
+                data = stream.read()
+
+        compressed = compress(data)
+        if len(compressed) >= len(data):
+            continue
+
+        temporary = '%s.%d.tmp' % (target, os.getpid())
+        with open(temporary, 'wb') as stream:
+            stream.write(compressed)
+        os.utime(temporary, (source.st_atime, source.st_mtime))
+        os.rename(temporary, target)
+        written.append(target)
+
+    return written
+
+
+def precompress(root, level = 9, workers = None, minimum_size = MINIMUM_SIZE):
+    """ Compress all candidate files below `root`, returning the files written. """
+    jobs = [(path, level) for path in candidates(root, minimum_size)]
+    pool = multiprocessing.Pool(workers or multiprocessing.cpu_count())
+    try:
+        results = pool.map(compress_file, jobs, chunksize = 8)
+    finally:
+        pool.close()
+        pool.join()
+    return [target for written in results for target in written]
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description = 'Precompress static files.')
+    parser.add_argument('directory')
+    parser.add_argument('--level', type = int, default = 9)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--minimum-size', type = int, default = MINIMUM_SIZE)
+    options = parser.parse_args(args)
+
+    written = precompress(options.directory,
+        options.level, options.workers, options.minimum_size)
+    for target in written:
+        print(target)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
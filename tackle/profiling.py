@@ -0,0 +1,166 @@
+# Request profiling.
+# Copyright (c) 2015, Sam Briesemeister
+# Licensed under the Python Software Foundation License.
+
+""" Traces of the handlers of sampled or slow requests.
+
+    A WSGIApplication given a `profiler` runs each request's handler through
+    it. A `sample_rate` fraction of requests is profiled with cProfile, and
+    written as pstats files ('.prof'). With a `slow_threshold` (in seconds),
+    every other request's thread is sampled by a background thread every
+    `sample_interval` seconds, and requests taking longer than the threshold
+    are written as folded stacks ('.folded', one "frame;frame;... count"
+    line per stack, as read by flamegraph.pl).
+
+    Files are named for their time, method, route and duration, e.g.
+    "20150601-120000.123-GET-item-250ms-4242-0.prof", and only the newest
+    `max_files` are kept.
+
+    Usage:
+        profiler = RequestProfiler('/var/tmp/profiles',
+                                   sample_rate = 0.001, slow_threshold = 0.5)
+        app = WSGIApplication(..., profiler = profiler)
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import cProfile
+import itertools
+import threading
+
+
+class StackSampler(object):
+    """ A daemon thread recording the stacks of registered threads. While no
+        thread is registered, it waits rather than waking every interval. """
+
+    def __init__(self, interval = 0.005):
+        self.interval = interval
+        self.active = {}  # thread id => list of sampled stacks
+        self.lock = threading.Lock()
+        self.busy = threading.Event()  # set while `active` is not empty.
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target = self.run,
+                                               name = 'tackle-stack-sampler')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def track(self):
+        """ Sample the current thread until untrack(), returning its samples. """
+        if self.thread is None:
+            self.start()
+        samples = []
+        with self.lock:
+            self.active[threading.current_thread().ident] = samples
+            self.busy.set()
+        return samples
+
+    def untrack(self):
+        with self.lock:
+            self.active.pop(threading.current_thread().ident, None)
+            if not self.active:
+                self.busy.clear()
+
+    def run(self):
+        while True:
+            self.busy.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for ident, samples in self.active.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    samples.append(self.stack(frame))
+
+    @staticmethod
+    def stack(frame):
+        """ The frames of a stack as (filename, function, line), outermost first. """
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_name, frame.f_lineno))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    @staticmethod
+    def fold(samples):
+        """ Samples in the folded format: "frame;frame;... count" lines. """
+        counts = {}
+        for stack in samples:
+            key = ';'.join('%s (%s:%d)' % (function, os.path.basename(filename), line)
+                           for filename, function, line in stack)
+            counts[key] = counts.get(key, 0) + 1
+        return ''.join('%s %d\n' % item for item in sorted(counts.items()))
+
+
+
+class RequestProfiler(object):
+
+    sampler_class = StackSampler
+
+    def __init__(self, directory, sample_rate = 0.0, slow_threshold = None,
+            sample_interval = 0.005, max_files = 200):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.max_files = max_files
+        self.sampler = self.sampler_class(sample_interval)
+        self.lock = threading.Lock()
+        self.sequence = itertools.count()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __call__(self, route, environ, func, *args):
+        """ Call func(*args) for a request to `route`, tracing it if chosen. """
+        if self.sample_rate and random.random() < self.sample_rate:
+            profile = cProfile.Profile()
+            started = time.time()
+            try:
+                return profile.runcall(func, *args)
+            finally:
+                filename = self.filename(route, environ, time.time() - started, '.prof')
+                profile.dump_stats(filename)
+                self.rotate()
+
+        if self.slow_threshold is None:
+            return func(*args)
+
+        samples = self.sampler.track()
+        started = time.time()
+        try:
+            return func(*args)
+        finally:
+            self.sampler.untrack()
+            duration = time.time() - started
+            if duration >= self.slow_threshold and samples:
+                filename = self.filename(route, environ, duration, '.folded')
+                with open(filename, 'wb') as stream:
+                    stream.write(self.sampler.fold(samples))
+                self.rotate()
+
+    def filename(self, route, environ, duration, extension):
+        now = time.time()
+        name = '%s.%03d-%s-%s-%dms-%d-%d%s' % (
+            time.strftime('%Y%m%d-%H%M%S', time.localtime(now)),
+            int(now * 1000) % 1000,
+            environ.get('REQUEST_METHOD', 'GET'),
+            re.sub(r'[^\w.-]+', '_', str(route)).strip('_') or 'root',
+            int(duration * 1000), os.getpid(), next(self.sequence), extension)
+        return os.path.join(self.directory, name)
+
+    def rotate(self):
+        """ Remove the oldest traces beyond `max_files`. """
+        with self.lock:
+            names = sorted(name for name in os.listdir(self.directory)
+                           if name.endswith(('.prof', '.folded')))
+            for name in names[:max(0, len(names) - self.max_files)]:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
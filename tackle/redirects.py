@@ -0,0 +1,207 @@
+# Bulk redirect (short link) stores.
+# Copyright (c) 2015, Sam Briesemeister
+# Licensed under the Python Software Foundation License.
+
+""" Sources of short links for Shortener, loaded in bulk rather than by
+    registering each link with redirect().
+
+    Links are (code, target URL, permanent) rows, read from CSV or JSON
+    lines files. They can be held in memory (MemoryRedirectStore, or
+    Shortener.load()), or compiled into an SQLite database file which all
+    worker processes read in place (SQLiteRedirectStore), and which can be
+    replaced while they run.
+
+    Usage:
+        python -m tackle.redirects links.csv links.db
+
+        shortener = Shortener(basepath = '/s/',
+                              store = SQLiteRedirectStore('links.db'))
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import sqlite3
+import threading
+
+
+TRUTHY = ('1', 'true', 'yes', 'permanent', '301')
+
+
+def read_csv(filename):
+    """ Read (code, target, permanent) rows from a CSV file, with an optional
+        third column marking permanent redirects (e.g. 'true' or '301'). """
+    with open(filename, 'rb') as stream:
+        for row in csv.reader(stream):
+            if len(row) < 2 or not row[0] or row[0].startswith('#'):
+                continue
+            permanent = len(row) > 2 and row[2].strip().lower() in TRUTHY
+            yield row[0].strip(), row[1].strip(), permanent
+
+
+def read_jsonl(filename):
+    """ Read (code, target, permanent) rows from a file of JSON objects, one
+        per line, e.g. {"code": "abc", "target": "http://...", "permanent": true} """
+    with open(filename, 'rb') as stream:
+        for line in stream:
+            if not line.strip():
+                continue
+            link = json.loads(line)
+            yield (link['code'].encode('utf-8'), link['target'].encode('utf-8'),
+                   bool(link.get('permanent', False)))
+
+
+def read_links(filename):
+    """ Read rows from a CSV or JSON lines file, by its extension. """
+    if filename.endswith(('.jsonl', '.json')):
+        return read_jsonl(filename)
+    return read_csv(filename)
+
+
+
+class RedirectStore(object):
+    """ A source of short links: code => (target URL, permanent).
+
+        Subclasses implement find(), and refresh() when their content can be
+        replaced while in use; get() refreshes the store before each lookup.
+    """
+
+    # Incremented whenever the content of the store is replaced.
+    generation = 0
+
+    def refresh(self):
+        """ Pick up replaced content; True when the generation changed. """
+        return False
+
+    def find(self, code):
+        raise NotImplementedError
+
+    def get(self, code):
+        self.refresh()
+        return self.find(code)
+
+    def __contains__(self, code):
+        return self.get(code) is not None
+
+
+
+class MemoryRedirectStore(RedirectStore):
+
+    def __init__(self, rows = ()):
+        self.links = {}
+        self.load(rows)
+
+    def load(self, rows):
+        links = self.links
+        for code, target, permanent in rows:
+            if code not in links:  # the first definition wins.
+                links[code] = (target, bool(permanent))
+
+    def find(self, code):
+        return self.links.get(code)
+
+
+
+class SQLiteRedirectStore(RedirectStore):
+    """ Links in an SQLite database file, as written by build_sqlite().
+
+        The file is memory-mapped, so its pages are cached once by the
+        operating system and shared by every process reading it, rather than
+        copied into each worker's heap. When the file is replaced (renamed
+        over), the new file is used from the next lookup after at most
+        `check_interval` seconds.
+    """
+
+    query = 'SELECT target, permanent FROM links WHERE code = ?'
+
+    def __init__(self, filename, check_interval = 1.0, mmap_size = 1 << 30):
+        self.filename = filename
+        self.check_interval = check_interval
+        self.mmap_size = mmap_size
+        self.local = threading.local()  # connections are per thread.
+        self.identity = self.stat()
+        self.checked = time.time()
+
+    def stat(self):
+        filestat = os.stat(self.filename)
+        return (filestat.st_ino, filestat.st_size, filestat.st_mtime)
+
+    def refresh(self):
+        """ Check whether the file was replaced, at most once per interval. """
+        now = time.time()
+        if now - self.checked < self.check_interval:
+            return False
+        self.checked = now
+
+        try:
+            identity = self.stat()
+        except OSError:
+            return False  # mid-replacement; keep the open file.
+        if identity != self.identity:
+            self.identity = identity
+            self.generation = self.generation + 1
+            return True
+        return False
+
+    def connection(self):
+        local = self.local
+        if getattr(local, 'generation', None) != self.generation:
+            if getattr(local, 'connection', None) is not None:
+                local.connection.close()
+            connection = sqlite3.connect(self.filename)
+            connection.text_factory = str
+            connection.execute('PRAGMA query_only = 1')
+            connection.execute('PRAGMA mmap_size = %d' % self.mmap_size)
+            local.connection = connection
+            local.generation = self.generation
+        return local.connection
+
+    def find(self, code):
+        row = self.connection().execute(self.query, (code,)).fetchone()
+        if row is None:
+            return None
+        return row[0], bool(row[1])
+
+
+
+def build_sqlite(rows, filename):
+    """ Write (code, target, permanent) rows to an SQLite database, replacing
+        any existing file atomically, so running readers switch over cleanly.
+        Where a code is repeated, its first row wins. Returns the row count. """
+    temporary = '%s.%d.tmp' % (filename, os.getpid())
+    if os.path.exists(temporary):
+        os.remove(temporary)
+
+    connection = sqlite3.connect(temporary)
+    try:
+        connection.text_factory = str
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.execute(
+            'CREATE TABLE links (code TEXT PRIMARY KEY, target TEXT NOT NULL, '
+            'permanent INTEGER NOT NULL) WITHOUT ROWID')
+        connection.executemany('INSERT OR IGNORE INTO links VALUES (?, ?, ?)',
+            ((code, target, int(bool(permanent)))
+             for code, target, permanent in rows))
+        connection.commit()
+        count = connection.execute('SELECT COUNT(*) FROM links').fetchone()[0]
+    finally:
+        connection.close()
+
+    os.rename(temporary, filename)
+    return count
+
+
+
+def main(args):
+    if len(args) != 2:
+        sys.stderr.write('Usage: python -m tackle.redirects LINKS.(csv|jsonl) OUTPUT.db\n')
+        return 2
+    count = build_sqlite(read_links(args[0]), args[1])
+    print('%d links written to %s' % (count, args[1]))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,391 @@
+# A preforking WSGI server.
+# Copyright (c) 2015, Sam Briesemeister
+# Licensed under the Python Software Foundation License.
+
+""" A production entry point for tackle applications, using only the
+    standard library: a master process forks `workers` processes (by default
+    one per CPU), each serving requests from a pool of `threads` threads.
+
+    - Workers accept from one listening socket opened by the master, or with
+      `reuse_port`, from their own sockets bound with SO_REUSEPORT, which
+      the kernel balances between.
+    - With `preload` (the default), the application is imported by the
+      master before forking, and finalized (see WSGIApplication.finalize),
+      so workers share its compiled routes, manifests and other read-only
+      state copy-on-write.
+    - SIGHUP starts a new generation of workers (re-importing the
+      application), then stops the old ones once their requests complete.
+      SIGTERM and SIGINT stop gracefully; SIGQUIT stops at once.
+    - Workers exit after `max_requests` requests (plus up to
+      `max_requests_jitter`, so they do not all restart together), and are
+      replaced, bounding memory growth. Workers that crash are replaced
+      after a delay, doubled for each crash in a row (up to
+      `max_respawn_delay` seconds), rather than re-forked continuously.
+
+    Usage:
+        python -m tackle.server myapp.wsgi:service --bind 0.0.0.0:8080 \\
+            --workers 4 --threads 8 --max-requests 10000
+
+        PreforkServer(service, port = 8080).run()
+"""
+
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+from select import error as select_error
+
+import os
+import sys
+import time
+import errno
+import Queue
+import random
+import signal
+import socket
+import logging
+import argparse
+import importlib
+import threading
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def load_application(spec):
+    """ Import an application from a 'module:attribute' string. """
+    module, _, attribute = spec.partition(':')
+    module = importlib.import_module(module)
+    return getattr(module, attribute or 'application')
+
+
+def reload_application(spec):
+    module = spec.partition(':')[0]
+    if module in sys.modules:
+        reload(sys.modules[module])
+    return load_application(spec)
+
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """ wsgiref's handler, logging requests to the `logging` module. """
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s', self.client_address[0], format % args)
+
+
+
+class PooledWSGIServer(WSGIServer):
+    """ wsgiref's server, accepting on an already listening socket and
+        handling requests in a fixed pool of threads. """
+
+    # Seconds between checks for stopping while idle.
+    timeout = 1.0
+
+    def __init__(self, listener, application, threads = 8, max_requests = 0,
+            handler_class = QuietRequestHandler):
+        WSGIServer.__init__(self, listener.getsockname()[:2], handler_class,
+                            bind_and_activate = False)
+        self.socket.close()
+        self.socket = listener
+        host, port = listener.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+        self.setup_environ()
+        self.set_app(application)
+
+        self.max_requests = max_requests
+        self.handled = 0
+        self.stopping = False
+        self.queue = Queue.Queue(threads * 2)
+        self.threads = [threading.Thread(target = self.work) for i in range(threads)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def process_request(self, request, client_address):
+        self.queue.put((request, client_address))
+        self.handled = self.handled + 1
+        if self.max_requests and self.handled >= self.max_requests:
+            self.stopping = True
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def handle_error(self, request, client_address):
+        logger.exception('Error handling a request from %s', client_address[0])
+
+    def serve(self, keep_running = lambda: True):
+        """ Handle requests until stopped, or `keep_running()` is false, then
+            wait for the requests in progress. """
+        while not self.stopping and keep_running():
+            try:
+                self.handle_request()
+            except (OSError, select_error) as error:
+                if error.args[0] != errno.EINTR:
+                    raise
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def server_close(self):
+        pass  # the listening socket belongs to the master.
+
+
+
+class PreforkServer(object):
+
+    server_class = PooledWSGIServer
+
+    # Seconds before replacing a crashed worker, doubling with each crash
+    # in a row; a worker running longer than the maximum ends the series.
+    respawn_delay = 0.5
+    max_respawn_delay = 30.0
+
+    def __init__(self, application, host = '0.0.0.0', port = 8080,
+            workers = None, threads = 8, max_requests = 0,
+            max_requests_jitter = 0, reuse_port = False, preload = True,
+            backlog = 1024, graceful_timeout = 30):
+        """ `application` is a WSGI callable, or a 'module:attribute' string
+            to import it from (in the master with `preload`, otherwise in
+            each worker). """
+        self.spec = application if isinstance(application, basestring) else None
+        self.application = None if self.spec else application
+        self.address = (host, port)
+        self.workers = workers or multiprocessing.cpu_count()
+        self.threads = threads
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.reuse_port = reuse_port
+        self.preload = preload or self.spec is None
+        self.backlog = backlog
+        self.graceful_timeout = graceful_timeout
+
+        self.listener = None
+        self.children = {}  # pid => generation
+        self.spawned = {}   # pid => time forked
+        self.generation = 0
+        self.failures = 0   # crashes in a row
+        self.respawn_at = 0
+        self.running = False
+        self.reloading = False
+
+    def bind(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            listener.setsockopt(socket.SOL_SOCKET,
+                getattr(socket, 'SO_REUSEPORT', 15), 1)
+        listener.bind(self.address)
+        listener.listen(self.backlog)
+        return listener
+
+    def load(self, reloading = False):
+        if self.spec is None:
+            application = self.application
+        elif reloading:
+            application = reload_application(self.spec)
+        else:
+            application = load_application(self.spec)
+        # compile routes once here, rather than in each worker's first requests.
+        finalize = getattr(application, 'finalize', None)
+        if callable(finalize):
+            finalize()
+        return application
+
+    # Master process.
+
+    def run(self):
+        self.listener = self.bind()
+        self.address = self.listener.getsockname()[:2]
+        if self.reuse_port:
+            # workers bind their own sockets; one left open here would
+            # receive a share of connections that nothing accepts.
+            self.listener.close()
+            self.listener = None
+        if self.preload:
+            self.application = self.load()
+
+        signal.signal(signal.SIGHUP, self.on_reload)
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGINT, self.on_stop)
+        signal.signal(signal.SIGQUIT, self.on_quit)
+        logger.info('Serving on %s:%d with %d workers', self.address[0],
+                    self.address[1], self.workers)
+
+        self.running = True
+        try:
+            while self.running:
+                self.reap()
+                if self.reloading:
+                    self.reload()
+                self.spawn()
+                time.sleep(0.2)
+        finally:
+            self.stop()
+
+    def on_reload(self, signum, frame):
+        self.reloading = True
+
+    def on_stop(self, signum, frame):
+        self.running = False
+
+    def on_quit(self, signum, frame):
+        self.signal_all(signal.SIGKILL)
+        self.running = False
+
+    def reload(self):
+        self.reloading = False
+        self.failures, self.respawn_at = 0, 0  # the new code may work.
+        if self.preload and self.spec is not None:
+            try:
+                self.application = self.load(reloading = True)
+            except Exception:
+                logger.exception('Reloading %s failed; keeping workers', self.spec)
+                return
+        self.generation = self.generation + 1
+        old = [pid for pid, generation in self.children.items()
+               if generation < self.generation]
+        self.spawn()
+        for pid in old:
+            self.kill(pid, signal.SIGTERM)
+
+    def spawn(self):
+        if time.time() < self.respawn_at:
+            return
+        current = sum(1 for generation in self.children.values()
+                      if generation == self.generation)
+        for i in range(self.workers - current):
+            pid = os.fork()
+            if pid == 0:
+                self.work()  # never returns
+            self.children[pid] = self.generation
+            self.spawned[pid] = time.time()
+
+    def reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as error:
+                if error.errno == errno.ECHILD:
+                    self.children.clear()
+                    self.spawned.clear()
+                    return
+                raise
+            if pid == 0:
+                return
+            self.children.pop(pid, None)
+            self.exited(pid, status)
+
+    def exited(self, pid, status):
+        """ Note a worker's exit, delaying replacements after a crash. """
+        now = time.time()
+        lifetime = now - self.spawned.pop(pid, now)
+        if os.WIFSIGNALED(status):
+            crashed = os.WTERMSIG(status) != signal.SIGTERM
+        else:
+            crashed = os.WEXITSTATUS(status) != 0
+        if not crashed or lifetime > self.max_respawn_delay:
+            self.failures, self.respawn_at = 0, 0
+        if crashed:
+            delay = min(self.respawn_delay * 2 ** self.failures,
+                        self.max_respawn_delay)
+            self.failures = self.failures + 1
+            self.respawn_at = now + delay
+            logger.warning('Worker %d exited with status %d; replacing it in %.1fs',
+                           pid, status, delay)
+
+    def kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError as error:
+            if error.errno != errno.ESRCH:
+                raise
+
+    def signal_all(self, signum):
+        for pid in list(self.children):
+            self.kill(pid, signum)
+
+    def stop(self):
+        """ Stop the workers, waiting `graceful_timeout` seconds for them. """
+        self.signal_all(signal.SIGTERM)
+        deadline = time.time() + self.graceful_timeout
+        while self.children and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        self.signal_all(signal.SIGKILL)
+        self.reap()
+        if self.listener is not None:
+            self.listener.close()
+
+    # Worker processes.
+
+    def work(self):
+        status = 0
+        try:
+            self.serve()
+        except SystemExit as exit:
+            status = exit.code or 0
+        except BaseException:
+            logger.exception('Worker %d failed', os.getpid())
+            status = 1
+        finally:
+            os._exit(status)
+
+    def serve(self):
+        master = os.getppid()
+        signal.signal(signal.SIGQUIT, signal.SIG_DFL)
+        for signum in (signal.SIGHUP, signal.SIGINT):
+            signal.signal(signum, signal.SIG_IGN)  # the master decides.
+
+        application = self.application if self.preload else self.load()
+        listener = self.listener if not self.reuse_port else self.bind()
+        # workers race to accept; the losers must not block in accept().
+        listener.setblocking(False)
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests = max_requests + random.randint(0, self.max_requests_jitter)
+
+        server = self.server_class(listener, application, self.threads, max_requests)
+        def stop(signum, frame):
+            server.stopping = True
+        signal.signal(signal.SIGTERM, stop)
+        # a SIGTERM arriving before the handler above ran the master's
+        # handler, which cleared `running` in this process.
+        server.serve(lambda: self.running and os.getppid() == master)
+
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description = 'Serve a WSGI application.')
+    parser.add_argument('application', help = 'module:attribute of the WSGI application')
+    parser.add_argument('--bind', default = '0.0.0.0:8080', help = 'host:port')
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--threads', type = int, default = 8)
+    parser.add_argument('--max-requests', type = int, default = 0)
+    parser.add_argument('--max-requests-jitter', type = int, default = 0)
+    parser.add_argument('--reuse-port', action = 'store_true')
+    parser.add_argument('--no-preload', dest = 'preload', action = 'store_false')
+    options = parser.parse_args(args)
+
+    host, _, port = options.bind.rpartition(':')
+    logging.basicConfig(level = logging.INFO,
+                        format = '%(asctime)s [%(process)d] %(message)s')
+    PreforkServer(options.application, host or '0.0.0.0', int(port),
+        workers = options.workers, threads = options.threads,
+        max_requests = options.max_requests,
+        max_requests_jitter = options.max_requests_jitter,
+        reuse_port = options.reuse_port, preload = options.preload).run()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,6 +1,18 @@
+import os
+import re
+import sys
+import zlib
+import _sre
 import threading
+import sre_parse
+import sre_compile
+import cPickle as pickle
 
 
+# Python 2's regular expression engine refuses patterns with more than 100
+# groups; combined alternations are split into chunks below this limit.
+RE_GROUP_LIMIT = 99
+
 def stripfirst(char, text):
     while text.startswith(char):
         text = text[len(char):]
@@ -13,6 +25,403 @@ def striplast(char, text):
     return text
 
 
+def gzip_compressor(level = 6):
+    """ A streaming compressor (compress/flush) to the gzip format. """
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def gzip_compress(data, level = 6):
+    """ Compress a string into the gzip format. """
+    compressor = gzip_compressor(level)
+    return compressor.compress(data) + compressor.flush()
+
+
+def parse_accept_encoding(header):
+    """ The content codings a client accepts, from an Accept-Encoding header,
+        as a dict of coding => quality. """
+    result = {}
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        result[coding] = quality
+    return result
+
+
+def parse_cache_control(header):
+    """ The directives of a Cache-Control header, as a dict of (lowercase)
+        directive => value, or True for directives without a value. """
+    result = {}
+    for item in (header or '').split(','):
+        name, sep, value = item.strip().partition('=')
+        name = name.strip().lower()
+        if name:
+            result[name] = value.strip().strip('"') if sep else True
+    return result
+
+
+def accepts_encoding(accepted, coding):
+    """ Whether a coding is acceptable, given parse_accept_encoding() output. """
+    return accepted.get(coding, accepted.get('*', 0)) > 0
+
+
+def noncapturing(pattern):
+    """ Rewrite the capturing groups of a regular expression as non-capturing
+        groups, so it can be embedded within a larger alternation.
+
+        Returns None for patterns that cannot be combined safely, i.e. those
+        relying on their own group numbering (backreferences, conditionals)
+        or carrying inline flags that would apply to the whole alternation.
+    """
+    result = []
+    index, length = 0, len(pattern)
+    in_class = False
+
+    while index < length:
+        char = pattern[index]
+
+        if char == '\\':
+            if not in_class and pattern[index+1:index+2] in '123456789':
+                return None  # backreference
+            result.append(pattern[index:index+2])
+            index = index + 2
+
+        elif in_class:
+            in_class = (char != ']')
+            result.append(char)
+            index = index + 1
+
+        elif char == '[':
+            # A leading ']' (optionally after '^') is a literal member.
+            end = index + 1
+            if pattern[end:end+1] == '^':
+                end = end + 1
+            if pattern[end:end+1] == ']':
+                end = end + 1
+            in_class = True
+            result.append(pattern[index:end])
+            index = end
+
+        elif pattern.startswith('(?P<', index):
+            end = pattern.find('>', index)
+            if end < 0:
+                return None
+            result.append('(?:')
+            index = end + 1
+
+        elif pattern.startswith('(?', index):
+            if pattern[index+2:index+3] not in (':', '=', '!', '<'):
+                return None  # inline flags, comments, named backreferences
+            result.append('(?')
+            index = index + 2
+
+        elif char == '(':
+            result.append('(?:')
+            index = index + 1
+
+        else:
+            result.append(char)
+            index = index + 1
+
+    return ''.join(result)
+
+
+def literal_prefix(pattern):
+    """ The literal text every match of a pattern must begin with, and whether
+        that text is the entire pattern, e.g. '^/users/(\d+)$' => '/users/'.
+        Conservative: any escape, class or group ends the prefix.
+    """
+    if '|' in pattern:
+        return '', False
+    body = pattern[1:] if pattern.startswith('^') else pattern
+    body = body[:-1] if body.endswith('$') and not body.endswith('\\$') else body
+    for index, char in enumerate(body):
+        if char in '.^$*+?{}[]\\|()':
+            if char in '*?{':  # the preceding character is optional.
+                index = max(index - 1, 0)
+            return body[:index], False
+    return body, True
+
+
+def compile_alternation(patterns, compiler = re.compile):
+    """ Combine several (non-capturing) patterns into a single expression.
+        Each alternative is followed by an empty marker group, so that the
+        `lastindex` of a match identifies which alternative matched (1-based).
+        Alternatives are attempted in order; the first to match wins.
+    """
+    return compiler('|'.join('(?:%s)()' % p for p in patterns))
+
+
+class PatternCache(object):
+    """ Compiles regular expressions, optionally persisting their compiled
+        form (the regular expression engine's code, as produced by
+        sre_compile) to a file, so a later process can rebuild them without
+        parsing and compiling them again.
+
+        Entries are keyed by pattern and flags, so patterns that changed are
+        simply compiled anew; a file written by another Python version, or
+        that cannot be read, is ignored. The file is unpickled, so it must
+        be writable only by the application's own user.
+    """
+
+    version = (sys.version, _sre.MAGIC, _sre.CODESIZE)
+
+    def __init__(self, filename = None):
+        self.filename = filename
+        self.stored = {}  # (pattern, flags) => _sre.compile() arguments
+        self.used = {}
+        if filename is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, 'rb') as stream:
+                version, stored = pickle.load(stream)
+        except Exception:
+            return
+        if version == self.version and isinstance(stored, dict):
+            self.stored = stored
+
+    @staticmethod
+    def arguments(pattern, flags):
+        """ What sre_compile.compile() passes to _sre.compile(). """
+        parsed = sre_parse.parse(pattern, flags)
+        code = sre_compile._code(parsed, flags)
+        groupindex = parsed.pattern.groupdict
+        indexgroup = [None] * parsed.pattern.groups
+        for name, index in groupindex.items():
+            indexgroup[index] = name
+        return (pattern, flags | parsed.pattern.flags, code,
+                parsed.pattern.groups - 1, groupindex, indexgroup)
+
+    def compile(self, pattern, flags = 0):
+        key = (pattern, flags)
+        arguments = self.used.get(key) or self.stored.get(key)
+        if arguments is not None:
+            try:
+                compiled = _sre.compile(*arguments)
+            except Exception:
+                arguments = None
+        if arguments is None:
+            try:
+                arguments = self.arguments(pattern, flags)
+                compiled = _sre.compile(*arguments)
+            except Exception:
+                return re.compile(pattern, flags)  # raises for invalid patterns.
+        self.used[key] = arguments
+        return compiled
+
+    def save(self):
+        """ Write the patterns compiled so far to the file, replacing it,
+            unless it holds exactly those already. """
+        if self.used.viewkeys() == self.stored.viewkeys():
+            return False
+        temporary = '%s.%d.tmp' % (self.filename, os.getpid())
+        with open(temporary, 'wb') as stream:
+            pickle.dump((self.version, self.used), stream, 2)
+        os.rename(temporary, self.filename)
+        self.stored = dict(self.used)
+        return True
+
+
+class PatternSet(object):
+    """ An ordered collection of items with compiled regular expressions,
+        matched as combined alternations: one evaluation per chunk of
+        patterns, rather than one per pattern. Patterns that cannot be
+        combined (see noncapturing) are evaluated alone, in their position,
+        so the first item whose pattern matches always wins.
+    """
+
+    chunk_size = RE_GROUP_LIMIT
+
+    def __init__(self, items, pattern = lambda item: item.pattern,
+            compiler = re.compile):
+        self.stages = list(self.compile([(i, pattern(i)) for i in items], compiler))
+
+    @classmethod
+    def compile(cls, members, compiler = re.compile):
+        """ Generate (combined pattern, members) stages, in order. A stage
+            with no combined pattern holds a single (item, pattern) member. """
+        chunk, sources = [], []
+        for member in members:
+            compiled = member[1]
+            source = None if compiled.flags else noncapturing(compiled.pattern)
+            if source is None or len(chunk) >= cls.chunk_size:
+                if chunk:
+                    yield compile_alternation(sources, compiler), chunk
+                chunk, sources = [], []
+            if source is None:
+                yield None, [member]
+            else:
+                chunk.append(member)
+                sources.append(source)
+        if chunk:
+            yield compile_alternation(sources, compiler), chunk
+
+    def match(self, text):
+        """ The first (item, match) whose pattern matches, or (None, None). """
+        for combined, members in self.stages:
+            if combined is None:
+                item, compiled = members[0]
+                match = compiled.match(text)
+                if match is not None:
+                    return item, match
+            else:
+                found = combined.match(text)
+                if found is not None:
+                    item, compiled = members[found.lastindex - 1]
+                    return item, compiled.match(text)
+
+        return None, None
+
+
+class LRUCache(object):
+    """ A bounded, thread-safe mapping which evicts the least recently used
+        entries once full. Size is counted in entries, or by the total weight
+        of the values when a `weigher` function is given (e.g. `len`).
+        Values heavier than the whole cache are not stored.
+
+        Recency is tracked in a circular doubly linked list of
+        [prev, next, key, value, weight] links, as in Python 3's lru_cache.
+    """
+
+    def __init__(self, maxsize, weigher = None):
+        self.maxsize = maxsize
+        self.weigher = weigher
+        self.lock = threading.Lock()
+        self.data = {}
+        self.root = []  # sentinel; root[1] is the oldest entry.
+        self.root[:] = [self.root, self.root, None, None, 0]
+        self.currsize = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def _unlink(self, link):
+        link_prev, link_next = link[0], link[1]
+        link_prev[1] = link_next
+        link_next[0] = link_prev
+
+    def _append(self, link):
+        root = self.root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0], link[1] = last, root
+
+    def get(self, key, default = None):
+        with self.lock:
+            link = self.data.get(key)
+            if link is None:
+                self.misses = self.misses + 1
+                return default
+            self._unlink(link)
+            self._append(link)
+            self.hits = self.hits + 1
+            return link[3]
+
+    def set(self, key, value):
+        weight = self.weigher(value) if self.weigher else 1
+        with self.lock:
+            self._remove(key)
+            if weight > self.maxsize:
+                return False
+            link = [None, None, key, value, weight]
+            self._append(link)
+            self.data[key] = link
+            self.currsize = self.currsize + weight
+            while self.currsize > self.maxsize:
+                self._remove(self.root[1][2])
+            return True
+
+    def _remove(self, key):
+        link = self.data.pop(key, None)
+        if link is not None:
+            self._unlink(link)
+            self.currsize = self.currsize - link[4]
+        return link
+
+    def pop(self, key, default = None):
+        with self.lock:
+            link = self._remove(key)
+            return default if link is None else link[3]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.root[:] = [self.root, self.root, None, None, 0]
+            self.currsize = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.data),
+            'size': self.currsize,
+            'maxsize': self.maxsize
+        }
+
+
+class SegmentedLRUCache(object):
+    """ An LRUCache split into independently locked segments by key hash,
+        so concurrent threads rarely contend on the same lock. Each segment
+        holds an equal share of the total size, and evicts on its own.
+    """
+
+    segment_class = LRUCache
+
+    def __init__(self, maxsize, segments = 16, weigher = None):
+        segments = max(1, min(segments, maxsize))
+        self.maxsize = maxsize
+        self.segments = [
+            self.segment_class(maxsize // segments, weigher)
+            for i in range(segments)
+        ]
+
+    def segment(self, key):
+        return self.segments[hash(key) % len(self.segments)]
+
+    def __len__(self):
+        return sum(len(s) for s in self.segments)
+
+    def __contains__(self, key):
+        return key in self.segment(key)
+
+    def get(self, key, default = None):
+        return self.segment(key).get(key, default)
+
+    def set(self, key, value):
+        return self.segment(key).set(key, value)
+
+    def pop(self, key, default = None):
+        return self.segment(key).pop(key, default)
+
+    def clear(self):
+        for segment in self.segments:
+            segment.clear()
+
+    def stats(self):
+        result = dict.fromkeys(('hits', 'misses', 'entries', 'size'), 0)
+        for segment in self.segments:
+            for key, value in segment.stats().items():
+                if key in result:
+                    result[key] = result[key] + value
+        result['maxsize'] = self.maxsize
+        return result
+
+
 class cached_property(object):
     """A decorator that converts a function into a lazy property.
 
@@ -28,7 +437,7 @@ class cached_property(object):
                 return 42
 
     The class has to have a `__dict__` in order for this property to
-    work.
+    work; for classes with `__slots__`, see `slot_cached_property`.
 
     .. note:: Implementation detail: this property is implemented as non-data
        descriptor.  non-data descriptors are only invoked if there is
@@ -38,6 +447,10 @@ class cached_property(object):
        will still work as expected because the lookup logic is replicated
        in __get__ for manual invocation.
 
+    No lock is taken: threads racing on the first access may each call the
+    function, so it should be free of side effects, but all of them return
+    the value stored first.
+
     This class was ported from `Werkzeug`_ and `Flask`_.
     NB: this class was copied from `webapp-improved`_, under an Apache license.
     """
@@ -49,16 +462,55 @@ class cached_property(object):
         self.__module__ = func.__module__
         self.__doc__ = doc or func.__doc__
         self.func = func
-        self.lock = threading.RLock()
 
     def __get__(self, obj, type=None):
         if obj is None:
             return self
 
-        with self.lock:
-            value = obj.__dict__.get(self.__name__, self._default_value)
-            if value is self._default_value:
-                value = self.func(obj)
-                obj.__dict__[self.__name__] = value
+        value = obj.__dict__.get(self.__name__, self._default_value)
+        if value is self._default_value:
+            # setdefault is atomic, so racing threads agree on one value.
+            value = obj.__dict__.setdefault(self.__name__, self.func(obj))
+        return value
+
+
+
+class slot_cached_property(object):
+    """ A lazy property for classes with `__slots__`, storing its value in
+        the slot named `slot` (by default the function's name with a
+        leading underscore), which the class must declare:
+
+            class Request(object):
+                __slots__ = ('environ', '_query')
+
+                @slot_cached_property
+                def query(self):
+                    return parse_qs(self.environ['QUERY_STRING'])
+
+        Without the slot, the first access raises AttributeError. As with
+        cached_property, threads racing on the first access may each call
+        the function, but all of them return the value stored first; a lock
+        is taken only to store it, as slots have no atomic setdefault.
+    """
+
+    def __init__(self, func, slot = None):
+        self.__name__ = func.__name__
+        self.__module__ = func.__module__
+        self.__doc__ = func.__doc__
+        self.func = func
+        self.slot = slot or '_' + func.__name__
+        self.lock = threading.Lock()
+
+    def __get__(self, obj, type=None, getattr=getattr, missing=object()):
+        if obj is None:
+            return self
 
-            return value
+        value = getattr(obj, self.slot, missing)
+        if value is missing:
+            computed = self.func(obj)
+            with self.lock:
+                value = getattr(obj, self.slot, missing)
+                if value is missing:
+                    value = computed
+                    setattr(obj, self.slot, value)
+        return value
@@ -5,16 +5,27 @@
 
 from webob import exc as exceptions
 from webob import Request, Response
+from webob.util import status_reasons
 
-from util import cached_property
+from util import cached_property, slot_cached_property
 from util import stripfirst, striplast
+from util import literal_prefix, PatternSet, PatternCache, LRUCache, SegmentedLRUCache
+from body import RequestBody
 
+import os
 import re
+import mmap
+import time
+import json
+import urllib
+import urlparse
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-logger.addHandler(logging.StreamHandler())
+logger.addHandler(logging.NullHandler())
+
+timer = time.time
 
 
 
@@ -26,9 +37,21 @@ class RequestInfo(object):
     """
 
 
+    environ_key = 'tackle.request_info'
+
     @classmethod
     def gethostname(cls, environ):
-        return environ.get('HTTP_HOST', None).split(':')[0]
+        host = environ.get('HTTP_HOST') or environ.get('SERVER_NAME', '')
+        return host.split(':')[0]
+
+    @classmethod
+    def of(cls, environ):
+        """ The request's RequestInfo, when shared by the layers handling it
+            (see MiddlewareChain), or else a new one. """
+        info = environ.get(cls.environ_key)
+        if info is None or info.environ is not environ:
+            info = cls(environ)
+        return info
 
     def __init__(self, environ):
         self.environ = environ
@@ -54,6 +77,72 @@ class RequestInfo(object):
 
 
 
+# Characters WebOb leaves unquoted in `Request.path`.
+PATH_SAFE = "/~!$&'()*+,;=:@"
+
+
+def request_path(environ):
+    """ The request path as WebOb's `Request.path` would report it. """
+    path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+    return urllib.quote(path, PATH_SAFE)
+
+
+
+class RequestView(object):
+    """ A lazy, read-only view of a request, for lightweight routes.
+        Values are read from the environ on access; the query string and
+        body are parsed only when first requested.
+    """
+
+    __slots__ = ('environ', '_query', '_body', '_stream')
+
+    def __init__(self, environ):
+        self.environ = environ
+        self._query = None
+        self._body = None
+
+    @property
+    def method(self):
+        return self.environ['REQUEST_METHOD']
+
+    @property
+    def path(self):
+        return request_path(self.environ)
+
+    @property
+    def query_string(self):
+        return self.environ.get('QUERY_STRING', '')
+
+    @property
+    def query(self):
+        """ Query parameters, as a dict of lists of values. """
+        if self._query is None:
+            self._query = urlparse.parse_qs(self.query_string, True)
+        return self._query
+
+    def header(self, name, default = None):
+        key = name.upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        return self.environ.get(key, default)
+
+    @slot_cached_property
+    def stream(self):
+        """ The body, to be read incrementally (see RequestBody). """
+        return RequestBody(self.environ)
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = self.stream.read()
+        return self._body
+
+    @property
+    def json(self):
+        return json.loads(self.body)
+
+
+
 class ResponseExtension(Response):
 
     def set_status(self, code, message = None):
@@ -66,39 +155,165 @@ class ResponseExtension(Response):
 
 
 class FileWrapper(object):
+    """ Iterates over a file-like object in blocks, optionally stopping after
+        `length` bytes. A fallback for servers without `wsgi.file_wrapper`.
+    """
 
-    def __init__(self, filelike, blksize=8192):
+    def __init__(self, filelike, blksize=8192, length=None):
         if not callable(getattr(filelike, 'read', None)):
             raise TypeError("wsgi.FileWrapper requires a file-like object")
 
         self.filelike = filelike
         self.blksize = blksize
+        self.remaining = length
         if hasattr(filelike, 'close'):
             self.close = filelike.close
 
     def __getitem__(self, key):
-        data = self.filelike.read(self.blksize)
+        blksize = self.blksize
+        if self.remaining is not None:
+            blksize = min(blksize, self.remaining)
+        data = self.filelike.read(blksize) if blksize else ''
         if data:
+            if self.remaining is not None:
+                self.remaining = self.remaining - len(data)
             return data
         raise IndexError
 
     def __iter__(self):
-        i = 0
-        while True:
-            try:
-                yield self[i]
-                i = i + 1
-            except IndexError:
+        read, blksize, remaining = self.filelike.read, self.blksize, self.remaining
+        while remaining is None or remaining > 0:
+            data = read(blksize if remaining is None else min(blksize, remaining))
+            if not data:
                 break
+            if remaining is not None:
+                remaining = remaining - len(data)
+            yield data
+
+
+
+class MappedFile(object):
+    """ Iterates over a region of a memory-mapped file in large blocks,
+        avoiding a read() call and buffer copy per block. """
+
+    def __init__(self, filelike, offset, length, blksize=262144):
+        self.filelike = filelike
+        self.mapping = mmap.mmap(filelike.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offset = offset
+        self.end = offset + length
+        self.blksize = blksize
+
+    def __iter__(self):
+        mapping, end = self.mapping, self.end
+        for start in xrange(self.offset, end, self.blksize):
+            yield mapping[start:min(start + self.blksize, end)]
+
+    def close(self):
+        self.mapping.close()
+        self.filelike.close()
+
+
+
+# Files (or ranges) at least this large are memory-mapped, when they cannot
+# be passed to the server's `wsgi.file_wrapper`.
+MMAP_THRESHOLD = 1 << 20
+
+
+def sendfile(environ, filepath, offset=0, length=None):
+    """ A response body for the file, or `length` bytes of it from `offset`.
+        Whole files are passed to the server's `wsgi.file_wrapper` when it
+        provides one, which servers typically implement with the sendfile
+        system call; otherwise large files are memory-mapped. """
+    filelike = open(filepath, 'rb')
+    handler = environ.get('wsgi.file_wrapper')
+    if handler is not None and not offset and length is None:
+        return handler(filelike)
 
+    if length is None:
+        length = os.fstat(filelike.fileno()).st_size - offset
+    if length >= MMAP_THRESHOLD:
+        return MappedFile(filelike, offset, length)
 
+    filelike.seek(offset)
+    return FileWrapper(filelike, 65536, length)
 
 
-def sendfile(environ, filepath):
-    handler = environ.get('wsgi.file_wrapper', FileWrapper)
-    return handler(open(filepath, 'rb'))
 
 
+def close_result(result):
+    if hasattr(result, 'close'):
+        result.close()
+
+
+def hook_close(result, callback):
+    """ Have closing a response iterable call `callback` afterwards, without
+        wrapping the iterable (so a server still recognises its own
+        `wsgi.file_wrapper`). False when its close() cannot be replaced. """
+    close = getattr(result, 'close', None)
+    def __close__():
+        try:
+            if close is not None:
+                close()
+        finally:
+            callback()
+    try:
+        result.close = __close__
+    except (AttributeError, TypeError):
+        return False
+    return True
+
+
+
+class ResponseStream(object):
+    """ A response iterable passing each chunk of `result` through
+        `transform(chunk)`, and appending the output of `finish()` once
+        `result` is exhausted; empty output is skipped. Closing the stream
+        closes `result` and then calls `close()`, whether or not the stream
+        was iterated, as servers must close response iterables.
+    """
+
+    def __init__(self, result, transform = None, finish = None, close = None):
+        self.result = result
+        self.iterator = iter(result)
+        self.transform = transform
+        self.finish = finish
+        self.on_close = close
+        self.exhausted = False
+
+    def __iter__(self):
+        if self.transform is None and self.finish is None:
+            return self.iterator  # only closing is wrapped; iterate natively.
+        return self
+
+    def next(self):
+        transform = self.transform
+        while not self.exhausted:
+            try:
+                chunk = next(self.iterator)
+            except StopIteration:
+                self.exhausted = True
+                break
+            if transform is None:
+                return chunk
+            chunk = transform(chunk)
+            if chunk:
+                return chunk
+
+        finish, self.finish = self.finish, None
+        if finish is not None:
+            chunk = finish()
+            if chunk:
+                return chunk
+        raise StopIteration
+
+    def close(self):
+        try:
+            close_result(self.result)
+        finally:
+            on_close, self.on_close = self.on_close, None
+            if on_close is not None:
+                on_close()
+
 
 
 class WSGIRequestHandler(object):
@@ -106,14 +321,48 @@ class WSGIRequestHandler(object):
     pass_all_match_groups = False
     environ = None
 
+    # Verbs answered by the router on the handler's behalf when unsupported;
+    # extend this to add custom verbs to the `Allow` header.
+    http_methods = (
+        'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE'
+    )
+
+    # The largest request body accepted, in bytes, or None for no limit;
+    # routes may set their own. See RequestBody.
+    max_body_size = None
+
+    # Bodies spooled by stream.spool() are written to disk beyond this size.
+    body_spool_threshold = 1 << 20
+
+    body_class = RequestBody
+
     def __init__(self, request, response, match):
         self.request = request
         self.response = response
         self.arguments = self.match_arguments(match)
 
+    @cached_property
+    def stream(self):
+        """ The request body, to be read incrementally rather than buffered
+            by WebOb (see RequestBody). """
+        return self.body_class(self.request.environ, self.max_body_size,
+                               self.body_spool_threshold)
+
     def sendfile(self, filename):
         return sendfile(self.environ, filename)
 
+    @classmethod
+    def supported_methods(cls):
+        """ The HTTP methods implemented by this handler class.
+            HEAD is implied by GET. """
+        methods = set()
+        for method in cls.http_methods:
+            if callable(getattr(cls, method.lower(), None)):
+                methods.add(method)
+        if 'GET' in methods:
+            methods.add('HEAD')
+        return frozenset(methods)
+
     @classmethod
     def match_arguments(cls, match):
         kwargs = match.groupdict()
@@ -139,6 +388,9 @@ class WSGIRequestHandler(object):
         method = getattr(self, self.request.method.lower(), None)
         self.environ = environ
 
+        if method is None and self.request.method == 'HEAD':
+            method = getattr(self, 'get', None)  # WebOb omits the body.
+
         if not callable(method):
             raise exceptions.HTTPNotImplemented
 
@@ -159,10 +411,23 @@ class WSGIRequestHandler(object):
 class WSGIRoute(object):
     RE_PARSE_PATH = re.compile(r'<([a-zA-Z_]+)?(?::([^>]+))?>')
 
-    def __init__(self, path, handler, name = None):
+    def __init__(self, path, handler, name = None, lightweight = False,
+            max_body_size = None):
         self.name = name
         self.path = path
         self.handler = handler
+        self.lightweight = lightweight
+        if max_body_size is None:
+            max_body_size = getattr(handler, 'max_body_size', None)
+        self.max_body_size = max_body_size
+        self.methods = None  # unknown; the handler decides.
+        self.allow = None
+
+        supported = getattr(handler, 'supported_methods', None)
+        if callable(supported):
+            self.http_methods = frozenset(handler.http_methods)
+            self.methods = supported()
+            self.allow = ', '.join(sorted(self.methods | set(['OPTIONS'])))
 
     @cached_property
     def template(self):
@@ -171,6 +436,10 @@ class WSGIRoute(object):
 
     @cached_property
     def matchpattern(self):
+        return re.compile(self.expression())
+
+    def expression(self):
+        """ The source of the route's regular expression. """
         def _sub(match):
             name, pattern = match.group(1, 2)
             if name:
@@ -178,8 +447,12 @@ class WSGIRoute(object):
             else:
                 return '(%s)' % (pattern or '[^/]+')
         rexp = self.path.lstrip('^').rstrip('$')
-        rexp = '^%s$' % self.RE_PARSE_PATH.sub(_sub, rexp)
-        return re.compile(rexp)
+        return '^%s$' % self.RE_PARSE_PATH.sub(_sub, rexp)
+
+    def compile(self, compiler = re.compile):
+        """ Prepare the route's pattern and template ahead of use. """
+        self.__dict__['matchpattern'] = compiler(self.expression())
+        self.template
 
     def match(self, path):
         m = self.matchpattern.match(path)
@@ -189,35 +462,326 @@ class WSGIRoute(object):
             return m, self.handler
 
 
+class URLBuilder(object):
+    """ Builds the URLs of a route. Its path is split once into literal text
+        and <name:pattern> placeholders; values are checked against their
+        placeholder's pattern (by default '[^/]+'), then percent-encoded.
+        Unnamed placeholders take positional arguments, in order.
+
+        With a positive `cache_size`, each placeholder remembers (up to that
+        many) str and int values it has checked and encoded, for links
+        rendered repeatedly; other types (1.0 and True equal 1, but are
+        rendered differently) are checked every time.
+    """
+
+    # Characters left as they are in values: those allowed in a path.
+    safe = "/-._~!$&'()*+,;=:@"
+    unescaped = urllib.always_safe + safe
+    RE_UNSAFE = re.compile('[^%s]' % re.escape(unescaped))
+    escapes = dict((chr(i), '%%%02X' % i) for i in range(256))
+
+    # Regular expression syntax which a route's literal text cannot contain.
+    RE_SPECIAL = re.compile(r'(?<!\\)[\^$*+?{}\[\]|()]')
+    RE_ESCAPE = re.compile(r'\\(\W)')
+
+    def __init__(self, route, cache_size = 0):
+        self.name = route.name
+        self.cache_size = cache_size
+        self.names = []  # named placeholders, for batch keys
+        self.fields = []  # (name or position, pattern, matcher, memo)
+
+        path = route.path.lstrip('^').rstrip('$')
+        literals, position, end = [], 0, 0
+        for match in WSGIRoute.RE_PARSE_PATH.finditer(path):
+            literals.append(path[end:match.start()])
+            name, pattern = match.group(1, 2)
+            if name:
+                self.names.append(name)
+            else:
+                name, position = position, position + 1
+            if pattern:
+                matcher = re.compile('(?:%s)\\Z' % pattern).match
+            else:
+                pattern, matcher = '[^/]+', None  # checked without a regex.
+            memo = {} if cache_size > 0 else None  # value => encoded value
+            self.fields.append((name, pattern, matcher, memo))
+            end = match.end()
+        literals.append(path[end:])
+
+        self.buildable = not any(self.RE_SPECIAL.search(l) for l in literals)
+        literals = [self.RE_ESCAPE.sub(r'\1', l).replace('%', '%%') for l in literals]
+        self.format = '%s'.join(literals)
+
+    def __call__(self, *args, **kwargs):
+        """ The URL for the given placeholder values. Raises KeyError for a
+            missing value, and ValueError for one its pattern rejects. """
+        if not self.buildable:
+            raise ValueError("The route %r matches a regular expression "
+                             "outside placeholders, and cannot be built" % self.name)
+        values = []
+        for name, pattern, matcher, memo in self.fields:
+            try:
+                value = args[name] if name.__class__ is int else kwargs[name]
+            except (KeyError, IndexError):
+                raise KeyError("Missing %r to build the route %r" % (name, self.name))
+            kind = value.__class__
+            if memo is not None and (kind is str or kind is int):
+                encoded = memo.get(value)  # no str equals an int, so no mixups.
+                if encoded is None:
+                    encoded = self.encode(value, pattern, matcher)
+                    if len(memo) >= self.cache_size:
+                        memo.clear()
+                    memo[value] = encoded
+            else:
+                encoded = self.encode(value, pattern, matcher)
+            values.append(encoded)
+        return self.format % tuple(values)
+
+    def build(self, args, kwargs):
+        return self(*args, **kwargs)
+
+    def key(self, args, kwargs):
+        values = args + tuple(map(kwargs.get, self.names))
+        return values + tuple([value.__class__ for value in values])
+
+    def encode(self, value, pattern, matcher):
+        """ A value checked against its placeholder's pattern, and escaped. """
+        if value.__class__ is not str:
+            if value.__class__ is int:
+                value = str(value)
+            else:
+                value = unicode(value).encode('utf-8')
+        if (not value or '/' in value) if matcher is None else matcher(value) is None:
+            raise ValueError("%r does not match %r in the route %r" % (
+                value, pattern, self.name))
+        if value.rstrip(self.unescaped):  # only unsafe characters are replaced.
+            escapes = self.escapes
+            value = self.RE_UNSAFE.sub(lambda match: escapes[match.group()], value)
+        return value
+
+    def build_many(self, arguments):
+        """ URLs for many sets of values: each a dict of names to values, a
+            tuple of positional values, or a single positional value. Values
+            repeated within the batch are built once. """
+        build, key_for = self.build, self.key
+        urls, built, empty = [], {}, {}
+        append = urls.append
+        for item in arguments:
+            if isinstance(item, dict):
+                args, kwargs = (), item
+            elif isinstance(item, tuple):
+                args, kwargs = item, empty
+            else:
+                args, kwargs = (item,), empty
+            key = key_for(args, kwargs)
+            try:
+                url = built.get(key)
+            except TypeError:  # unhashable values
+                url = build(args, kwargs)
+            if url is None:
+                url = built[key] = build(args, kwargs)
+            append(url)
+        return urls
+
+
+
+class WSGIDispatcher(object):
+    """ Resolves a path to the first registered route matching it.
+
+        Routes are indexed by the first path segment of their literal prefix,
+        so a lookup only considers routes that could possibly match, and the
+        candidate patterns are matched as a PatternSet (combined alternations)
+        rather than one by one. Routes are indexed from the source of their
+        expressions; each segment's patterns are compiled on its first use.
+    """
+
+    pattern_set_class = PatternSet
+
+    def __init__(self, routes, compiler = re.compile):
+        self.compiler = compiler
+        self.buckets = {}   # segment => candidate routes, in registered order
+        wildcards = []      # routes not bound to a specific first segment
+        for route in routes:
+            key = self.route_segment(route)
+            if key is None:
+                wildcards.append(route)
+                for bucket in self.buckets.values():
+                    bucket.append(route)
+            else:
+                self.buckets.setdefault(key, list(wildcards)).append(route)
+
+        self.wildcards = wildcards
+        self.default = None  # PatternSet of the wildcards, built on first use
+        self.indexed = {}   # segment => PatternSet, built on first use
+
+    @classmethod
+    def route_segment(cls, route):
+        compiled = route.__dict__.get('matchpattern')
+        source = compiled.pattern if compiled is not None else route.expression()
+        prefix, complete = literal_prefix(source)
+        if prefix.startswith('/'):
+            end = prefix.find('/', 1)
+            if end > 0:
+                return prefix[1:end]
+            elif complete:
+                return prefix[1:]
+        return None
+
+    @classmethod
+    def path_segment(cls, path):
+        if path.startswith('/'):
+            end = path.find('/', 1)
+            return path[1:end] if end > 0 else path[1:]
+        return None
+
+    def compile(self, routes):
+        return self.pattern_set_class(routes, lambda route: route.matchpattern,
+                                      self.compiler)
+
+    def patterns(self, path):
+        """ The PatternSet of routes which could match the path. """
+        key = self.path_segment(path)
+        patterns = self.indexed.get(key)
+        if patterns is None:
+            if key not in self.buckets:
+                if self.default is None:
+                    self.default = self.compile(self.wildcards)
+                return self.default
+            patterns = self.indexed[key] = self.compile(self.buckets[key])
+        return patterns
+
+    def match(self, path):
+        return self.patterns(path).match(path)
+
+    def finalize(self):
+        """ Build the pattern sets of all segments, rather than on first use. """
+        if self.default is None:
+            self.default = self.compile(self.wildcards)
+        for key, routes in self.buckets.items():
+            if key not in self.indexed:
+                self.indexed[key] = self.compile(routes)
+
+
+
 class WSGIRouter(object):
+    """ Maps request paths to routes.
 
-    def __init__(self, application):
+        With a positive `cache_size`, resolved paths (including those that
+        match no route) are kept in a segmented LRU cache, which is discarded
+        whenever a route is registered. See `cache.stats()` for hit counts.
+    """
+
+    dispatcher_class = WSGIDispatcher
+    cache_class = SegmentedLRUCache
+    builder_class = URLBuilder
+
+    def __init__(self, application, cache_size = 0, url_cache_size = 0):
         self.application = application
         self.routes = []
         self.named_routes = {}
+        self.builders = {}  # route name => URLBuilder
+        self.cache_size = cache_size
+        self.url_cache_size = url_cache_size
+        self.cache = self.make_cache()
+        self._dispatcher = None
+
+    def make_cache(self):
+        if self.cache_size > 0:
+            return self.cache_class(self.cache_size)
+        return None
 
     def register(self, route):
         self.routes.append(route)
         route_name = getattr(route, 'name', None)
         if route_name:
             self.named_routes[route_name] = route
+            self.builders[route_name] = self.builder_class(route, self.url_cache_size)
+        self._dispatcher = None  # rebuilt on the next dispatch.
+        if self.cache is not None:
+            self.cache = self.make_cache()
 
-
-    def resolve_route_to_url(self, name, **props):
-        if name not in self.named_routes:
+    @property
+    def dispatcher(self):
+        dispatcher = self._dispatcher
+        if dispatcher is None:
+            routes = list(self.routes)
+            dispatcher = self.dispatcher_class(routes)
+            if len(routes) == len(self.routes):  # not stale by now
+                self._dispatcher = dispatcher
+        return dispatcher
+
+
+    def finalize(self, compiler = re.compile):
+        """ Compile every route and the dispatcher ahead of requests. """
+        routes = list(self.routes)
+        for route in routes:
+            route.compile(compiler)
+        dispatcher = self.dispatcher_class(routes, compiler)
+        dispatcher.finalize()
+        if len(routes) == len(self.routes):
+            self._dispatcher = dispatcher
+
+    def builder(self, name):
+        builder = self.builders.get(name)
+        if builder is None:
             raise KeyError("Could not find the route named %r" % name)
+        return builder
 
-        return self.named_routes[name].template.format(**props)
+    def resolve_route_to_url(self, name, *args, **props):
+        return self.builder(name)(*args, **props)
 
-    def dispatch(self, environ, request):
-        for r in self.routes:
-            match, handler = r.match(request.path)
-            if match:
-                return match, handler
+    def match(self, path):
+        """ Find the first registered route matching the path.
+            Returns (route, match), or (None, None) when nothing matches. """
+        cache = self.cache  # before the dispatcher; see register().
+        if cache is None:
+            return self.dispatcher.match(path)
+
+        result = cache.get(path)
+        if result is None:
+            result = self.dispatcher.match(path)
+            cache.set(path, result)
+        return result
+
+    def lookup(self, environ):
+        route, match = self.match(request_path(environ))
+        if route is not None:
+            return route, match
 
         # else
         raise exceptions.HTTPNotFound
 
+    def dispatch(self, environ, request):
+        route, match = self.match(request.path)
+        if route is None:
+            raise exceptions.HTTPNotFound
+        return match, route.handler
+
+    def preempt(self, route, environ, start_response):
+        """ Answer requests for methods the route's handler does not implement,
+            without constructing the handler: OPTIONS is answered with the
+            `Allow` header, other known methods with 405 Method Not Allowed.
+            Returns None when the handler should serve the request.
+            Bodies declared larger than the route allows are refused too, and
+            those of undeclared length are limited as they are read. """
+        limit = route.max_body_size
+        if limit is not None:
+            RequestBody.limit(environ, limit)
+
+        methods = route.methods
+        method = environ['REQUEST_METHOD']
+        if methods is None or method in methods:
+            return None
+
+        elif method == 'OPTIONS':
+            start_response('200 OK', [
+                ('Allow', route.allow), ('Content-Length', '0') ])
+            return []
+
+        elif method in route.http_methods:
+            raise exceptions.HTTPMethodNotAllowed(
+                headers = [('Allow', route.allow)])
+
 
 
 
@@ -226,9 +790,18 @@ class WSGIApplication(object):
     requesthandler_class = WSGIRequestHandler
     router_class = WSGIRouter
     route_class = WSGIRoute
+    pattern_cache_class = PatternCache
+
+    # The route reported to metrics for requests matching no route.
+    unmatched_route = '<unmatched>'
 
     def __init__(self, *routes, **options):
-        self.router = self.router_class(self)
+        self.router = self.router_class(self,
+            cache_size = options.get('dispatch_cache_size', 0),
+            url_cache_size = options.get('url_cache_size', 0))
+        self.metrics = options.get('metrics')
+        self.profiler = options.get('profiler')
+        self.route_cache = options.get('route_cache')
         for route in routes:
             if isinstance(route, self.route_class):
                 self.router.register(route)
@@ -249,14 +822,82 @@ class WSGIApplication(object):
         return _decorator
 
 
-    def url_for(self, *args, **kwargs):
-        return self.router.resolve_route_to_url(*args, **kwargs)
+    def finalize(self, route_cache = None):
+        """ Compile all routes and the dispatcher now, rather than on the
+            first requests to each (e.g. before forking workers).
+
+            With `route_cache` (a filename, by default the `route_cache`
+            option), compiled patterns are read from that file when it
+            holds them, and the file is rewritten with the current routes,
+            so later starts skip compiling them.
+        """
+        filename = route_cache or self.route_cache
+        cache = self.pattern_cache_class(filename)
+        self.router.finalize(cache.compile)
+        if filename is not None:
+            try:
+                cache.save()
+            except (IOError, OSError):
+                logger.warning('Could not write the route cache %s', filename,
+                               exc_info = True)
+        return self
+
+    def url_for(self, name, *args, **kwargs):
+        return self.router.builder(name)(*args, **kwargs)
+
+    def urls_for(self, name, arguments):
+        """ URLs of a named route for each of many sets of values
+            (see URLBuilder.build_many). """
+        return self.router.builder(name).build_many(arguments)
+
+    @classmethod
+    def respond(cls, result, start_response, head = False):
+        """ Emit a (status, headers, body) tuple from a lightweight route.
+            Status may be an integer code, headers a dict, and body a string
+            (which receives a Content-Length) or an iterable of strings.
+            For a HEAD request (`head`), the body is dropped. """
+        status, headers, body = result
+        if isinstance(status, int):
+            status = '%d %s' % (status, status_reasons.get(status, ''))
+        if isinstance(headers, dict):
+            headers = headers.items()
+        if isinstance(body, basestring):
+            if isinstance(body, unicode):
+                body = body.encode('utf-8')
+            headers = list(headers)
+            if not any(k.lower() == 'content-length' for k, v in headers):
+                headers.append(('Content-Length', str(len(body))))
+            body = [body]
+        start_response(status, headers)
+        if head:
+            close_result(body)
+            return []
+        return body
 
     def __call__(self, environ, start_response):
-        request = Request(environ)
+        if self.metrics is not None or self.profiler is not None:
+            return self.instrumented(environ, start_response)
         try:
-            match, handler = self.router.dispatch(environ, request)
-            if issubclass(handler, self.requesthandler_class):
+            route, match = self.router.lookup(environ)
+        except exceptions.HTTPException, e:
+            return e(environ, start_response)
+        return self.handle(route, match, environ, start_response)
+
+    def handle(self, route, match, environ, start_response):
+        try:
+            preempted = self.router.preempt(route, environ, start_response)
+            if preempted is not None:
+                return preempted
+
+            handler = route.handler
+            if route.lightweight:
+                result = handler(RequestView(environ), match)
+                return self.respond(result, start_response,
+                                    environ['REQUEST_METHOD'] == 'HEAD')
+
+            request = Request(environ)
+            if isinstance(handler, type) and \
+                    issubclass(handler, self.requesthandler_class):
                 # Create an instance of the handler's subclass
                 handler = (handler(request, ResponseExtension(), match))
                 # Invoke the instance's __call__ method
@@ -270,29 +911,147 @@ class WSGIApplication(object):
 
         return response(environ, start_response)
 
+    def instrumented(self, environ, start_response):
+        """ Handle a request, reporting its route, status and the time spent
+            in each phase to the metrics sink once its response is closed,
+            and running its handler through the profiler (either of which
+            may be None). """
+        metrics, profiler = self.metrics, self.profiler
+        status = ['500']
+        if metrics is not None:
+            def __start_response__(status_line, headers, exc_info = None):
+                status[0] = status_line
+                return start_response(status_line, headers, exc_info)
+        else:
+            __start_response__ = start_response
+
+        started = timer()
+        try:
+            route, match = self.router.lookup(environ)
+            name = route.name or route.path
+        except exceptions.HTTPException, e:
+            route, match, name, missing = None, None, self.unmatched_route, e
+        dispatched = timer()
+
+        def finished():
+            metrics.record(name, status[0][:1] + 'xx', dispatched - started,
+                handled - dispatched, timer() - handled)
+
+        try:
+            if route is None:
+                result = missing(environ, __start_response__)
+            elif profiler is None:
+                result = self.handle(route, match, environ, __start_response__)
+            else:
+                result = profiler(name, environ,
+                    self.handle, route, match, environ, __start_response__)
+        except:
+            handled = timer()
+            if metrics is not None:
+                finished()
+            raise
+        handled = timer()
+        if metrics is None:
+            return result
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            try:
+                wrapped = isinstance(result, file_wrapper)
+            except TypeError:  # not a class.
+                wrapped = False
+            if wrapped and hook_close(result, finished):
+                return result  # left for the server to sendfile().
+        return ResponseStream(result, close = finished)
+
 
 
 class WSGIService(object):
-    """A simple virtual host router based on hostname."""
+    """ A virtual host router based on hostname.
+
+        Hostnames are registered exactly ('www.example.com'), by wildcard
+        ('*.example.com', matching any subdomain, the longest such suffix
+        winning), or as '*', the default for all other hosts. Wildcards are
+        held in a trie of reversed labels, so lookup cost grows with the
+        labels in the requested hostname, not the hosts registered.
+
+        Usage:
+            service = WSGIService(('www.example.com', site),
+                                  ('*.tenants.example.com',
+                                   LazyHostApplication(make_tenant_app)),
+                                  ('*', fallback))
+    """
 
     application_class = WSGIApplication
 
-    def __init__(self, *routes):
+    def __init__(self, *routes, **options):
         self.hostmap = {}
+        self.wildcards = {}  # label => subtree, from the top-level domain down.
+        self.default = options.get('default')
         for host, app in routes:
             self.register(app, host)
 
     def register(self, app, *hostnames):
         assert callable(app) or isinstance(app, self.application_class)
         for hostname in hostnames:
-            self.hostmap[hostname] = app
+            hostname = hostname.lower().rstrip('.')
+            if hostname == '*':
+                self.default = app
+            elif hostname.startswith('*.'):
+                node = self.wildcards
+                for label in reversed(hostname[2:].split('.')):
+                    node = node.setdefault(label, {})
+                node[None] = app
+            else:
+                self.hostmap[hostname] = app
+
+    def applications(self):
+        """ The distinct applications registered, in no particular order. """
+        found = dict((id(app), app) for app in self.hostmap.values())
+        nodes = [self.wildcards]
+        while nodes:
+            node = nodes.pop()
+            for label, child in node.items():
+                if label is None:
+                    found[id(child)] = child
+                else:
+                    nodes.append(child)
+        if self.default is not None:
+            found[id(self.default)] = self.default
+        return found.values()
+
+    def finalize(self):
+        """ Finalize every registered application which supports it. """
+        for app in self.applications():
+            finalize = getattr(app, 'finalize', None)
+            if callable(finalize):
+                finalize()
+        return self
+
+    def resolve(self, hostname):
+        """ The application serving a (lowercase) hostname, or None. """
+        hostname = hostname.rstrip('.')
+        app = self.hostmap.get(hostname)
+        if app is not None:
+            return app
+
+        found, node = self.default, self.wildcards
+        labels = hostname.split('.')
+        for index in xrange(len(labels) - 1, 0, -1):
+            node = node.get(labels[index])
+            if node is None:
+                break
+            app = node.get(None)
+            if app is not None:
+                found = app
+        return found
 
 
     def __call__(self, environ, start_response):
         request_host = RequestInfo.gethostname(environ)
+        app = self.resolve(request_host.lower())
 
-        if request_host in self.hostmap:
-            return (self.hostmap[request_host])(environ, start_response)
+        if app is not None:
+            return app(environ, start_response)
         else:
             start_response(
                 "503 Service Unavailable",
@@ -303,6 +1062,47 @@ class WSGIService(object):
                 ) ]
 
 
+
+class LazyHostApplication(object):
+    """ Applications created on demand, one per hostname, by calling
+        `factory(hostname)` on the first request to each. Only the
+        `max_loaded` most recently requested are kept; others are unloaded,
+        and created again if requested again. Requests for a hostname being
+        created wait for it; other hostnames are served meanwhile. """
+
+    cache_class = LRUCache
+
+    def __init__(self, factory, max_loaded = 1024):
+        self.factory = factory
+        self.loaded = self.cache_class(max_loaded)
+        self.loading = {}  # hostname => Lock, held while it is created.
+        self.lock = threading.Lock()
+
+    def application(self, hostname):
+        app = self.loaded.get(hostname)
+        if app is not None:
+            return app
+
+        with self.lock:
+            loading = self.loading.setdefault(hostname, threading.Lock())
+        with loading:  # create each application once.
+            app = self.loaded.get(hostname)
+            if app is None:
+                try:
+                    app = self.factory(hostname)
+                    self.loaded.set(hostname, app)
+                finally:
+                    with self.lock:
+                        if self.loading.get(hostname) is loading:
+                            del self.loading[hostname]
+        return app
+
+    def __call__(self, environ, start_response):
+        hostname = RequestInfo.gethostname(environ).lower().rstrip('.')
+        return self.application(hostname)(environ, start_response)
+
+
+
 class VirtualHostRouter(WSGIService):
     """ A compatibility class """
     pass
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+
+import hashlib
+import unittest
+
+from cStringIO import StringIO
+from webob import exc as exceptions
+
+from tackle import WSGIApplication, RequestHandler
+from tackle.body import RequestBody
+from runner import ApplicationTestCase
+
+app = WSGIApplication()
+
+
+@app.route('/digest', max_body_size = 1024)
+class DigestHandler(RequestHandler):
+    """ Hashes the body as it streams, without holding it. """
+
+    def post(self):
+        digest = hashlib.md5()
+        for chunk in self.stream:
+            digest.update(chunk)
+        return digest.hexdigest()
+
+
+@app.route('/form')
+class SpoolingHandler(RequestHandler):
+
+    body_spool_threshold = 16
+
+    def post(self):
+        spooled = self.stream.spool()
+        return '%s %s' % (spooled._rolled, self.request.POST['name'])
+
+
+@app.route('/buffered', max_body_size = 16)
+class BufferedHandler(RequestHandler):
+    """ Reads the body through WebOb, as most handlers do. """
+
+    def post(self):
+        return str(len(self.request.body))
+
+
+@app.route('/echo', lightweight = True)
+def echo(request, match):
+    return (200, {'Content-Type': 'text/plain'}, request.body)
+
+
+@app.route('/echo/limited', lightweight = True, max_body_size = 1000)
+def echo_limited(request, match):
+    return (200, {'Content-Type': 'text/plain'}, request.body)
+
+
+@app.route('/stream', max_body_size = 1000)
+class StreamHandler(RequestHandler):
+
+    def post(self):
+        return self.stream.read()
+
+
+def chunked(*chunks):
+    return ''.join('%x;ext=1\r\n%s\r\n' % (len(c), c) for c in chunks) + '0\r\nX-Trailer: 1\r\n\r\n'
+
+
+class TestCaseRequestBody(unittest.TestCase):
+
+    def body(self, data, **environ):
+        environ.setdefault('wsgi.input', StringIO(data))
+        return RequestBody(environ, **environ.pop('options', {}))
+
+    def testContentLength(self):
+        body = self.body('abcdefEXTRA', CONTENT_LENGTH = '6')
+        body.chunk_size = 4
+        self.assertEqual(list(body), ['abcd', 'ef'])
+
+    def testChunked(self):
+        body = self.body(chunked('hello ', 'world'), HTTP_TRANSFER_ENCODING = 'chunked')
+        self.assertEqual(body.read(3), 'hel')
+        self.assertEqual(body.read(), 'lo world')
+        self.assertEqual(body.read(), '')
+
+    def testMalformedChunked(self):
+        for size in ('zz', '0x3', '+3', '-0', ''):
+            body = self.body('%s\r\nabc\r\n0\r\n\r\n' % size,
+                             HTTP_TRANSFER_ENCODING = 'chunked')
+            self.assertRaises(exceptions.HTTPBadRequest, body.read)
+
+    def testLimits(self):
+        self.assertRaises(exceptions.HTTPRequestEntityTooLarge, self.body,
+                          'x' * 10, CONTENT_LENGTH = '10', options = {'max_size': 5})
+        body = self.body(chunked('x' * 4, 'x' * 4), HTTP_TRANSFER_ENCODING = 'chunked',
+                         options = {'max_size': 5})
+        self.assertEqual(body.read(4), 'xxxx')
+        self.assertRaises(exceptions.HTTPRequestEntityTooLarge, body.read)
+        self.assertEqual(self.body('x' * 5, HTTP_TRANSFER_ENCODING = 'chunked',
+            **{'wsgi.input_terminated': True, 'options': {'max_size': 5}}).read(), 'x' * 5)
+
+    def testLimitedChunkedReadAll(self):
+        body = self.body('5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n',
+                         HTTP_TRANSFER_ENCODING = 'chunked', options = {'max_size': 1000})
+        self.assertEqual(body.read(), 'hello world')
+        self.assertEqual(body.read(), '')
+
+    def testSpool(self):
+        environ = {'HTTP_TRANSFER_ENCODING': 'chunked'}
+        body = self.body(chunked('a' * 10, 'b' * 10), options = {'spool_threshold': 8},
+                         **environ)
+        spooled = body.spool()
+        self.assertTrue(spooled._rolled)
+        self.assertEqual(spooled.read(), 'a' * 10 + 'b' * 10)
+        self.assertEqual(body.environ['CONTENT_LENGTH'], '20')
+        self.assertNotIn('HTTP_TRANSFER_ENCODING', body.environ)
+
+
+class TestCaseStreamingHandlers(ApplicationTestCase(app)):
+
+    def testStreamedDigest(self):
+        resp = self.application.post('/digest', 'x' * 1000)
+        self.assertEqual(resp.body, hashlib.md5('x' * 1000).hexdigest())
+
+    def testRouteLimitBeforeReading(self):
+        self.application.post('/digest', 'x' * 1025, status = 413)
+
+    def testRouteLimitWhileBuffering(self):
+        environ = {'wsgi.input_terminated': True}  # decoded by the server.
+        headers = {'Transfer-Encoding': 'chunked'}
+        self.application.post('/buffered', 'x' * 40, headers = headers,
+                              extra_environ = environ, status = 413)
+        resp = self.application.post('/buffered', 'x' * 16, headers = headers,
+                                     extra_environ = environ)
+        self.assertEqual(resp.body, '16')
+        self.application.post('/buffered', chunked('x' * 10, 'x' * 10),
+                              headers = headers, status = 413)
+        self.application.post('/buffered', 'x' * 17, status = 413)
+
+    def testSpooledForm(self):
+        resp = self.application.post('/form', {'name': 'n' * 40})
+        self.assertEqual(resp.body, 'True ' + 'n' * 40)
+
+    def testLightweightChunked(self):
+        resp = self.application.post('/echo', chunked('ab', 'cd'), headers = {
+            'Transfer-Encoding': 'chunked'})
+        self.assertEqual(resp.body, 'abcd')
+
+    def testLimitedChunkedWhole(self):
+        headers = {'Transfer-Encoding': 'chunked'}
+        for path in ('/echo/limited', '/stream'):
+            resp = self.application.post(path, chunked('ab', 'cd', 'ef'), headers = headers)
+            self.assertEqual(resp.body, 'abcdef')
+        self.application.post('/stream', chunked('x' * 600, 'x' * 600),
+                              headers = headers, status = 413)
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from tackle import WSGIApplication, RequestHandler, ResponseCacheMiddleware
+from tackle.cache import FileResponseCache
+from tackle.wsgi import close_result
+from runner import TestApp
+from webob import Request
+
+
+class Counted(RequestHandler):
+    calls = 0
+    delay = 0
+
+    def get(self, *args):
+        Counted.calls = Counted.calls + 1
+        time.sleep(self.delay)
+        self.response.headers['Cache-Control'] = 'max-age=60'
+        self.response.headers['ETag'] = '"v1"'
+        return 'call %d' % Counted.calls
+
+
+class Negotiated(RequestHandler):
+    def get(self):
+        Counted.calls = Counted.calls + 1
+        self.response.headers['Cache-Control'] = 'max-age=60'
+        self.response.headers['Vary'] = 'Accept-Language'
+        return 'lang=%s' % self.request.headers.get('Accept-Language', '')
+
+
+class Private(RequestHandler):
+    def get(self):
+        Counted.calls = Counted.calls + 1
+        self.response.headers['Cache-Control'] = 'private, max-age=60'
+        return 'private'
+
+
+def streamed(cache_control):
+    def application(environ, start_response):
+        Counted.calls = Counted.calls + 1
+        start_response('200 OK', [('Content-Type', 'text/plain'),
+                                  ('Cache-Control', cache_control)])
+        return ['streamed ', str(Counted.calls)]
+    return application
+
+
+upstream = WSGIApplication(('/counted', Counted), ('/vary', Negotiated),
+                           ('/private', Private))
+
+
+class TestCaseResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        Counted.calls = 0
+        self.cache = ResponseCacheMiddleware()
+        self.application = TestApp(self.cache.wsgi(upstream))
+
+    def testCachedUntilRefreshed(self):
+        first = self.application.get('/counted', status = 200)
+        second = self.application.get('/counted', status = 200)
+        self.assertEqual(second.body, first.body)
+        self.assertIn('Age', second.headers)
+        self.assertEqual(Counted.calls, 1)
+
+        self.application.get('/counted?other', status = 200)
+        self.application.get('/counted',
+            headers = {'Cache-Control': 'no-cache'}, status = 200)
+        self.assertEqual(self.application.get('/counted').body, 'call 3')
+
+    def testConditionalHit(self):
+        self.application.get('/counted')
+        resp = self.application.get('/counted',
+            headers = {'If-None-Match': '"v1"'}, status = 304)
+        self.assertEqual(resp.headers['ETag'], '"v1"')
+        for tags in ('"v0", W/"v1"', '*'):
+            self.application.get('/counted',
+                headers = {'If-None-Match': tags}, status = 304)
+        self.application.get('/counted',
+            headers = {'If-None-Match': '"v"'}, status = 200)
+
+    def testHeadFromCachedGet(self):
+        self.application.get('/counted')
+        resp = self.application.head('/counted', status = 200)
+        self.assertEqual(resp.body, '')
+        self.assertEqual(Counted.calls, 1)
+
+    def testVary(self):
+        for language in ('en', 'fr', 'en', 'fr'):
+            resp = self.application.get('/vary',
+                headers = {'Accept-Language': language})
+            self.assertEqual(resp.body, 'lang=%s' % language)
+        self.assertEqual(Counted.calls, 2)
+
+    def testUncacheable(self):
+        self.application.get('/private')
+        self.application.get('/private')
+        self.application.post('/counted', status = 405)
+        self.assertEqual(Counted.calls, 2)
+
+    def testCoalescing(self):
+        Counted.delay = 0.2
+        try:
+            threads = [threading.Thread(target = self.application.get,
+                                        args = ('/counted',))
+                       for i in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            Counted.delay = 0
+        self.assertEqual(Counted.calls, 1)
+
+    def follow(self, application):
+        """ Request /slow while a leading request is in progress, returning
+            the body and the seconds waited. """
+        self.cache.coalesce_timeout = 5.0
+        started, bodies, errors = time.time(), [], []
+        def request():
+            try:
+                environ = Request.blank('/slow').environ
+                result = self.cache.handle(application, environ, lambda *args: None)
+                try:
+                    bodies.append(''.join(result))
+                finally:
+                    close_result(result)
+            except Exception as error:
+                errors.append(error)
+        thread = threading.Thread(target = request)
+        thread.start()
+        thread.join(10)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(bodies), 1)
+        return bodies[0], time.time() - started
+
+    def testUncacheableReleasesFollowers(self):
+        application = streamed('no-store')
+        leader = self.cache.handle(application,
+            Request.blank('/slow').environ, lambda *args: None)
+        try:
+            body, waited = self.follow(application)
+        finally:
+            leader.close()
+        self.assertEqual(body, 'streamed 2')
+        self.assertTrue(waited < 2.0, waited)
+
+    def testCapturedBodyReleasesFollowers(self):
+        application = streamed('max-age=60')
+        leader = self.cache.handle(application,
+            Request.blank('/slow').environ, lambda *args: None)
+        try:
+            self.assertEqual(list(leader), ['streamed ', '1'])
+            body, waited = self.follow(application)  # before closing.
+        finally:
+            leader.close()
+        self.assertEqual(body, 'streamed 1')
+        self.assertTrue(waited < 2.0, waited)
+
+
+class TestCaseFileResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        Counted.calls = 0
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testSharedBetweenInstances(self):
+        for i in range(2):
+            cache = ResponseCacheMiddleware(
+                backend = FileResponseCache(self.directory))
+            resp = TestApp(cache.wsgi(upstream)).get('/counted')
+            self.assertEqual(resp.body, 'call 1')
+        self.assertEqual(Counted.calls, 1)
+
+    def testConcurrentWritesOfOneKey(self):
+        backend, errors = FileResponseCache(self.directory), []
+        def store(value):
+            try:
+                for i in range(50):
+                    backend.set('key\0vary', value, 60)
+            except Exception as error:
+                errors.append(error)
+        threads = [threading.Thread(target = store, args = (('accept-encoding', i),))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(backend.get('key\0vary')[0], 'accept-encoding')
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+    def testExpiry(self):
+        backend = FileResponseCache(self.directory)
+        backend.set('key', 'value', 60)
+        backend.set('old', 'value', -1)
+        self.assertEqual(backend.get('key'), 'value')
+        self.assertEqual(backend.purge(), 1)
+        self.assertEqual(backend.get('old'), None)
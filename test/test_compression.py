@@ -0,0 +1,122 @@
+#!/usr/bin/python
+
+import gzip
+import unittest
+
+from StringIO import StringIO
+
+from tackle import WSGIApplication, RequestHandler, CompressionMiddleware
+
+
+PAYLOAD = '{"items": [%s]}' % ', '.join(['{"id": %d}' % i for i in range(2000)])
+
+
+class JSONHandler(RequestHandler):
+    def get(self, kind):
+        if kind == 'small':
+            self.response.content_type = 'application/json'
+            return '{}'
+        if kind == 'png':
+            self.response.content_type = 'image/png'
+        elif kind == 'encoded':
+            self.response.content_type = 'application/json'
+            self.response.headers['Content-Encoding'] = 'identity'
+        else:
+            self.response.content_type = 'application/json'
+            self.response.headers['ETag'] = '"v1"'
+        return PAYLOAD
+
+
+def chunked(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    for i in range(100):
+        yield 'line %d\n' % i
+
+
+def written(environ, start_response):
+    write = start_response('200 OK', [('Content-Type', 'application/json')])
+    write(PAYLOAD[:1000])
+    write(PAYLOAD[1000:])
+    return []
+
+
+upstream = WSGIApplication(('/json/<kind>', JSONHandler))
+
+
+class TestCaseCompressionMiddleware(unittest.TestCase):
+
+    def request(self, path, accept_encoding = 'gzip', app = None, **environ):
+        app = app or CompressionMiddleware().wsgi(upstream)
+        environ = dict({'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+            'wsgi.url_scheme': 'http', 'wsgi.input': StringIO('')}, **environ)
+        if accept_encoding is not None:
+            environ['HTTP_ACCEPT_ENCODING'] = accept_encoding
+        response = []
+        def start_response(status, headers, exc_info = None):
+            response.extend((status, dict(headers)))
+        result = app(environ, start_response)
+        try:
+            body = ''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response[0], response[1], body
+
+    def decompress(self, body):
+        return gzip.GzipFile(fileobj = StringIO(body)).read()
+
+    def testCompressed(self):
+        status, headers, body = self.request('/json/data')
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(headers['ETag'], 'W/"v1"')
+        self.assertNotIn('Content-Length', headers)
+        self.assertTrue(len(body) < len(PAYLOAD) / 4)
+        self.assertEqual(self.decompress(body), PAYLOAD)
+
+    def testStreamedChunks(self):
+        status, headers, body = self.request('/chunked',
+            app = CompressionMiddleware().wsgi(chunked))
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(self.decompress(body),
+                         ''.join('line %d\n' % i for i in range(100)))
+
+    def testPassedThrough(self):
+        for path, environ in (('/json/data', {'accept_encoding': None}),
+                              ('/json/small', {}),
+                              ('/json/png', {}),
+                              ('/json/encoded', {}),
+                              ('/json/data', {'HTTP_RANGE': 'bytes=0-9'}),
+                              ('/json/data', {'REQUEST_METHOD': 'HEAD'})):
+            status, headers, body = self.request(path, **environ)
+            self.assertNotEqual(headers.get('Content-Encoding'), 'gzip', path)
+        self.assertNotIn('Vary', self.request('/json/png')[1])
+        self.assertEqual(self.request('/json/data', None)[1]['Vary'],
+                         'Accept-Encoding')
+
+    def testWrittenBodyCompressed(self):
+        app = CompressionMiddleware().wsgi(written)
+        environ = {'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'}
+        response, body = [], []
+        def start_response(status, headers, exc_info = None):
+            response.extend((status, dict(headers)))
+            return body.append
+        body.extend(app(environ, start_response))
+        self.assertEqual(response[1]['Content-Encoding'], 'gzip')
+        self.assertEqual(self.decompress(''.join(body)), PAYLOAD)
+
+    def testThreadPool(self):
+        compression = CompressionMiddleware(level = 9, threads = 2,
+                                            threaded_size = 1024)
+        status, headers, body = self.request('/json/data',
+            app = compression.wsgi(upstream))
+        self.assertEqual(self.decompress(body), PAYLOAD)
+        self.assertTrue(compression._pool is not None)
+
+        pool = compression.pool
+        compression._pool_pid = -1  # as seen from a forked child.
+        self.assertTrue(compression.pool is not pool)
+        pool.terminate()
+        compression.close()
+        self.assertTrue(compression._pool is None)
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+
+import threading
+import unittest
+
+from wsgiref.util import FileWrapper
+
+from tackle import WSGIApplication, WSGIService, RequestHandler
+from tackle.wsgi import sendfile
+from tackle.metrics import Histogram, Metrics, PrometheusExporter
+from runner import TestApp
+
+
+class Handler(RequestHandler):
+    def get(self, item_id):
+        return 'item %s' % item_id
+
+
+def download(request, match):
+    return (200, {'Content-Type': 'text/x-python'},
+            sendfile(request.environ, __file__))
+
+
+class TestCaseHistogram(unittest.TestCase):
+
+    def testBucketsBoundValues(self):
+        for seconds in (0.5e-6, 3e-6, 0.0123, 1.0, 7.5, 100.0):
+            index = Histogram.index(seconds)
+            self.assertTrue(seconds <= Histogram.upper_bound(index))
+            if index:
+                self.assertTrue(seconds > Histogram.upper_bound(index - 1))
+        self.assertEqual(Histogram.index(1e6), Histogram.SIZE - 1)
+
+    def testPercentile(self):
+        histogram = Histogram()
+        for i in range(99):
+            histogram.add(0.001)
+        histogram.add(1.0)
+        self.assertTrue(0.001 <= histogram.percentile(50) < 0.00125)
+        self.assertEqual(histogram.percentile(100), 1.0)
+
+
+class TestCaseMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        app = WSGIApplication(('/items/<item_id>', Handler, 'item'),
+                              metrics = self.metrics)
+        self.application = TestApp(app)
+        self.service = TestApp(WSGIService(
+            ('localhost', app), ('metrics', PrometheusExporter(self.metrics))))
+
+    def testPerRouteCounts(self):
+        self.application.get('/items/1')
+        self.application.get('/items/2')
+        self.application.post('/items/3', status = 405)
+        self.application.get('/missing', status = 404)
+
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot['item'].statuses, {'2xx': 2, '4xx': 1})
+        self.assertEqual(snapshot['<unmatched>'].statuses, {'4xx': 1})
+        for histogram in snapshot['item'].phases:
+            self.assertEqual(histogram.count, 3)
+
+    def testMergedAcrossThreads(self):
+        threads = [threading.Thread(target = self.application.get,
+                                    args = ('/items/%d' % i,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.metrics.snapshot()['item'].statuses, {'2xx': 4})
+
+    def testShortLivedThreadsRetired(self):
+        record = lambda: self.metrics.record('route', '2xx', 0.001, 0.002, 0.003)
+        for batch in range(10):
+            threads = [threading.Thread(target = record) for i in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertTrue(len(self.metrics.tables) <= 20)
+
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot['route'].statuses, {'2xx': 200})
+        self.assertEqual(snapshot['route'].phases[2].count, 200)
+        self.assertEqual(len(self.metrics.tables), 0)
+        self.assertEqual(self.metrics.snapshot()['route'].statuses, {'2xx': 200})
+
+    def testFileWrapperPassedThrough(self):
+        app = WSGIApplication(('/download', download, 'download', True),
+                              metrics = self.metrics)
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/download',
+                   'wsgi.file_wrapper': FileWrapper}
+        result = app(environ, lambda status, headers, exc_info = None: None)
+        self.assertIsInstance(result, FileWrapper)
+        self.assertEqual(self.metrics.snapshot(), {})
+        result.close()
+        self.assertEqual(self.metrics.snapshot()['download'].statuses, {'2xx': 1})
+
+    def testPrometheusEndpoint(self):
+        self.service.get('/items/1', extra_environ = {'HTTP_HOST': 'localhost'})
+        resp = self.service.get('/', extra_environ = {'HTTP_HOST': 'metrics'})
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+        self.assertIn('tackle_requests_total{route="item",status="2xx"} 1', resp.body)
+        self.assertIn('tackle_request_duration_seconds_count'
+                      '{route="item",phase="handler"} 1', resp.body)
+        self.assertIn('tackle_request_duration_seconds_bucket'
+                      '{route="item",phase="write",le="+Inf"} 1', resp.body)
+
+    def testDisabledByDefault(self):
+        self.assertTrue(WSGIApplication().metrics is None)
@@ -0,0 +1,199 @@
+#!/usr/bin/python
+
+import unittest
+
+from webob import Request
+from tackle import Middleware, MiddlewareChain, RedirectionMiddleware
+from tackle import WSGIApplication, WSGIService, ResponseCacheMiddleware
+from tackle.server import PreforkServer
+from tackle.wsgi import RequestInfo
+from runner import TestApp
+
+
+class Body(object):
+    """ A response iterable recording how far it was consumed. """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.consumed = 0
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.consumed = self.consumed + 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class Upstream(object):
+    def __init__(self, *chunks):
+        self.body = Body(list(chunks))
+
+    def __call__(self, environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain'),
+                                  ('Content-Length', str(sum(map(len, self.body.chunks))))])
+        return self.body
+
+
+class Uppercase(Middleware):
+
+    def run_start_response(self, environ, status, headers):
+        headers = [(name, value) for name, value in headers
+                   if name.lower() != 'content-length']
+        return '203 Non-Authoritative Information', headers + [('X-Upper', '1')]
+
+    def run_after(self, environ, start_response, result):
+        counted = environ['test.counted'] = []
+        def transform(chunk):
+            counted.append(len(chunk))
+            return chunk.upper()
+        return self.stream(result, transform, lambda: '!',
+                           lambda: counted.append('closed'))
+
+
+class TestCaseStreamingMiddleware(unittest.TestCase):
+
+    def testTransformAndRewrite(self):
+        upstream = Upstream('abc', '', 'def')
+        resp = TestApp(Uppercase().wsgi(upstream)).get('/', status = 203)
+        self.assertEqual(resp.body, 'ABCDEF!')
+        self.assertEqual(resp.headers['X-Upper'], '1')
+        self.assertTrue(upstream.body.closed)
+
+    def testChunksAreNotMaterialised(self):
+        upstream = Upstream('abc', 'def', 'ghi')
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+        result = Uppercase().wsgi(upstream)(environ, lambda s, h, e = None: None)
+        self.assertEqual(next(result), 'ABC')
+        self.assertEqual(upstream.body.consumed, 1)
+        result.close()
+        self.assertTrue(upstream.body.closed)
+        self.assertEqual(environ['test.counted'], [3, 'closed'])
+
+    def testCloseWithoutIteration(self):
+        upstream = Upstream('abc')
+        result = Uppercase().wsgi(upstream)({}, lambda s, h, e = None: None)
+        result.close()
+        self.assertTrue(upstream.body.closed)
+
+    def testPlainMiddlewarePassesResultThrough(self):
+        upstream = Upstream('abc')
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+        result = Middleware().wsgi(upstream)(environ, lambda s, h, e = None: None)
+        self.assertTrue(result is upstream.body)
+
+
+
+class Recorder(Middleware):
+
+    def __init__(self, name, log, intercept = False):
+        self.name = name
+        self.log = log
+        self.intercept = intercept
+
+    def run_before(self, environ, start_response):
+        self.log.append((self.name, 'before', id(RequestInfo.of(environ))))
+        if self.intercept:
+            start_response('204 No Content', [])
+            return []
+
+    def run_after(self, environ, start_response, result):
+        self.log.append((self.name, 'after'))
+        return result
+
+
+class Tagger(Middleware):
+
+    def run_start_response(self, environ, status, headers):
+        return status, headers + [('X-Tag', str(len(headers)))]
+
+
+class TestCaseMiddlewareChain(unittest.TestCase):
+
+    def run_stack(self, compile, intercept = False):
+        log = []
+        layers = [Recorder('a', log), Tagger(), Recorder('b', log, intercept),
+                  Tagger(), Recorder('c', log)]
+        resp = TestApp(compile(layers, Upstream('body'))).get('/')
+        return log, resp
+
+    def nested(self, layers, app):
+        for layer in reversed(layers):
+            app = layer.wsgi(app)
+        return app
+
+    def chained(self, layers, app):
+        return MiddlewareChain(layers).wsgi(app)
+
+    def testEquivalentToNesting(self):
+        for intercept in (False, True):
+            nested_log, nested = self.run_stack(self.nested, intercept)
+            chained_log, chained = self.run_stack(self.chained, intercept)
+            self.assertEqual([entry[:2] for entry in chained_log],
+                             [entry[:2] for entry in nested_log])
+            self.assertEqual(chained.status, nested.status)
+            self.assertEqual(chained.headers.getall('X-Tag'),
+                             nested.headers.getall('X-Tag'))
+        self.assertEqual([entry[:2] for entry in chained_log],
+                         [('a', 'before'), ('b', 'before'), ('a', 'after')])
+
+    def testSharedRequestInfo(self):
+        log, resp = self.run_stack(self.chained)
+        self.assertEqual(len(set(entry[2] for entry in log if len(entry) > 2)), 1)
+        self.assertEqual(resp.body, 'body')
+
+    def testRequestInfoRemovedAfterChain(self):
+        # the info references the environ; left in it, each request is a cycle.
+        environ = Request.blank('/').environ
+        app = MiddlewareChain(Recorder('a', [])).wsgi(Upstream('body'))
+        self.assertEqual(''.join(app(environ, lambda *args: None)), 'body')
+        self.assertNotIn(RequestInfo.environ_key, environ)
+        RequestInfo.of(environ)
+        self.assertNotIn(RequestInfo.environ_key, environ)
+
+    def testRedirectionWithinChain(self):
+        redir = RedirectionMiddleware()
+        redir.redirect('^/old$', 'http://example.com/new')
+        app = TestApp(MiddlewareChain(Tagger(), redir).wsgi(Upstream('body')))
+        self.assertEqual(app.get('/old', status = 302).headers['Location'],
+                         'http://example.com/new')
+        self.assertEqual(app.get('/other', status = 200).headers['X-Tag'], '2')
+
+    def testLayerWithOwnWrapper(self):
+        from tackle import ResponseCacheMiddleware
+        log = []
+        upstream = Upstream('body')
+        upstream.body.chunks = ['cached']
+        cache = ResponseCacheMiddleware(default_ttl = 60)
+        app = TestApp(MiddlewareChain(Recorder('a', log), cache,
+                                      Recorder('b', log)).wsgi(upstream))
+        for i in range(2):
+            self.assertEqual(app.get('/').body, 'cached')
+        self.assertEqual([entry[:2] for entry in log], [
+            ('a', 'before'), ('b', 'before'), ('b', 'after'), ('a', 'after'),
+            ('a', 'before'), ('a', 'after')])
+
+
+class TestCaseFinalizeWrapped(unittest.TestCase):
+
+    def wrapped(self):
+        app = WSGIApplication(('/one', Upstream('one')), ('/two/<id>', Upstream('two')))
+        chain = MiddlewareChain(RedirectionMiddleware(), ResponseCacheMiddleware())
+        return app, Middleware().wsgi(chain.wsgi(app))
+
+    def assertFinalized(self, app):
+        self.assertTrue(app.router._dispatcher is not None)
+        self.assertTrue(all('matchpattern' in route.__dict__
+                            for route in app.router.routes))
+
+    def testServiceFinalizesWrapped(self):
+        app, wrapped = self.wrapped()
+        WSGIService(('www.example.com', wrapped)).finalize()
+        self.assertFinalized(app)
+
+    def testPreloadFinalizesWrapped(self):
+        app, wrapped = self.wrapped()
+        PreforkServer(wrapped, workers = 1).load()
+        self.assertFinalized(app)
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+
+import os
+import time
+import pstats
+import shutil
+import tempfile
+import unittest
+
+from tackle import WSGIApplication, RequestHandler
+from tackle.profiling import RequestProfiler, StackSampler
+from runner import TestApp
+
+
+class SlowHandler(RequestHandler):
+    def get(self):
+        time.sleep(self.request.GET.get('delay') and 0.05 or 0)
+        return 'done'
+
+
+def plain_view(request, match):
+    return 'plain'
+
+
+class TestCaseRequestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def application(self, **options):
+        profiler = RequestProfiler(self.directory, **options)
+        return TestApp(WSGIApplication(('/slow', SlowHandler, 'slow'),
+                                       ('/plain', plain_view),
+                                       profiler = profiler))
+
+    def testSampledProfiles(self):
+        app = self.application(sample_rate = 1.0)
+        app.get('/slow')
+        app.post('/plain')
+        names = sorted(os.listdir(self.directory))
+        self.assertEqual(len(names), 2)
+        self.assertTrue(any('-GET-slow-' in name for name in names))
+        self.assertTrue(any('-POST-plain-' in name for name in names))
+        stats = pstats.Stats(os.path.join(self.directory, names[0]))
+        self.assertTrue(stats.total_calls > 0)
+
+    def testSlowRequestStacks(self):
+        app = self.application(slow_threshold = 0.04, sample_interval = 0.002)
+        app.get('/slow')
+        self.assertEqual(os.listdir(self.directory), [])
+        app.get('/slow?delay=1')
+        names = os.listdir(self.directory)
+        self.assertEqual(len(names), 1)
+        self.assertTrue(names[0].endswith('.folded'))
+        with open(os.path.join(self.directory, names[0])) as stream:
+            self.assertIn('get (test_profiling.py:', stream.read())
+
+    def testRotation(self):
+        app = self.application(sample_rate = 1.0, max_files = 2)
+        for i in range(4):
+            app.get('/slow')
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+
+class TestCaseStackSampler(unittest.TestCase):
+
+    def testIdleWhileUntracked(self):
+        sampler = StackSampler(interval = 0.001)
+        samples = sampler.track()
+        self.assertTrue(sampler.busy.is_set())
+        time.sleep(0.02)
+        sampler.untrack()
+        self.assertTrue(samples)
+        self.assertFalse(sampler.busy.is_set())
+
+        count = len(samples)
+        time.sleep(0.02)
+        self.assertEqual(len(samples), count)
+        self.assertTrue(sampler.thread.is_alive())
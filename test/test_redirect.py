@@ -0,0 +1,131 @@
+#!/usr/bin/python
+
+from tackle import WSGIApplication, RedirectionMiddleware, Shortener
+from tackle.redirects import read_csv, read_jsonl, build_sqlite
+from tackle.redirects import MemoryRedirectStore, SQLiteRedirectStore
+from runner import ApplicationTestCase
+from webtest import TestApp
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+shortener = Shortener(basepath = '/s/')
+for index in range(2000):
+    shortener.redirect('code%d' % index, 'http://example.com/%d' % index)
+shortener.redirect('perm', 'http://example.com/permanent', permanent = True)
+
+redir = RedirectionMiddleware()
+redir.redirect(r'^/help/(?P<article>\w+)$', 'http://help.example.com/{article}')
+redir.redirect(r'^/exact$', 'http://example.com/first')
+redir.redirect(r'^/ex(act)$', 'http://example.com/second')
+redir.redirect(r'^/(x+)$', 'http://example.com/regex')
+redir.redirect(r'^/xx$', 'http://example.com/literal')
+
+app = redir.wsgi(shortener.wsgi(WSGIApplication()))
+
+
+class TestCaseRedirection(ApplicationTestCase(app)):
+
+    def testLiteralShortCode(self):
+        resp = self.application.get('/s/code1999', status = 302)
+        self.assertEqual(resp.headers['Location'], 'http://example.com/1999')
+
+    def testPermanent(self):
+        self.application.get('/s/perm', status = 301)
+
+    def testMiss(self):
+        self.application.get('/s/code2000', status = 404)
+
+    def testRetainQuery(self):
+        resp = self.application.get('/s/code7?utm={x}', status = 302)
+        self.assertEqual(resp.headers['Location'],
+            'http://example.com/7?utm={x}')
+
+    def testFormattedTarget(self):
+        resp = self.application.get('/help/topic?a=1', status = 302)
+        self.assertEqual(resp.headers['Location'],
+            'http://help.example.com/topic?a=1')
+
+    def testRegisteredOrderWins(self):
+        resp = self.application.get('/exact', status = 302)
+        self.assertEqual(resp.headers['Location'], 'http://example.com/first')
+        resp = self.application.get('/xx', status = 302)
+        self.assertEqual(resp.headers['Location'], 'http://example.com/regex')
+
+    def testLiteralRules(self):
+        self.assertEqual(len(shortener._literals), 2001)
+        self.assertEqual(len(shortener._expressions), 0)
+
+
+
+class TestCaseRedirectStores(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, filename, content):
+        path = os.path.join(self.directory, filename)
+        with open(path, 'wb') as stream:
+            stream.write(content)
+        return path
+
+    def testReadRows(self):
+        rows = list(read_csv(self.write('links.csv',
+            '# code,target\nabc,http://abc.com/\nperm,http://p.com/,301\n')))
+        self.assertEqual(rows, [('abc', 'http://abc.com/', False),
+                                ('perm', 'http://p.com/', True)])
+        rows = list(read_jsonl(self.write('links.jsonl',
+            '{"code": "abc", "target": "http://abc.com/", "permanent": true}\n\n')))
+        self.assertEqual(rows, [('abc', 'http://abc.com/', True)])
+
+    def testMemoryStore(self):
+        store = MemoryRedirectStore([('a', 'http://one/', False),
+                                     ('a', 'http://two/', True)])
+        self.assertEqual(store.get('a'), ('http://one/', False))
+        self.assertEqual(store.get('b'), None)
+
+    def testStoreRulesCachedPerGeneration(self):
+        store = MemoryRedirectStore([('abc', 'http://one/', False)])
+        shortener = Shortener(basepath = '/s/', store = store)
+        rule = shortener.store_rule('abc')
+        self.assertTrue(shortener.store_rule('abc') is rule)
+        self.assertEqual(shortener.store_rule('missing'), None)
+
+        store.links['abc'] = ('http://two/', True)
+        self.assertTrue(shortener.store_rule('abc') is rule)
+        store.generation = store.generation + 1
+        rule = shortener.store_rule('abc')
+        self.assertEqual((rule.target, rule.status[:3]), ('http://two/', '301'))
+
+    def testShortenerLoad(self):
+        shortener = Shortener(basepath = '/s/')
+        shortener.load([('abc', 'http://abc.com/', True)])
+        resp = TestApp(shortener.wsgi(WSGIApplication())).get('/s/abc', status = 301)
+        self.assertEqual(resp.headers['Location'], 'http://abc.com/')
+
+    def testSQLiteStoreHotSwap(self):
+        filename = os.path.join(self.directory, 'links.db')
+        self.assertEqual(build_sqlite([('abc', 'http://old.com/', False)], filename), 1)
+
+        store = SQLiteRedirectStore(filename, check_interval = 0)
+        shortener = Shortener(basepath = '/s/', store = store)
+        shortener.redirect('local', 'http://local.com/')
+        application = TestApp(shortener.wsgi(WSGIApplication()))
+
+        resp = application.get('/s/abc?x=1', status = 302)
+        self.assertEqual(resp.headers['Location'], 'http://old.com/?x=1')
+        application.get('/s/local', status = 302)
+        application.get('/s/missing', status = 404)
+
+        build_sqlite([('abc', 'http://new.com/', True),
+                      ('def', 'http://def.com/', False)], filename)
+        resp = application.get('/s/abc', status = 301)
+        self.assertEqual(resp.headers['Location'], 'http://new.com/')
+        application.get('/s/def', status = 302)
+        self.assertEqual(store.generation, 1)
@@ -0,0 +1,266 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tackle import WSGIApplication, RequestHandler
+from tackle.wsgi import WSGIRoute
+from tackle.util import PatternSet, PatternCache
+from runner import ApplicationTestCase
+
+
+class Handler(RequestHandler):
+    def get(self, *args, **kwargs):
+        return repr((args, kwargs))
+
+
+class TestCaseDispatcher(unittest.TestCase):
+
+    def makeApplication(self, *paths):
+        return WSGIApplication(*[(path, Handler, path) for path in paths])
+
+    def testFirstRegisteredWins(self):
+        app = self.makeApplication('/item/<name>', '/item/<id:\d+>')
+        route, match = app.router.match('/item/42')
+        self.assertEqual(route.name, '/item/<name>')
+        self.assertEqual(match.groupdict(), {'name': '42'})
+
+    def testMatchArgumentsFromCombinedDispatch(self):
+        app = self.makeApplication('/a/<x>', '/b/(\d+)/(\w+)')
+        route, match = app.router.match('/b/12/abc')
+        self.assertEqual(Handler.match_arguments(match), (('12', 'abc'), {}))
+
+    def testManyRoutesSpanChunks(self):
+        paths = ['/r/%d/<value>' % i for i in range(PatternSet.chunk_size * 3)]
+        app = self.makeApplication(*paths)
+        self.assertEqual(len(app.router.dispatcher.patterns('/r/0/v').stages), 3)
+        for index in (0, PatternSet.chunk_size, len(paths) - 1):
+            route, match = app.router.match('/r/%d/v' % index)
+            self.assertEqual(route.name, paths[index])
+        self.assertEqual(app.router.match('/missing'), (None, None))
+
+    def testSegmentIndexKeepsWildcardOrder(self):
+        app = self.makeApplication('/users/<id>', '/<kind>/<id>', '/posts/<id>')
+        self.assertEqual(app.router.match('/posts/1')[0].name, '/<kind>/<id>')
+        self.assertEqual(app.router.match('/users/1')[0].name, '/users/<id>')
+        self.assertEqual(app.router.match('/other/1')[0].name, '/<kind>/<id>')
+
+    def testUncombinablePatternKeepsOrder(self):
+        app = WSGIApplication()
+        app.router.register(WSGIRoute(r'^/(\w)\1$', Handler, 'backref'))
+        app.router.register(WSGIRoute(r'^/(\w+)$', Handler, 'word'))
+        self.assertEqual(app.router.match('/aa')[0].name, 'backref')
+        self.assertEqual(app.router.match('/ab')[0].name, 'word')
+
+    def testRegisterInvalidatesDispatcher(self):
+        app = self.makeApplication('/one')
+        self.assertEqual(app.router.match('/two'), (None, None))
+        app.router.register(WSGIRoute('/two', Handler, 'two'))
+        self.assertEqual(app.router.match('/two')[0].name, 'two')
+
+
+class TestCaseFinalize(unittest.TestCase):
+
+    paths = ('/a/<x>', '/b/(\d+)/(\w+)', '/<kind>/<id:\d+>', '/c')
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'routes.cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def makeApplication(self, **options):
+        return WSGIApplication(*[(path, Handler, path) for path in self.paths],
+                               **options)
+
+    def assertRoutes(self, app):
+        self.assertEqual(app.router.match('/a/1')[0].name, '/a/<x>')
+        self.assertEqual(app.router.match('/b/12/x')[1].groups(), ('12', 'x'))
+        self.assertEqual(app.router.match('/c/7')[1].groupdict(), {'kind': 'c', 'id': '7'})
+        self.assertEqual(app.router.match('/c')[0].name, '/c')
+        self.assertEqual(app.router.match('/d'), (None, None))
+
+    def testCompilesAhead(self):
+        app = self.makeApplication().finalize()
+        for route in app.router.routes:
+            self.assertIn('matchpattern', route.__dict__)
+            self.assertIn('template', route.__dict__)
+        dispatcher = app.router.dispatcher
+        self.assertEqual(set(dispatcher.indexed), set(dispatcher.buckets))
+        self.assertRoutes(app)
+
+    def testPersistedPatterns(self):
+        self.makeApplication(route_cache = self.filename).finalize()
+        self.assertTrue(os.path.exists(self.filename))
+
+        cache = PatternCache(self.filename)
+        self.assertIn(('^/c$', 0), cache.stored)
+        app = self.makeApplication()
+        app.router.finalize(cache.compile)
+        self.assertEqual(set(cache.used), set(cache.stored))
+        self.assertRoutes(app)
+
+    def testUnreadableCacheIgnored(self):
+        with open(self.filename, 'wb') as stream:
+            stream.write('not a pickle')
+        app = self.makeApplication().finalize(self.filename)
+        self.assertRoutes(app)
+        self.assertTrue(PatternCache(self.filename).stored)
+
+
+class TestCaseDispatchCache(unittest.TestCase):
+
+    def testCachedHitsAndMisses(self):
+        app = WSGIApplication(('/one', Handler), dispatch_cache_size = 64)
+        for i in range(3):
+            self.assertEqual(app.router.match('/one')[0].path, '/one')
+            self.assertEqual(app.router.match('/bot-probe'), (None, None))
+        stats = app.router.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (4, 2))
+        self.assertEqual(stats['entries'], 2)
+
+    def testRegisterInvalidatesCache(self):
+        app = WSGIApplication(('/one', Handler), dispatch_cache_size = 64)
+        self.assertEqual(app.router.match('/two'), (None, None))
+        app.router.register(WSGIRoute('/two', Handler))
+        self.assertEqual(app.router.match('/two')[0].path, '/two')
+
+    def testCacheIsBounded(self):
+        app = WSGIApplication(('/<any>', Handler), dispatch_cache_size = 16)
+        for i in range(100):
+            app.router.match('/%d' % i)
+        self.assertTrue(len(app.router.cache) <= 16)
+
+    def testSegmentsCompiledOnFirstUse(self):
+        app = WSGIApplication(('/one/<id:\d+>', Handler), ('/two', Handler))
+        self.assertEqual(app.router.match('/one/1')[0].path, '/one/<id:\d+>')
+        compiled = [route.path for route in app.router.routes
+                    if 'matchpattern' in route.__dict__]
+        self.assertEqual(compiled, ['/one/<id:\d+>'])
+
+
+
+class CountingHandler(RequestHandler):
+    instances = 0
+
+    def __init__(self, *args):
+        CountingHandler.instances = CountingHandler.instances + 1
+        super(CountingHandler, self).__init__(*args)
+
+    def get(self):
+        return 'content'
+
+    def post(self):
+        return 'posted'
+
+
+methods_app = WSGIApplication(('/counted', CountingHandler))
+
+
+class TestCaseMethodRouting(ApplicationTestCase(methods_app)):
+
+    def setUp(self):
+        CountingHandler.instances = 0
+
+    def testRouteMethods(self):
+        route = methods_app.router.routes[0]
+        self.assertEqual(route.methods, frozenset(['GET', 'HEAD', 'POST']))
+        self.assertEqual(route.allow, 'GET, HEAD, OPTIONS, POST')
+
+    def testUnsupportedMethodPreempted(self):
+        resp = self.application.delete('/counted', status = 405)
+        self.assertEqual(resp.headers['Allow'], 'GET, HEAD, OPTIONS, POST')
+        self.assertEqual(CountingHandler.instances, 0)
+
+    def testOptionsAnsweredByRouter(self):
+        resp = self.application.options('/counted', status = 200)
+        self.assertEqual(resp.headers['Allow'], 'GET, HEAD, OPTIONS, POST')
+        self.assertEqual(CountingHandler.instances, 0)
+
+    def testHeadServedByGet(self):
+        resp = self.application.head('/counted', status = 200)
+        self.assertEqual(resp.body, '')
+        self.assertEqual(resp.content_length, len('content'))
+
+
+lightweight_app = WSGIApplication()
+
+
+@lightweight_app.route('/items/<item_id:\d+>', lightweight = True)
+def item_view(request, match):
+    return (200, {'Content-Type': 'application/json'},
+        '{"id": %s, "q": "%s"}' % (
+            match.group('item_id'), request.query.get('q', [''])[0]))
+
+
+@lightweight_app.route('/echo', lightweight = True)
+def echo_view(request, match):
+    return ('201 Created', [('X-Method', request.method)], [request.body])
+
+
+class TestCaseLightweightRoutes(ApplicationTestCase(lightweight_app)):
+
+    def testTupleResponse(self):
+        resp = self.application.get('/items/7?q=x', status = 200)
+        self.assertResponseContentType(resp, 'application/json')
+        self.assertResponseBodyIs(resp, '{"id": 7, "q": "x"}')
+        self.assertEqual(resp.content_length, len(resp.body))
+
+    def testHeadOmitsBody(self):
+        resp = self.application.head('/items/7', status = 200)
+        self.assertEqual(resp.body, '')
+        self.assertEqual(resp.content_length, len('{"id": 7, "q": ""}'))
+
+    def testBodyRead(self):
+        resp = self.application.post('/echo', 'payload', status = 201)
+        self.assertEqual(resp.headers['X-Method'], 'POST')
+        self.assertResponseBodyIs(resp, 'payload')
+
+
+class TestCaseURLBuilding(unittest.TestCase):
+
+    def setUp(self):
+        self.app = WSGIApplication(
+            ('/users/<user_id:\d+>', Handler, 'user'),
+            ('/tags/<tag>/page/<:\d+>', Handler, 'tag'),
+            ('/files/<path:.+>\.json$', Handler, 'file'),
+            ('/raw/(\d+)', Handler, 'raw'),
+            ('/page/<:\d+>', Handler, 'page'),
+            url_cache_size = 16)
+
+    def testBuild(self):
+        self.assertEqual(self.app.url_for('user', user_id = 42), '/users/42')
+        self.assertEqual(self.app.url_for('tag', 2, tag = 'a b'), '/tags/a%20b/page/2')
+        self.assertEqual(self.app.url_for('file', path = u'd/caf\xe9'),
+                         '/files/d/caf%C3%A9.json')
+        self.assertEqual(self.app.router.match('/tags/a%20b/page/2')[0].name, 'tag')
+
+    def testValidation(self):
+        self.assertRaises(ValueError, self.app.url_for, 'user', user_id = 'x')
+        self.assertRaises(ValueError, self.app.url_for, 'tag', 1, tag = 'a/b')
+        self.assertRaises(KeyError, self.app.url_for, 'tag', tag = 'a')
+        self.assertRaises(KeyError, self.app.url_for, 'missing')
+        self.assertRaises(ValueError, self.app.url_for, 'raw')
+
+    def testBatchAndCache(self):
+        urls = self.app.urls_for('user', [{'user_id': 1}, {'user_id': 2}, {'user_id': 1}])
+        self.assertEqual(urls, ['/users/1', '/users/2', '/users/1'])
+        self.assertEqual(self.app.urls_for('page', [1, (2,)]), ['/page/1', '/page/2'])
+        for user_id in (1, 2, 1, '2'):
+            self.app.url_for('user', user_id = user_id)
+        memo = self.app.router.builder('user').fields[0][3]
+        self.assertEqual(memo, {1: '1', 2: '2', '2': '2'})
+        self.assertEqual(self.app.url_for('file', path = '100%'), '/files/100%25.json')
+
+    def testCacheKeyedOnTypes(self):
+        self.assertEqual(self.app.url_for('user', user_id = 1), '/users/1')
+        self.assertRaises(ValueError, self.app.url_for, 'user', user_id = True)
+        self.assertRaises(ValueError, self.app.url_for, 'user', user_id = 1.0)
+        self.assertEqual(self.app.url_for('page', 1), '/page/1')
+        self.assertRaises(ValueError, self.app.url_for, 'page', True)
+        self.assertRaises(ValueError, self.app.urls_for, 'user',
+                          [{'user_id': 1}, {'user_id': True}])
+        self.assertRaises(ValueError, self.app.urls_for, 'page', [1, 1.0])
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+import os
+import sys
+import time
+import signal
+import socket
+import urllib2
+import unittest
+import threading
+import subprocess
+
+from tackle.server import PooledWSGIServer, PreforkServer
+
+
+def application(environ, start_response):
+    """ Served by the servers under test: responds with the worker's pid. """
+    body = str(os.getpid())
+    start_response('200 OK', [('Content-Type', 'text/plain'),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def listen():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+    return listener
+
+
+def fetch(port, path = '/'):
+    return urllib2.urlopen('http://127.0.0.1:%d%s' % (port, path), timeout = 5).read()
+
+
+class TestCasePooledWSGIServer(unittest.TestCase):
+
+    def testServesUntilMaxRequests(self):
+        listener = listen()
+        server = PooledWSGIServer(listener, application, threads = 2,
+                                  max_requests = 3)
+        thread = threading.Thread(target = server.serve)
+        thread.start()
+        try:
+            port = listener.getsockname()[1]
+            for i in range(3):
+                self.assertEqual(fetch(port), str(os.getpid()))
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        finally:
+            server.stopping = True
+            listener.close()
+
+
+class TestCaseRespawnDelay(unittest.TestCase):
+
+    def testCrashesDelayRespawn(self):
+        server = PreforkServer(application, workers = 1)
+        now = time.time()
+        delays = []
+        for pid in range(1, 10):
+            server.spawned[pid] = now
+            server.exited(pid, 1 << 8)  # exit status 1
+            delays.append(server.respawn_at - now)
+        self.assertTrue(delays[0] >= server.respawn_delay)
+        self.assertTrue(delays[1] >= delays[0] * 2 - 0.1)
+        self.assertTrue(delays[-1] <= server.max_respawn_delay + 1)
+        self.assertTrue(time.time() < server.respawn_at)
+
+        server.spawned[10] = now
+        server.exited(10, signal.SIGTERM)  # stopped by the master.
+        self.assertEqual((server.failures, server.respawn_at), (0, 0))
+
+        server.spawned[11] = now - server.max_respawn_delay - 1
+        server.exited(11, signal.SIGSEGV)  # after running for a while.
+        self.assertEqual(server.failures, 1)
+
+
+class TestCasePreforkServer(unittest.TestCase):
+
+    def start(self, *options):
+        listener = listen()
+        self.port = listener.getsockname()[1]
+        listener.close()
+
+        here = os.path.dirname(os.path.abspath(__file__))
+        environ = dict(os.environ, PYTHONPATH = os.pathsep.join(
+            [os.path.dirname(here), here] + sys.path))
+        self.process = subprocess.Popen([sys.executable, '-m', 'tackle.server',
+            'test_server:application', '--bind', '127.0.0.1:%d' % self.port,
+            '--threads', '2'] + list(options), env = environ,
+            stderr = open(os.devnull, 'w'))
+
+        deadline = time.time() + 10
+        while True:
+            try:
+                return fetch(self.port)
+            except (urllib2.URLError, socket.error):
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def tearDown(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+        self.assertEqual(self.process.wait(), 0)
+
+    def pids(self, count = 12):
+        return set(fetch(self.port) for i in range(count))
+
+    def testWorkersRecycled(self):
+        self.start('--workers', '2', '--max-requests', '2')
+        self.assertTrue(len(self.pids()) > 2)
+
+    def testReloadReplacesWorkers(self):
+        self.start('--workers', '2')
+        before = self.pids()
+        self.assertTrue(str(self.process.pid) not in before)
+
+        self.process.send_signal(signal.SIGHUP)
+        deadline = time.time() + 10
+        while self.pids() & before:
+            self.assertTrue(time.time() < deadline)
+            time.sleep(0.2)
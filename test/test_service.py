@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+import time
+import unittest
+import threading
+
+from tackle import WSGIService, LazyHostApplication
+from runner import TestApp
+
+
+def site(name):
+    def application(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [name]
+    return application
+
+
+class TestCaseHostRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.service = WSGIService(
+            ('www.example.com', site('www')),
+            ('*.example.com', site('any')),
+            ('*.eu.example.com', site('eu')))
+        self.application = TestApp(self.service)
+
+    def get(self, host, **kwargs):
+        return self.application.get('/', extra_environ = {'HTTP_HOST': host}, **kwargs)
+
+    def testExactBeforeWildcard(self):
+        self.assertEqual(self.get('www.example.com:8080').body, 'www')
+        self.assertEqual(self.get('WWW.Example.com').body, 'www')
+        self.assertEqual(self.get('www.example.com.').body, 'www')
+        self.assertEqual(self.get('shop.eu.example.com.:80').body, 'eu')
+
+    def testLongestWildcard(self):
+        self.assertEqual(self.get('shop.example.com').body, 'any')
+        self.assertEqual(self.get('a.b.example.com').body, 'any')
+        self.assertEqual(self.get('shop.eu.example.com').body, 'eu')
+        self.assertEqual(self.get('eu.example.com').body, 'any')
+
+    def testDefault(self):
+        self.get('example.com', status = 503)
+        self.get('other.org', status = 503)
+        self.service.register(site('default'), '*')
+        self.assertEqual(self.get('other.org').body, 'default')
+
+
+class TestCaseLazyHostApplication(unittest.TestCase):
+
+    def testCreatedOnDemandAndUnloaded(self):
+        created = []
+        def factory(hostname):
+            created.append(hostname)
+            return site(hostname.split('.')[0])
+
+        lazy = LazyHostApplication(factory, max_loaded = 2)
+        application = TestApp(WSGIService(('*.tenants.example.com', lazy)))
+        for tenant in ('a', 'a', 'b', 'a', 'c', 'b'):
+            resp = application.get('/', extra_environ = {
+                'HTTP_HOST': '%s.tenants.example.com' % tenant})
+            self.assertEqual(resp.body, tenant)
+
+        self.assertEqual(created, ['a.tenants.example.com',
+            'b.tenants.example.com', 'c.tenants.example.com',
+            'b.tenants.example.com'])
+        self.assertEqual(len(lazy.loaded), 2)
+
+    def testHostsCreatedConcurrently(self):
+        created = []
+        def factory(hostname):
+            created.append(hostname)
+            time.sleep(0.2)
+            return site(hostname)
+
+        lazy = LazyHostApplication(factory)
+        threads = [threading.Thread(target = lazy.application, args = (name,))
+                   for name in ('a.example.com', 'b.example.com') * 3]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(time.time() - started < 0.35)
+        self.assertEqual(sorted(created), ['a.example.com', 'b.example.com'])
+        self.assertEqual(lazy.loading, {})
+
+        application = TestApp(lazy)
+        resp = application.get('/', extra_environ = {'HTTP_HOST': 'a.example.com.'})
+        self.assertEqual(resp.body, 'a.example.com')
+        self.assertEqual(len(created), 2)
@@ -0,0 +1,304 @@
+#!/usr/bin/python
+
+import os
+import gzip
+import shutil
+import hashlib
+import unittest
+import tempfile
+
+from StringIO import StringIO
+
+from tackle import WSGIApplication, StaticFileMiddleware
+from tackle import wsgi, precompress
+from runner import ApplicationTestCase, TestApp
+
+
+static_dir = tempfile.mkdtemp(prefix = 'tackle-static-')
+content = ''.join(chr(i % 256) for i in range(5000))
+
+with open(os.path.join(static_dir, 'data.txt'), 'wb') as stream:
+    stream.write(content)
+
+with open(os.path.join(static_dir, 'site.css'), 'wb') as stream:
+    stream.write('body { color: black; }')
+
+
+static = StaticFileMiddleware(static_dir, '/static/')
+app = static.wsgi(WSGIApplication())
+
+
+class TestCaseStaticFiles(ApplicationTestCase(app)):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(static_dir, ignore_errors = True)
+
+    def testWholeFile(self):
+        resp = self.application.get('/static/site.css', status = 200)
+        self.assertResponseContentType(resp, 'text/css')
+        self.assertResponseBodyIs(resp, 'body { color: black; }')
+        self.assertEqual(resp.content_length, 22)
+        self.assertEqual(resp.headers['Accept-Ranges'], 'bytes')
+
+    def testMissingFile(self):
+        self.application.get('/static/missing.css', status = 404)
+
+    def testRange(self):
+        resp = self.application.get('/static/data.txt',
+            headers = {'Range': 'bytes=100-199'}, status = 206)
+        self.assertEqual(resp.body, content[100:200])
+        self.assertEqual(resp.headers['Content-Range'], 'bytes 100-199/5000')
+        self.assertEqual(resp.content_length, 100)
+
+    def testSuffixRange(self):
+        resp = self.application.get('/static/data.txt',
+            headers = {'Range': 'bytes=-10'}, status = 206)
+        self.assertEqual(resp.body, content[-10:])
+
+    def testUnsatisfiableRange(self):
+        resp = self.application.get('/static/data.txt',
+            headers = {'Range': 'bytes=6000-'}, status = 416)
+        self.assertEqual(resp.headers['Content-Range'], 'bytes */5000')
+
+    def testIfRangeMismatchServesWholeFile(self):
+        resp = self.application.get('/static/data.txt', headers = {
+            'Range': 'bytes=0-9',
+            'If-Range': 'Thu, 01 Jan 1970 00:00:00 GMT' }, status = 200)
+        self.assertEqual(len(resp.body), 5000)
+
+    def testIfRangeMatch(self):
+        modified = self.application.get('/static/data.txt').headers['Last-Modified']
+        resp = self.application.get('/static/data.txt', headers = {
+            'Range': 'bytes=0-9', 'If-Range': modified }, status = 206)
+        self.assertEqual(resp.body, content[:10])
+
+    def testMappedRange(self):
+        threshold, wsgi.MMAP_THRESHOLD = wsgi.MMAP_THRESHOLD, 1
+        try:
+            resp = self.application.get('/static/data.txt',
+                headers = {'Range': 'bytes=1000-'}, status = 206)
+            self.assertEqual(resp.body, content[1000:])
+        finally:
+            wsgi.MMAP_THRESHOLD = threshold
+
+    def testNotModifiedByETag(self):
+        etag = self.application.get('/static/site.css').headers['ETag']
+        resp = self.application.get('/static/site.css',
+            headers = {'If-None-Match': 'W/"other", ' + etag}, status = 304)
+        self.assertEqual(resp.headers['ETag'], etag)
+        self.assertEqual(resp.body, '')
+
+    def testModifiedETag(self):
+        self.application.get('/static/site.css',
+            headers = {'If-None-Match': '"other"'}, status = 200)
+
+    def testNotModifiedSince(self):
+        modified = self.application.get('/static/site.css').headers['Last-Modified']
+        self.application.get('/static/site.css',
+            headers = {'If-Modified-Since': modified}, status = 304)
+        self.application.get('/static/site.css',
+            headers = {'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'},
+            status = 200)
+
+    def testContentHashETag(self):
+        hashed = StaticFileMiddleware(static_dir, '/static/', etag_hash = True)
+        resp = TestApp(hashed.wsgi(WSGIApplication())).get('/static/site.css')
+        self.assertEqual(resp.headers['ETag'],
+            '"%s"' % hashlib.md5('body { color: black; }').hexdigest())
+
+
+class LegacyRules(StaticFileMiddleware):
+    match_content_types = [(r'\.txt$', 'text/x-legacy', 60)]
+
+
+class ExtendedRules(StaticFileMiddleware):
+    match_content_types = StaticFileMiddleware.match_content_types + [
+        (r'\.md$', 'text/markdown', 120)]
+
+
+class TestCaseContentTypes(unittest.TestCase):
+
+    def testTable(self):
+        self.assertEqual(static.get_headers('a/b.CSS'), [
+            ('Content-Type', 'text/css'), ('Cache-Control', 'max-age=3600')])
+        self.assertEqual(static.get_headers('a/b.unknown'), [])
+
+    def testSubclassRulesHonoured(self):
+        legacy = LegacyRules(static_dir, '/static/')
+        self.assertEqual(legacy.get_headers('notes.txt'), [
+            ('Content-Type', 'text/x-legacy'), ('Cache-Control', 'max-age=60')])
+        self.assertEqual(LegacyRules.cache_life('notes.txt'), 60)
+        self.assertEqual(legacy.get_headers('site.css')[0], ('Content-Type', 'text/css'))
+        resp = TestApp(legacy.wsgi(WSGIApplication())).get('/static/data.txt')
+        self.assertEqual(resp.content_type, 'text/x-legacy')
+
+    def testSubclassRulesExtended(self):
+        extended = ExtendedRules(static_dir, '/static/')
+        self.assertEqual(extended.get_headers('README.md'), [
+            ('Content-Type', 'text/markdown'), ('Cache-Control', 'max-age=120')])
+        self.assertEqual(extended.get_headers('notes.txt'), [
+            ('Content-Type', 'text/plain'), ('Cache-Control', 'max-age=600')])
+        self.assertEqual(ExtendedRules.cache_life('README.md'), 120)
+
+
+class TestCaseStaticMemoryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix = 'tackle-static-')
+        self.filename = os.path.join(self.directory, 'app.js')
+        self.write('var a = 1;', 1000000000)
+        self.static = StaticFileMiddleware(self.directory, '/static/',
+            memory_cache_size = 1024, memory_check_interval = 0)
+        self.application = TestApp(self.static.wsgi(WSGIApplication()))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+    def write(self, content, mtime):
+        with open(self.filename, 'wb') as stream:
+            stream.write(content)
+        os.utime(self.filename, (mtime, mtime))
+
+    def testServedFromMemory(self):
+        for i in range(3):
+            resp = self.application.get('/static/app.js', status = 200)
+            self.assertEqual(resp.body, 'var a = 1;')
+        stats = self.static.memory_stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['resident_bytes'], len('var a = 1;'))
+
+    def testRangeFromMemory(self):
+        self.application.get('/static/app.js')
+        resp = self.application.get('/static/app.js',
+            headers = {'Range': 'bytes=4-4'}, status = 206)
+        self.assertEqual(resp.body, 'a')
+
+    def testChangedFileReloaded(self):
+        self.application.get('/static/app.js')
+        self.write('var a = 2;', 1000000100)
+        resp = self.application.get('/static/app.js', status = 200)
+        self.assertEqual(resp.body, 'var a = 2;')
+
+
+class TestCaseStaticCompression(unittest.TestCase):
+    """ WebTest decodes compressed responses, so these call the WSGI
+        application directly. """
+
+    content = 'body { color: black; }\n' * 100
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix = 'tackle-static-')
+        for name in ('site.css', 'plain.css'):
+            with open(os.path.join(self.directory, name), 'wb') as stream:
+                stream.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+    def request(self, path, accept_encoding = None, **options):
+        static = StaticFileMiddleware(self.directory, '/static/', **options)
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}
+        if accept_encoding is not None:
+            environ['HTTP_ACCEPT_ENCODING'] = accept_encoding
+        response = []
+        body = static.wsgi(WSGIApplication())(environ,
+            lambda status, headers: response.extend((status, dict(headers))))
+        return response[0], response[1], ''.join(body)
+
+    def decompress(self, body):
+        return gzip.GzipFile(fileobj = StringIO(body)).read()
+
+    def testPrecompressedSibling(self):
+        written = precompress.precompress(self.directory, workers = 2)
+        self.assertIn(os.path.join(self.directory, 'site.css.gz'), written)
+
+        status, headers, body = self.request('/static/site.css',
+            'gzip, deflate', precompressed = True)
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(headers['Content-Length'], str(len(body)))
+        self.assertEqual(self.decompress(body), self.content)
+
+        status, headers, body = self.request('/static/site.css',
+            precompressed = True)
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(body, self.content)
+
+    def testStaleVariantNotServedFromMemory(self):
+        precompress.precompress(self.directory, workers = 1)
+        static = StaticFileMiddleware(self.directory, '/static/',
+            precompressed = True, memory_cache_size = 1 << 20,
+            memory_check_interval = 0)
+        app = static.wsgi(WSGIApplication())
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/static/site.css',
+                   'HTTP_ACCEPT_ENCODING': 'gzip'}
+        def request():
+            response = []
+            body = ''.join(app(dict(environ),
+                lambda status, headers: response.append(dict(headers))))
+            return response[0], body
+
+        self.assertEqual(request()[0]['Content-Encoding'], 'gzip')
+        filename = os.path.join(self.directory, 'site.css')
+        with open(filename, 'wb') as stream:
+            stream.write('changed')
+        mtime = os.stat(filename + '.gz').st_mtime + 10
+        os.utime(filename, (mtime, mtime))  # the .gz sibling is now stale.
+
+        headers, body = request()
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(body, 'changed')
+
+    def testCompressedOnTheFly(self):
+        status, headers, body = self.request('/static/plain.css',
+            'gzip', compress = True)
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertTrue(headers['ETag'].endswith('-gzip"'))
+        self.assertEqual(self.decompress(body), self.content)
+
+        status, headers, body = self.request('/static/plain.css',
+            'gzip;q=0', compress = True)
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(body, self.content)
+
+
+class TestCaseStaticManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix = 'tackle-static-')
+        self.outside = tempfile.mkdtemp(prefix = 'tackle-outside-')
+        os.mkdir(os.path.join(self.directory, 'img'))
+        self.write(self.directory, 'img/logo.svg', '<svg/>')
+        self.write(self.outside, 'secret.txt', 'secret')
+        os.symlink(os.path.join(self.outside, 'secret.txt'),
+            os.path.join(self.directory, 'secret.txt'))
+
+        self.static = StaticFileMiddleware(self.directory, '/static/',
+            manifest = True)
+        self.application = TestApp(self.static.wsgi(WSGIApplication()))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors = True)
+        shutil.rmtree(self.outside, ignore_errors = True)
+
+    def write(self, directory, name, content):
+        with open(os.path.join(directory, name), 'wb') as stream:
+            stream.write(content)
+
+    def testServedFromManifest(self):
+        resp = self.application.get('/static/img/logo.svg', status = 200)
+        self.assertEqual(resp.content_type, 'image/svg+xml')
+        self.assertEqual(resp.body, '<svg/>')
+
+    def testOutsidePathsExcluded(self):
+        self.application.get('/static/secret.txt', status = 404)
+        self.application.get('/static/../img/logo.svg', status = 404)
+        self.application.get('/img/logo.svg', status = 404)
+
+    def testReload(self):
+        self.write(self.directory, 'new.js', 'var b;')
+        self.application.get('/static/new.js', status = 404)
+        self.static.reload()
+        resp = self.application.get('/static/new.js', status = 200)
+        self.assertEqual(resp.content_type, 'text/javascript')
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+
+import time
+import unittest
+import threading
+
+from tackle.util import cached_property, slot_cached_property
+
+
+class Counted(object):
+
+    calls = 0
+
+    @cached_property
+    def value(self):
+        Counted.calls += 1
+        return object()
+
+
+class Slotted(object):
+
+    __slots__ = ('calls', '_value')
+
+    def __init__(self):
+        self.calls = 0
+
+    @slot_cached_property
+    def value(self):
+        self.calls += 1
+        return [self.calls]
+
+
+class SlowSlotted(object):
+
+    __slots__ = ('_value',)
+
+    @slot_cached_property
+    def value(self):
+        time.sleep(0.01)  # let the threads race.
+        return object()
+
+
+class TestCaseCachedProperty(unittest.TestCase):
+
+    def testComputedOnce(self):
+        Counted.calls = 0
+        instance = Counted()
+        self.assertIs(instance.value, instance.value)
+        self.assertEqual(Counted.calls, 1)
+        self.assertIn('value', instance.__dict__)
+
+    def testThreadsAgreeOnValue(self):
+        instance, seen = Counted(), []
+        threads = [threading.Thread(target = lambda: seen.append(instance.value))
+                   for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(map(id, seen))), 1)
+
+    def testThreadsAgreeOnSlotValue(self):
+        instance, seen = SlowSlotted(), []
+        threads = [threading.Thread(target = lambda: seen.append(instance.value))
+                   for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(map(id, seen))), 1)
+        self.assertIs(seen[0], instance.value)
+
+    def testSlots(self):
+        instance = Slotted()
+        self.assertEqual(instance.value, [1])
+        self.assertIs(instance.value, instance.value)
+        self.assertEqual(instance.calls, 1)
+        self.assertIsInstance(Slotted.value, slot_cached_property)
+
+    def testMissingSlot(self):
+        class Unslotted(object):
+            __slots__ = ()
+            value = slot_cached_property(lambda self: 1, '_missing')
+        self.assertRaises(AttributeError, getattr, Unslotted(), 'value')